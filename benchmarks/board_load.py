@@ -0,0 +1,150 @@
+"""
+Sprint board load benchmark.
+
+Grows a scratch SQLite database through several sizes by adding
+background users' epics, stories, tasks, schedules and work, and
+times the sprint board for one user whose own board never changes.
+With the indexes from noscrum.db in place the board time should
+stay flat while the total row count grows by orders of magnitude.
+
+    python benchmarks/board_load.py --scales 10000 100000 1000000
+    python benchmarks/board_load.py --drop-indexes  # for comparison
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark-secret-key-benchmark-secret')
+
+import noscrum  # noqa: E402 pylint: disable=wrong-import-position
+from noscrum.db import (  # noqa: E402 pylint: disable=wrong-import-position
+    get_db, upgrade_schema, User, Epic, Story, Task, Sprint, ScheduleTask, Work
+)
+
+BOARD_TASKS = 40
+BOARD_SCHEDULES = 30
+BOARD_WORK = 100
+TASKS_PER_USER = 500
+SPRINT_START = date(2022, 1, 3)
+CHUNK = 20000
+
+
+def insert_rows(connection, table, rows):
+    """
+    Insert a list of row dicts in executemany chunks
+    """
+    for start in range(0, len(rows), CHUNK):
+        connection.execute(table.insert(), rows[start:start + CHUNK])
+
+
+def add_user(connection, user_id, task_count, work_per_task, sched_per_task, rng):
+    """
+    Populate one user with a single epic/sprint and task_count tasks
+    spread over ten stories, plus their schedules and work rows.
+    Returns the id of the user's sprint.
+    """
+    insert_rows(connection, User.__table__, [{
+        'id': user_id, 'username': f'bench{user_id}', 'password': '', 'active': True}])
+    epic_id = connection.execute(Epic.__table__.insert(), {
+        'epic': f'Epic {user_id}', 'color': 'red', 'user_id': user_id}).inserted_primary_key[0]
+    sprint_id = connection.execute(Sprint.__table__.insert(), {
+        'start_date': SPRINT_START, 'end_date': SPRINT_START + timedelta(6),
+        'user_id': user_id}).inserted_primary_key[0]
+    story_ids = [connection.execute(Story.__table__.insert(), {
+        'story': f'Story {user_id}.{i}', 'epic_id': epic_id,
+        'user_id': user_id}).inserted_primary_key[0] for i in range(10)]
+    first_task = connection.execute('SELECT coalesce(max(id),0) + 1 FROM task').scalar()
+    insert_rows(connection, Task.__table__, [{
+        'id': first_task + i, 'task': f'Task {user_id}.{i}',
+        'story_id': story_ids[i % len(story_ids)],
+        'sprint_id': sprint_id if i < BOARD_TASKS else None,
+        'estimate': rng.randint(1, 8), 'status': 'To-Do', 'user_id': user_id}
+        for i in range(task_count)])
+    task_ids = range(first_task, first_task + task_count)
+    insert_rows(connection, Work.__table__, [{
+        'task_id': rng.choice(task_ids), 'user_id': user_id, 'hours_worked': 1,
+        'work_date': SPRINT_START + timedelta(rng.randint(-700, 6)), 'status': 'To-Do'}
+        for _ in range(int(task_count * work_per_task))])
+    insert_rows(connection, ScheduleTask.__table__, [{
+        'task_id': rng.choice(task_ids), 'sprint_id': sprint_id, 'user_id': user_id,
+        'sprint_day': SPRINT_START + timedelta(i % 7), 'sprint_hour': 9 + 2 * (i // 7 % 7)}
+        for i in range(int(task_count * sched_per_task))])
+    return sprint_id
+
+
+def time_board(app, user_id, sprint_id, repeat):
+    """
+    Render the user's sprint board repeat times, return timings in ms
+    """
+    client = app.test_client()
+    timings = []
+    with app.app_context(), patch('flask_login.utils._get_user') as current_user:
+        current_user.return_value = User.query.get(user_id)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = client.get(f'/sprint/{sprint_id}')
+            timings.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 200, response.status_code
+    return timings
+
+
+def main():
+    """
+    Run the benchmark across the requested database sizes
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='background task counts to grow the database through')
+    parser.add_argument('--repeat', type=int, default=20, help='board renders per scale')
+    parser.add_argument('--drop-indexes', action='store_true',
+                        help='run without the model indexes, as a baseline')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='noscrum-bench-')
+    app = noscrum.create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(workdir, 'bench.sqlite')}",
+        'TESTING': True})
+    with app.app_context():
+        app_db = get_db()
+        app_db.create_all()
+        upgrade_schema(app_db)
+        engine = app_db.engine
+        if args.drop_indexes:
+            for table in app_db.Model.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.drop(bind=engine)
+        with engine.begin() as connection:
+            sprint_id = add_user(connection, 1, BOARD_TASKS + 20,
+                                 BOARD_WORK / (BOARD_TASKS + 20),
+                                 BOARD_SCHEDULES / (BOARD_TASKS + 20), rng)
+
+    print(f"{'tasks':>10} {'total rows':>12} {'median ms':>10} {'p95 ms':>8}")
+    next_user, background = 2, 0
+    for scale in sorted(args.scales):
+        with app.app_context():
+            engine = get_db().engine
+            with engine.begin() as connection:
+                while background < scale:
+                    add_user(connection, next_user, TASKS_PER_USER, 4, 2, rng)
+                    next_user += 1
+                    background += TASKS_PER_USER
+            engine.execute('ANALYZE')
+            total = sum(engine.execute(f'SELECT count(1) FROM {table}').scalar()
+                        for table in ('epic', 'story', 'task', 'sprint', 'work', 'schedule_task'))
+        time_board(app, 1, sprint_id, 2)
+        timings = sorted(time_board(app, 1, sprint_id, args.repeat))
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        print(f'{background:>10} {total:>12} {statistics.median(timings):>10.2f} {p95:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+Deterministic synthetic data for benchmarks.
+
+Fills users with epics, stories, tasks, weekly sprints (the last
+one running today), schedule_task slots and work rows. The same
+seed, user id and counts always give the same rows, so timings
+from two releases are taken against identical data. Task.actual
+and the per-day work aggregates are kept consistent with the
+generated work.
+
+    python benchmarks/datagen.py bench.sqlite --users 10 --tasks 5000
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark-secret-key-benchmark-secret')
+
+import noscrum  # noqa: E402 pylint: disable=wrong-import-position
+from noscrum.db import (  # noqa: E402 pylint: disable=wrong-import-position
+    get_db, upgrade_schema, User, Epic, Story, Task, Sprint, ScheduleTask, Work
+)
+from noscrum.work_days import rebuild_work_days  # noqa: E402 pylint: disable=wrong-import-position
+
+# Rows per user for each table, scaled together by --tasks
+DEFAULT_COUNTS = {'epics': 5, 'stories': 40, 'tasks': 1000, 'sprints': 26,
+                  'schedules': 800, 'work': 3000}
+# Board hours a schedule slot can take
+SCHEDULE_HOURS = range(8, 18)
+STATUSES = ('To-Do', 'In Progress', 'Done')
+CHUNK = 20000
+
+
+def scale_counts(tasks, **overrides):
+    """
+    Counts for a user with the given number of tasks, the
+    other tables scaled in DEFAULT_COUNTS' proportions
+    @param tasks tasks per user
+    @param overrides exact counts for some tables
+    """
+    ratio = tasks / DEFAULT_COUNTS['tasks']
+    counts = {name: max(1, round(count * ratio)) for name, count in DEFAULT_COUNTS.items()}
+    counts['sprints'] = DEFAULT_COUNTS['sprints']
+    counts.update({name: count for name, count in overrides.items() if count is not None})
+    return counts
+
+
+def next_id(connection, table):
+    """
+    First free id of a table
+    """
+    return connection.execute(f'SELECT coalesce(max(id), 0) + 1 FROM {table}').scalar()
+
+
+def insert_rows(connection, table, rows):
+    """
+    Insert a list of row dicts in executemany chunks
+    """
+    for start in range(0, len(rows), CHUNK):
+        connection.execute(table.insert(), rows[start:start + CHUNK])
+
+
+def generate_user(connection, user_id, counts, seed=1, today=None):
+    """
+    Create one user and its rows. Returns the ids a
+    benchmark needs: user_id, sprint_ids (oldest first,
+    the last is active today) and task_ids
+    @param connection engine connection in a transaction
+    @param user_id id of the user to create
+    @param counts rows per table, see DEFAULT_COUNTS
+    @param seed together with user_id fixes every value
+    @param today date the last sprint runs through
+    """
+    rng = random.Random(f'{seed}:{user_id}')
+    today = today or date.today()
+    insert_rows(connection, User.__table__, [{
+        'id': user_id, 'username': f'bench{user_id}', 'password': '', 'active': True,
+        'first_name': 'Bench', 'last_name': str(user_id)}])
+
+    first_epic = next_id(connection, 'epic')
+    epic_ids = list(range(first_epic, first_epic + counts['epics']))
+    insert_rows(connection, Epic.__table__, [{
+        'id': epic_id, 'epic': f'Epic {user_id}.{i}', 'color': rng.choice(('red', 'blue', 'green')),
+        'deadline': today + timedelta(rng.randint(-30, 180)) if rng.random() < 0.5 else None,
+        'user_id': user_id} for i, epic_id in enumerate(epic_ids)])
+
+    first_story = next_id(connection, 'story')
+    story_ids = list(range(first_story, first_story + counts['stories']))
+    insert_rows(connection, Story.__table__, [{
+        'id': story_id, 'story': f'Story {user_id}.{i}', 'epic_id': epic_ids[i % len(epic_ids)],
+        'prioritization': rng.randint(1, 5), 'user_id': user_id}
+        for i, story_id in enumerate(story_ids)])
+
+    monday = today - timedelta(today.weekday())
+    starts = [monday - timedelta(7 * i) for i in reversed(range(counts['sprints']))]
+    first_sprint = next_id(connection, 'sprint')
+    sprint_ids = list(range(first_sprint, first_sprint + len(starts)))
+    insert_rows(connection, Sprint.__table__, [{
+        'id': sprint_id, 'start_date': start, 'end_date': start + timedelta(6), 'user_id': user_id}
+        for sprint_id, start in zip(sprint_ids, starts)])
+
+    first_task = next_id(connection, 'task')
+    tasks = []
+    for i in range(counts['tasks']):
+        # Two thirds of the tasks are planned, the rest wait in the backlog
+        sprint = rng.randrange(len(sprint_ids)) if rng.random() < 0.67 else None
+        past = sprint is not None and sprint < len(sprint_ids) - 1
+        tasks.append({
+            'id': first_task + i, 'task': f'Task {user_id}.{i}',
+            'story_id': story_ids[rng.randrange(len(story_ids))],
+            'estimate': rng.choice((1, 2, 3, 5, 8, None)),
+            'status': 'Done' if past and rng.random() < 0.85 else rng.choice(STATUSES),
+            'actual': None, 'deadline': None,
+            'sprint_id': sprint_ids[sprint] if sprint is not None else None,
+            'recurring': rng.random() < 0.01, 'user_id': user_id})
+
+    work = []
+    for _ in range(counts['work']):
+        task = tasks[rng.randrange(len(tasks))]
+        work.append({'task_id': task['id'], 'user_id': user_id, 'hours_worked': rng.randint(1, 4),
+                     'work_date': starts[0] + timedelta(rng.randrange((today - starts[0]).days + 1)),
+                     'status': task['status']})
+        task['actual'] = (task['actual'] or 0) + work[-1]['hours_worked']
+    insert_rows(connection, Task.__table__, tasks)
+    insert_rows(connection, Work.__table__, work)
+
+    slots = [(sprint_id, start + timedelta(day), hour)
+             for sprint_id, start in zip(sprint_ids, starts)
+             for day in range(7) for hour in SCHEDULE_HOURS]
+    insert_rows(connection, ScheduleTask.__table__, [{
+        'task_id': tasks[rng.randrange(len(tasks))]['id'], 'sprint_id': sprint_id,
+        'sprint_day': sprint_day, 'sprint_hour': hour, 'user_id': user_id}
+        for sprint_id, sprint_day, hour in rng.sample(slots, min(counts['schedules'], len(slots)))])
+    return {'user_id': user_id, 'sprint_ids': sprint_ids,
+            'task_ids': [task['id'] for task in tasks]}
+
+
+def generate(app_db, users, counts, seed=1, first_user=None):
+    """
+    Generate several users, then refresh the work
+    aggregates and the planner statistics
+    @param app_db database to fill
+    @param users number of users to create
+    @param counts rows per user and table
+    @param seed fixes every generated value
+    @param first_user id of the first user (next free id)
+    """
+    with app_db.engine.begin() as connection:
+        first_user = first_user or next_id(connection, 'user')
+        created = [generate_user(connection, user_id, counts, seed)
+                   for user_id in range(first_user, first_user + users)]
+    rebuild_work_days(app_db)
+    app_db.engine.execute('ANALYZE')
+    return created
+
+
+def main():
+    """
+    Fill a SQLite database file with synthetic users
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('database', help='SQLite file to create or add to')
+    parser.add_argument('--users', type=int, default=1)
+    parser.add_argument('--tasks', type=int, default=DEFAULT_COUNTS['tasks'],
+                        help='tasks per user; other tables scale with it')
+    for name in DEFAULT_COUNTS:
+        if name != 'tasks':
+            parser.add_argument(f'--{name}', type=int, help=f'{name} per user')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    counts = scale_counts(args.tasks, **{name: getattr(args, name) for name in DEFAULT_COUNTS
+                                         if name != 'tasks'})
+    app = noscrum.create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.abspath(args.database)}'})
+    with app.app_context():
+        app_db = get_db()
+        app_db.create_all()
+        upgrade_schema(app_db)
+        created = generate(app_db, args.users, counts, args.seed)
+    print(f"Created users {created[0]['user_id']}-{created[-1]['user_id']} with {counts}")
+
+
+if __name__ == '__main__':
+    main()
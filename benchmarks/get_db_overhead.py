@@ -0,0 +1,76 @@
+"""
+get_db() per-call overhead benchmark.
+
+Almost every controller function calls noscrum.db.get_db(), often
+several times per request. This times the current lookup against the
+asyncio handshake it replaced, which ran a fresh event loop for every
+call (asyncio.run + create_task around the singleton lookup).
+
+    python benchmarks/get_db_overhead.py --calls 20000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark-secret-key-benchmark-secret')
+
+import noscrum  # noqa: E402 pylint: disable=wrong-import-position
+from noscrum import DatabaseSingleton  # noqa: E402 pylint: disable=wrong-import-position
+
+
+async def legacy_get_db_instance():
+    """
+    The old DatabaseSingleton.get_db_instance coroutine
+    """
+    return DatabaseSingleton.get_db_instance()
+
+
+async def legacy_singleton_get_db():
+    """
+    The old DatabaseSingleton.get_db coroutine
+    """
+    instance = await asyncio.create_task(legacy_get_db_instance())
+    return instance.app_db
+
+
+def legacy_get_db():
+    """
+    The old noscrum.db.get_db wrapper
+    """
+    return asyncio.run(legacy_singleton_get_db())
+
+
+def time_per_call(function, calls, repeat):
+    """
+    Best-of-repeat time of one call, in microseconds
+    """
+    best = min(timeit.repeat(function, number=calls, repeat=repeat))
+    return best / calls * 1e6
+
+
+def main():
+    """
+    Time both lookups and print the per-call cost
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--calls', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = noscrum.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:'})
+    from noscrum.db import get_db  # pylint: disable=import-outside-toplevel
+    with app.app_context():
+        assert legacy_get_db() is get_db()
+        legacy = time_per_call(legacy_get_db, max(args.calls // 20, 1), args.repeat)
+        current = time_per_call(get_db, args.calls, args.repeat)
+    print(f'{"lookup":>24} {"us/call":>10}')
+    print(f'{"asyncio.run handshake":>24} {legacy:10.3f}')
+    print(f'{"get_db()":>24} {current:10.3f}')
+    print(f'{"speedup":>24} {legacy / current:9.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Hot route benchmark suite.
+
+For each data scale a fresh SQLite database is filled by datagen
+(one measured user plus background users of the same size) and
+every scenario is requested repeatedly as the measured user. The
+report gives p50/p95 latency, SQL queries per request (from the
+request instrumentation) and the peak Python memory one request
+allocates. Save a run with --json and pass it to --compare on the
+next release to see which routes got slower.
+
+    python benchmarks/scenarios.py --scales 500 2000 10000
+    python benchmarks/scenarios.py --json before.json
+    python benchmarks/scenarios.py --compare before.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+from itertools import count
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+# datagen puts the package on the path and sets a secret key
+from datagen import generate, scale_counts, SCHEDULE_HOURS  # noqa: E402 pylint: disable=wrong-import-position
+import noscrum  # noqa: E402 pylint: disable=wrong-import-position
+from noscrum.db import get_db, User  # noqa: E402 pylint: disable=wrong-import-position
+
+
+def get_scenarios(user):
+    """
+    (name, method, url, form) of each scenario; url and
+    form are called with the request number, so writes
+    go to different tasks and slots
+    @param user ids from datagen.generate_user
+    """
+    sprint_id = user['sprint_ids'][-1]
+    task_ids = user['task_ids']
+    today = date.today()
+    return [
+        ('sprint.show', 'GET', lambda i: f'/sprint/{sprint_id}', None),
+        ('sprint.active', 'GET', lambda i: '/sprint/active', None),
+        ('task.list_all', 'GET', lambda i: '/task/', None),
+        ('story.list_all', 'GET', lambda i: '/story/', None),
+        ('sprint.schedule POST', 'POST', lambda i: f'/sprint/schedule/{sprint_id}?is_json=1',
+         lambda i: {'task_id': task_ids[i % len(task_ids)], 'sprint_day': str(today),
+                    'sprint_hour': SCHEDULE_HOURS[i % len(SCHEDULE_HOURS)]}),
+        ('work.create', 'POST', lambda i: f'/work/create/{task_ids[i % len(task_ids)]}?is_json=1',
+         lambda i: {'work_date': str(today), 'hours_worked': 1}),
+    ]
+
+
+def run_scenario(app, client, scenario, repeat, numbers):
+    """
+    Time one scenario. Returns its latencies in ms, the
+    queries of its last request and the peak memory of
+    one extra request traced by tracemalloc
+    """
+    _, method, url, form = scenario
+    timings = []
+    for _ in range(repeat + 1):
+        i = next(numbers)
+        start = time.perf_counter()
+        response = client.open(url(i), method=method, data=form(i) if form else None)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, (scenario[0], response.status_code)
+    queries = app.extensions['noscrum_instrument'][-1]['queries']
+    i = next(numbers)
+    tracemalloc.start()
+    client.open(url(i), method=method, data=form(i) if form else None)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    # The first request warms caches (rollups, templates) and is left out
+    return timings[1:], queries, peak
+
+
+def run_scale(tasks, users, repeat, seed):
+    """
+    Build a database at one scale and run every scenario
+    @param tasks tasks per user
+    @param users background users besides the measured one
+    @param repeat timed requests per scenario
+    @param seed data generator seed
+    """
+    workdir = tempfile.mkdtemp(prefix='noscrum-bench-')
+    app = noscrum.create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(workdir, 'bench.sqlite')}",
+        'TESTING': True})
+    with app.app_context():
+        measured, *_ = generate(get_db(), users + 1, scale_counts(tasks), seed)
+    results = []
+    with app.app_context(), patch('flask_login.utils._get_user') as current_user:
+        client = app.test_client()
+        numbers = count()
+        for scenario in get_scenarios(measured):
+            # Writes bump data_version, so load the user afresh for each scenario
+            current_user.return_value = User.query.get(measured['user_id'])
+            timings, queries, peak = run_scenario(app, client, scenario, repeat, numbers)
+            timings.sort()
+            results.append({'tasks': tasks, 'scenario': scenario[0],
+                            'p50_ms': round(statistics.median(timings), 2),
+                            'p95_ms': round(timings[min(len(timings) - 1,
+                                                        int(len(timings) * 0.95))], 2),
+                            'queries': queries, 'peak_kib': round(peak / 1024)})
+    return results
+
+
+def print_report(results, baseline=None):
+    """
+    Print the results table, with the change in p50
+    against a saved run when one is given
+    """
+    before = {(x['tasks'], x['scenario']): x for x in baseline or []}
+    print(f"{'tasks':>7} {'scenario':<22} {'p50 ms':>8} {'p95 ms':>8} " +
+          f"{'queries':>7} {'peak KiB':>9}" + (f" {'p50 vs':>8}" if baseline else ''))
+    for result in results:
+        line = (f"{result['tasks']:>7} {result['scenario']:<22} {result['p50_ms']:>8.2f} " +
+                f"{result['p95_ms']:>8.2f} {result['queries']:>7} {result['peak_kib']:>9}")
+        old = before.get((result['tasks'], result['scenario']))
+        if old:
+            line += f" {(result['p50_ms'] / old['p50_ms'] - 1) * 100:>+7.0f}%"
+        print(line)
+
+
+def main():
+    """
+    Run the scenarios across the requested data scales
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[500, 2000, 10000],
+                        help='tasks per user at each scale')
+    parser.add_argument('--users', type=int, default=4,
+                        help='background users sharing the database')
+    parser.add_argument('--repeat', type=int, default=30, help='timed requests per scenario')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='save the results to this file')
+    parser.add_argument('--compare', help='results file of an earlier run')
+    args = parser.parse_args()
+
+    results = []
+    for tasks in sorted(args.scales):
+        results.extend(run_scale(tasks, args.users, args.repeat, args.seed))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as saved:
+            baseline = json.load(saved)
+    print_report(results, baseline)
+    if args.json:
+        with open(args.json, 'w') as saved:
+            json.dump(results, saved, indent=1)
+
+
+if __name__ == '__main__':
+    main()
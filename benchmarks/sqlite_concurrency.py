@@ -0,0 +1,129 @@
+"""
+Concurrent board reads against work logging, per SQLite profile.
+
+Mimics a multi-worker deployment: reader processes render the
+sprint board while writer processes log work (each log is a
+commit) against the same database file. The run is repeated for
+each storage profile on its own copy of the generated data. With
+the rollback journal, every commit locks readers out; with the
+production profile's WAL they keep reading.
+
+    python benchmarks/sqlite_concurrency.py --readers 4 --writers 2 --seconds 10
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+# datagen puts the package on the path and sets a secret key
+from datagen import generate, scale_counts  # noqa: E402 pylint: disable=wrong-import-position
+import noscrum  # noqa: E402 pylint: disable=wrong-import-position
+from noscrum.db import get_db, User  # noqa: E402 pylint: disable=wrong-import-position
+from noscrum.storage import SQLITE_PROFILES  # noqa: E402 pylint: disable=wrong-import-position
+
+
+def make_app(database, profile):
+    """
+    App of one worker process on the shared database file
+    """
+    return noscrum.create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database}',
+                               'SQLITE_PROFILE': profile, 'INSTRUMENT_REQUESTS': False,
+                               'TESTING': True})
+
+
+def worker(role, number, database, profile, user, start_at, seconds, results):
+    """
+    Read the board or log work until the time is up, then
+    report latencies in ms and the number of failed requests
+    """
+    app = make_app(database, profile)
+    sprint_id = user['sprint_ids'][-1]
+    task_ids = user['task_ids'][number::8]
+    timings, errors = [], 0
+    with app.app_context(), patch('flask_login.utils._get_user') as current_user:
+        current_user.return_value = User.query.get(user['user_id'])
+        client = app.test_client()
+        time.sleep(max(0, start_at - time.time()))
+        i = 0
+        while time.time() < start_at + seconds:
+            start = time.perf_counter()
+            try:
+                if role == 'read':
+                    response = client.get(f'/sprint/{sprint_id}')
+                else:
+                    response = client.post(f'/work/create/{task_ids[i % len(task_ids)]}?is_json=1',
+                                           data={'work_date': str(date.today()), 'hours_worked': 1})
+                ok = response.status_code == 200
+            except Exception:  # pylint: disable=broad-except
+                ok = False
+                get_db().session.rollback()
+            timings.append((time.perf_counter() - start) * 1000)
+            errors += not ok
+            i += 1
+    results.put((role, timings, errors))
+
+
+def run_profile(profile, args):
+    """
+    Generate data, run the workers and summarise by role
+    """
+    database = os.path.join(tempfile.mkdtemp(prefix='noscrum-bench-'), 'bench.sqlite')
+    app = make_app(database, profile)
+    with app.app_context():
+        user, *_ = generate(get_db(), 1, scale_counts(args.tasks), args.seed)
+        get_db().engine.dispose()
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    start_at = time.time() + args.warmup
+    processes = [context.Process(target=worker, args=(
+        role, number, database, profile, user, start_at, args.seconds, results))
+        for role, count in (('read', args.readers), ('write', args.writers))
+        for number in range(count)]
+    for process in processes:
+        process.start()
+    summary = {'read': ([], 0), 'write': ([], 0)}
+    for _ in processes:
+        role, timings, errors = results.get()
+        summary[role] = (summary[role][0] + timings, summary[role][1] + errors)
+    for process in processes:
+        process.join()
+    for role, (timings, errors) in summary.items():
+        if not timings:
+            continue
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        print(f'{profile:<11} {role:<6} {len(timings) / args.seconds:>8.1f} ' +
+              f'{statistics.median(timings):>8.2f} {p95:>8.2f} {timings[-1]:>8.2f} {errors:>7}')
+
+
+def main():
+    """
+    Run the concurrent workload under each profile
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--profiles', nargs='+', default=['default', 'production'],
+                        choices=sorted(SQLITE_PROFILES))
+    parser.add_argument('--readers', type=int, default=4, help='board reading processes')
+    parser.add_argument('--writers', type=int, default=2, help='work logging processes')
+    parser.add_argument('--seconds', type=float, default=10, help='length of each run')
+    parser.add_argument('--warmup', type=float, default=5,
+                        help='seconds for the workers to start before the run')
+    parser.add_argument('--tasks', type=int, default=2000, help='tasks of the board user')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'profile':<11} {'role':<6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} " +
+          f"{'max ms':>8} {'errors':>7}")
+    for profile in args.profiles:
+        run_profile(profile, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,12 +4,11 @@ See README.md for full details.
 """
 import os
 
-import time
-from asyncio import create_task
 from dotenv import load_dotenv
 from flask import Flask
 from flask_babelex import Babel
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
 from flask_user import UserManager
 from flask_foundation import Foundation
 
@@ -46,34 +45,74 @@ class DatabaseSingleton():
         return DatabaseSingleton.__instance
 
     @staticmethod
-    async def get_db_instance():
+    def get_db_instance():
         """
-        Get instance of the Singleton class. Waits
-        until instance has been created via method
-        DatabaseSingleton.create_singleton(d_base)
+        Get instance of the Singleton class. It is
+        made by DatabaseSingleton.create_singleton
+        in create_app before any model is imported
         """
-        while DatabaseSingleton.__instance is None:
-            # Forgive me father for I have sinned
-            time.sleep(1)
+        if DatabaseSingleton.__instance is None:
+            raise RuntimeError('Database used before create_app() set it up')
         return DatabaseSingleton.__instance
 
     @staticmethod
-    async def get_db():
+    def get_db():
         """
         Returns the app database instance used for
-        the application controller modules. It can
-        wait for the DatabaseSingleton instance to
-        Initialize just like get_db_instance() can
+        the application controller modules. One
+        SQLAlchemy object serves every app created
+        by create_app, bound to each by init_app()
         """
-        instance = await create_task(DatabaseSingleton.get_db_instance())
-        return instance.app_db
+        return DatabaseSingleton.get_db_instance().app_db
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session that lets an app send statements to other
+    databases than its own. The callable in
+    app.extensions['noscrum_router'] is given the mapper
+    and statement and returns the engine to use, or None
+    for the app's database (see noscrum.sharding)
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        router = self.app.extensions.get('noscrum_router')
+        engine = router(mapper, clause) if router is not None else None
+        if engine is not None:
+            return engine
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy with RoutingSession sessions
+    """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
 
 
 class ConfigClass():
     """Flask application config"""
     SECRET_KEY = os.environ.get('FLASK_SECRET_KEY')
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///noscrum.sqlite'
+    SQLALCHEMY_DATABASE_URI = os.environ.get('NOSCRUM_DATABASE_URI', 'sqlite:///noscrum.sqlite')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Pragma profile of SQLite connections, see noscrum.storage
+    SQLITE_PROFILE = os.environ.get('NOSCRUM_SQLITE_PROFILE', 'production')
+    DB_POOL_SIZE = int(os.environ.get('NOSCRUM_DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('NOSCRUM_DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = int(os.environ.get('NOSCRUM_DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.environ.get('NOSCRUM_DB_POOL_RECYCLE', 3600))
+    # Database of each user's planning data, eg
+    # sqlite:////var/lib/noscrum/shards/user_{user_id}.sqlite,
+    # see noscrum.sharding. Unset keeps all of it in the one above
+    SHARD_DATABASE_URI = os.environ.get('NOSCRUM_SHARD_DATABASE_URI')
+    SHARD_POOL_SIZE = int(os.environ.get('NOSCRUM_SHARD_POOL_SIZE', 2))
+    # Most shard engines kept open at once by a process
+    SHARD_ENGINE_LIMIT = int(os.environ.get('NOSCRUM_SHARD_ENGINE_LIMIT', 64))
+    # Users whose forecasts a process keeps, see noscrum.forecast;
+    # each simulation kept is up to about 21 MB
+    FORECAST_CACHE_USERS = int(os.environ.get('NOSCRUM_FORECAST_CACHE_USERS', 16))
 
     USER_APP_NAME = "NoScrum"
     USER_APP_VERSION = "βeta.1.0"
@@ -130,25 +169,56 @@ def create_app(test_config=None):
 
     # Init SQLAlchemy
 
-    app_db = SQLAlchemy(running_app)
     print("Creating Database")
-    DatabaseSingleton.create_singleton(app_db)
+    from noscrum.storage import get_engine_options, init_storage
+    running_app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                                  get_engine_options(running_app.config))
+    app_db = DatabaseSingleton.create_singleton(RoutingSQLAlchemy()).app_db
+    app_db.init_app(running_app)
+    init_storage(running_app, app_db)
     print("Populating Database")
     from noscrum.db import User, Role, Task, Story, Epic, Tag, TagStory, Sprint, Work, UserRoles, ScheduleTask
-    app_db.create_all()
+    from noscrum.db import RecurringSchedule, SprintRollup, WorkDay
+    from noscrum.db import get_db, upgrade_schema, upgrade_db_command
+    from noscrum.search import install_search, rebuild_search_command
+    from noscrum.work_days import install_work_days, rebuild_work_days_command
+    with running_app.app_context():
+        app_db.create_all()
+        upgrade_schema(get_db())
+        running_app.config['SEARCH_ENABLED'] = install_search(get_db())
+        install_work_days(get_db())
+    running_app.cli.add_command(upgrade_db_command)
+    running_app.cli.add_command(rebuild_work_days_command)
+    from noscrum.sharding import init_sharding, split_shards_command, merge_shards_command
+    init_sharding(running_app)
+    running_app.cli.add_command(split_shards_command)
+    running_app.cli.add_command(merge_shards_command)
 
     # These need app to exist before they can be imported
     UserManager(running_app, app_db, User)
 
-    from noscrum import epic, story, task, sprint, tag, work, user, semi_static
+    from noscrum import epic, story, task, sprint, tag, work, user, semi_static, export, importer, search, events, etag, analytics, instrument
     running_app.register_blueprint(epic.bp)
     running_app.register_blueprint(story.bp)
     running_app.register_blueprint(task.bp)
     running_app.register_blueprint(sprint.bp)
     running_app.register_blueprint(tag.bp)
     running_app.register_blueprint(work.bp)
+    running_app.cli.add_command(work.reconcile_actuals_command)
     running_app.register_blueprint(user.bp)
     running_app.register_blueprint(semi_static.bp)
+    running_app.register_blueprint(export.bp)
+    running_app.cli.add_command(export.export_user_command)
+    running_app.register_blueprint(importer.bp)
+    running_app.cli.add_command(importer.import_user_command)
+    running_app.register_blueprint(search.bp)
+    running_app.cli.add_command(rebuild_search_command)
+    events.init_events(running_app)
+    running_app.register_blueprint(events.bp)
+    etag.init_etag(running_app)
+    running_app.register_blueprint(analytics.bp)
+    instrument.init_instrument(running_app)
+    running_app.register_blueprint(instrument.bp)
 
     return running_app
 
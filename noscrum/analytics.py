@@ -0,0 +1,269 @@
+"""
+Sprint velocity, estimate accuracy and burndown analytics
+
+A user's tasks, work and sprints are loaded with one query
+per table into columns of NumPy arrays; every figure is then
+computed on whole columns rather than row by row.
+"""
+import json
+import numpy as np
+from flask import Blueprint, render_template, request, abort
+from flask_login import current_user
+from flask_user import login_required
+from sqlalchemy import func
+from noscrum.db import get_db, Task, Work, Sprint, Story
+
+bp = Blueprint('analytics', __name__, url_prefix='/analytics')
+
+DEFAULT_WINDOW = 3
+MAX_WINDOW = 52
+
+
+def to_columns(rows, dtypes):
+    """
+    Turn query rows into a dict of NumPy columns
+    None becomes NaN in float and NaT in date columns
+    @param rows result rows of one query
+    @param dtypes (name, dtype) for each selected column
+    """
+    values = list(zip(*rows)) or [()] * len(dtypes)
+    return {name: np.array(column, dtype=dtype)
+            for (name, dtype), column in zip(dtypes, values)}
+
+
+def load_columns(user_id):
+    """
+    Load the user's tasks (with their story and epic),
+    work and sprints as columns; sprints are ordered by
+    start date and missing ids are 0
+    @param user_id owner of the records
+    """
+    app_db = get_db()
+    tasks = app_db.session.query(
+        Task.id, Task.estimate, Task.actual, Task.status == 'Done',
+        func.coalesce(Task.sprint_id, 0), func.coalesce(Task.story_id, 0),
+        func.coalesce(Story.epic_id, 0)
+    ).outerjoin(Story, Story.id == Task.story_id).filter(Task.user_id == user_id)
+    work = app_db.session.query(
+        Work.task_id, Work.work_date, Work.hours_worked
+    ).join(Task, Task.id == Work.task_id).filter(Task.user_id == user_id)
+    sprints = app_db.session.query(
+        Sprint.id, Sprint.start_date, Sprint.end_date
+    ).filter(Sprint.user_id == user_id).order_by(Sprint.start_date, Sprint.id)
+    # Plain result rows: building ORM keyed tuples costs more than the math
+    tasks, work, sprints = (app_db.session.execute(query.statement).fetchall()
+                            for query in (tasks, work, sprints))
+    return {
+        'tasks': to_columns(tasks, (('id', np.int64), ('estimate', float), ('actual', float),
+                                    ('done', bool), ('sprint_id', np.int64),
+                                    ('story_id', np.int64), ('epic_id', np.int64))),
+        'work': to_columns(work, (('task_id', np.int64), ('work_date', 'datetime64[D]'),
+                                  ('hours', float))),
+        'sprints': to_columns(sprints, (('id', np.int64), ('start_date', 'datetime64[D]'),
+                                        ('end_date', 'datetime64[D]'))),
+    }
+
+
+def index_of(keys, values):
+    """
+    Position of each value in keys, -1 where missing
+    @param keys array of unique keys
+    @param values array of values to look up
+    """
+    if len(keys) == 0:
+        return np.full(len(values), -1)
+    order = np.argsort(keys)
+    positions = np.clip(np.searchsorted(keys, values, sorter=order), 0, len(keys) - 1)
+    return np.where(keys[order[positions]] == values, order[positions], -1)
+
+
+def sprint_of_dates(sprints, dates):
+    """
+    Position of the sprint each date falls in, -1 for
+    none. Where sprints overlap the latest started wins;
+    if it has already ended, an earlier sprint still
+    running (the one ending last) takes the date
+    @param sprints sprint columns ordered by start date
+    @param dates datetime64 array
+    """
+    if len(sprints['id']) == 0:
+        return np.full(len(dates), -1)
+    end_date = sprints['end_date']
+    # Per position: the sprint up to it that ends last
+    reach = np.maximum.accumulate(end_date)
+    ends_last = np.maximum.accumulate(
+        np.where(end_date == reach, np.arange(len(end_date)), 0))
+    positions = np.searchsorted(sprints['start_date'], dates, side='right') - 1
+    started = positions >= 0
+    positions = np.maximum(positions, 0)
+    positions = np.where(dates <= end_date[positions], positions, ends_last[positions])
+    return np.where(started & (dates <= end_date[positions]), positions, -1)
+
+
+def rolling_mean(values, window):
+    """
+    Trailing mean over window values, NaN until the
+    window is full
+    @param values 1-D array
+    @param window number of values averaged
+    """
+    values = np.asarray(values, dtype=float)
+    means = np.full(len(values), np.nan)
+    if len(values) >= window:
+        sums = np.cumsum(np.insert(values, 0, 0.0))
+        means[window - 1:] = (sums[window:] - sums[:-window]) / window
+    return means
+
+
+def get_sprint_stats(columns, window):
+    """
+    Per sprint: committed estimate, velocity (estimate of
+    the sprint's Done tasks), hours worked in its dates,
+    the actual/estimate ratio of its Done tasks and the
+    rolling velocity. Arrays follow columns['sprints']
+    @param columns from load_columns
+    @param window sprints in the rolling velocity
+    """
+    tasks, work, sprints = columns['tasks'], columns['work'], columns['sprints']
+    count = len(sprints['id'])
+    task_sprint = index_of(sprints['id'], tasks['sprint_id'])
+    planned = task_sprint >= 0
+    estimate = np.nan_to_num(tasks['estimate'])
+    done = planned & tasks['done']
+    measured = done & (estimate > 0) & ~np.isnan(tasks['actual'])
+    work_sprint = sprint_of_dates(sprints, work['work_date'])
+    dated = work_sprint >= 0
+    velocity = np.bincount(task_sprint[done], estimate[done], minlength=count)
+    measured_estimate = np.bincount(task_sprint[measured], estimate[measured], minlength=count)
+    measured_actual = np.bincount(task_sprint[measured], tasks['actual'][measured],
+                                  minlength=count)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        actual_to_estimate = np.where(measured_estimate > 0,
+                                      measured_actual / measured_estimate, np.nan)
+    return {
+        'committed': np.bincount(task_sprint[planned], estimate[planned], minlength=count),
+        'velocity': velocity,
+        'hours_worked': np.bincount(work_sprint[dated], work['hours'][dated], minlength=count),
+        'actual_to_estimate': actual_to_estimate,
+        'rolling_velocity': rolling_mean(velocity, window),
+    }
+
+
+def get_estimate_accuracy(columns):
+    """
+    How Done tasks' actuals compare with their estimates
+    over the whole history
+    @param columns from load_columns
+    """
+    tasks = columns['tasks']
+    measured = tasks['done'] & (tasks['estimate'] > 0) & ~np.isnan(tasks['actual'])
+    ratios = tasks['actual'][measured] / tasks['estimate'][measured]
+    if len(ratios) == 0:
+        return {'tasks': 0, 'median_ratio': None, 'mean_absolute_error': None,
+                'underestimated': None}
+    return {'tasks': int(len(ratios)),
+            'median_ratio': float(np.median(ratios)),
+            'mean_absolute_error': float(np.mean(np.abs(
+                tasks['actual'][measured] - tasks['estimate'][measured]))),
+            'underestimated': float(np.mean(ratios > 1))}
+
+
+def get_burndown(columns, sprint_id, window):
+    """
+    Daily series for one sprint: hours logged on its tasks
+    each day, burn-up (their running total), remaining
+    scope (committed estimate less burn-up) and the ideal
+    straight line from scope to zero
+    @param columns from load_columns
+    @param sprint_id the sprint to chart
+    @param window days in the rolling daily hours
+    """
+    tasks, work, sprints = columns['tasks'], columns['work'], columns['sprints']
+    position = index_of(sprints['id'], np.array([sprint_id]))[0]
+    if position < 0:
+        return None
+    start, end = sprints['start_date'][position], sprints['end_date'][position]
+    days = np.arange(start, end + np.timedelta64(1, 'D'))
+    in_sprint = tasks['sprint_id'] == sprint_id
+    scope = float(np.nansum(tasks['estimate'][in_sprint]))
+    logged = (np.isin(work['task_id'], tasks['id'][in_sprint]) &
+              (work['work_date'] >= start) & (work['work_date'] <= end))
+    offsets = (work['work_date'][logged] - start).astype(np.int64)
+    daily = np.bincount(offsets, work['hours'][logged], minlength=len(days))
+    burn_up = np.cumsum(daily)
+    return {'days': days,
+            'scope': scope,
+            'daily_hours': daily,
+            'rolling_hours': rolling_mean(daily, window),
+            'burn_up': burn_up,
+            'remaining': np.maximum(scope - burn_up, 0),
+            'ideal': np.linspace(scope, 0, len(days))}
+
+
+def to_list(values):
+    """
+    JSON/template friendly list of an array; NaN -> None
+    @param values NumPy array
+    """
+    if np.issubdtype(values.dtype, np.datetime64):
+        return [str(x) for x in values]
+    return [None if np.isnan(x) else round(float(x), 2) for x in values]
+
+
+def get_window():
+    """
+    Read the rolling window from the request query string
+    """
+    try:
+        window = int(request.args.get('window', DEFAULT_WINDOW))
+    except ValueError:
+        abort(400, 'window must be an integer')
+    return max(1, min(window, MAX_WINDOW))
+
+
+@bp.route('/', methods=('GET',))
+@login_required
+def summary():
+    """
+    Velocity and estimate accuracy of every sprint
+    """
+    is_json = request.args.get('is_json', False)
+    window = get_window()
+    columns = load_columns(current_user.id)
+    stats = {key: to_list(value) for key, value in
+             get_sprint_stats(columns, window).items()}
+    sprints = columns['sprints']
+    rows = [dict({key: value[i] for key, value in stats.items()},
+                 sprint_id=int(sprint_id),
+                 start_date=str(sprints['start_date'][i]),
+                 end_date=str(sprints['end_date'][i]))
+            for i, sprint_id in enumerate(sprints['id'])]
+    accuracy = get_estimate_accuracy(columns)
+    if is_json:
+        return json.dumps({'Success': True, 'window': window,
+                           'sprints': rows, 'accuracy': accuracy})
+    return render_template('analytics/summary.html', window=window,
+                           sprints=rows, accuracy=accuracy)
+
+
+@bp.route('/sprint/<int:sprint_id>/burndown', methods=('GET',))
+@login_required
+def burndown(sprint_id):
+    """
+    Daily burndown and burn-up of one sprint
+    @param sprint_id the sprint to chart
+    """
+    is_json = request.args.get('is_json', False)
+    window = get_window()
+    series = get_burndown(load_columns(current_user.id), sprint_id, window)
+    if series is None:
+        abort(404, f'Sprint {sprint_id} not found')
+    series = {key: value if key == 'scope' else to_list(value)
+              for key, value in series.items()}
+    if is_json:
+        return json.dumps({'Success': True, 'sprint_id': sprint_id,
+                           'window': window, **series})
+    keys = [key for key in series if key != 'scope']
+    days = [dict(zip(keys, values)) for values in zip(*(series[key] for key in keys))]
+    return render_template('analytics/burndown.html', sprint_id=sprint_id,
+                           window=window, scope=series['scope'], days=days)
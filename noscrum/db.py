@@ -2,8 +2,9 @@
 Database Models and Controller (not much to do, thanks SQLAlchemy!)
 """
 
-import asyncio
+import click
 import sqlalchemy as sa
+from flask.cli import with_appcontext
 from flask_user import UserMixin
 from sqlalchemy.orm import relationship
 from noscrum import DatabaseSingleton
@@ -13,7 +14,47 @@ def get_db():
     """
     Returns the DB for the instance of the app.
     """
-    return asyncio.run(DatabaseSingleton.get_db())
+    return DatabaseSingleton.get_db()
+
+
+def create_record(model, **fields):
+    """
+    Insert a new row and return the persisted instance.
+    The id is assigned by the flush; the instance is kept
+    out of the commit's expiry so reading it back needs
+    no further query (server defaults load on access).
+    @param model the model class to create
+    @param fields column values for the new row
+    """
+    app_db = get_db()
+    record = model(**fields)
+    app_db.session.add(record)
+    app_db.session.flush()
+    app_db.session.expunge(record)
+    app_db.session.commit()
+    app_db.session.add(record)
+    return record
+
+
+def bump_data_version(user_id=None):
+    """
+    Mark a user's data as changed, so pages cached
+    under the old version are fetched again
+    @param user_id owner of the changed data,
+    None for a change that spans every user
+    """
+    app_db = get_db()
+    query = User.query if user_id is None else User.query.filter(User.id == user_id)
+    query.update({User.data_version: User.data_version + 1}, synchronize_session=False)
+    app_db.session.commit()
+
+
+def nocase_string(length):
+    """
+    String column type compared case insensitively on SQLite
+    @param length maximum length of the string
+    """
+    return sa.String(length).with_variant(sa.String(length, collation='NOCASE'), 'sqlite')
 
 
 db = get_db()
@@ -25,6 +66,9 @@ class Work(db.Model):
     Tracks the number of hours worked on a specific task.
     """
     __tablename__ = 'work'
+    __table_args__ = (
+        sa.Index('ix_work_task_id_work_date', 'task_id', 'work_date'),
+    )
     id = sa.Column(sa.Integer(), primary_key=True)
     work_date = sa.Column(sa.Date(), nullable=False)
     hours_worked = sa.Column(sa.Integer(), nullable=False)
@@ -33,6 +77,9 @@ class Work(db.Model):
     user_id = sa.Column(sa.Integer(), sa.ForeignKey('user.id'))
     story = relationship('Story', 'task')
 
+    def to_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
 
 class User(db.Model, UserMixin):
     """
@@ -47,16 +94,24 @@ class User(db.Model, UserMixin):
     # User auth information.
     # User authentication information. The collation='NOCASE' is required
     # to search case insensitively when USER_IFIND_MODE is 'nocase_collation'.
-    email = sa.Column(sa.String(255, collation='NOCASE'),
+    # It only exists in SQLite, so other databases get plain strings.
+    email = sa.Column(nocase_string(255),
                       nullable=True, unique=True)
     email_confirmed_at = sa.Column(sa.DateTime())
     email_opt_in = sa.Column(sa.Boolean(), nullable=False, server_default='0')
     password = sa.Column(sa.String(255), nullable=False, server_default='')
     # User personal information
-    first_name = sa.Column(sa.String(100, collation='NOCASE'),
+    first_name = sa.Column(nocase_string(100),
                            nullable=False, server_default='')
-    last_name = sa.Column(sa.String(100, collation='NOCASE'),
+    last_name = sa.Column(nocase_string(100),
                           nullable=False, server_default='')
+    # Bumped by every write to the user's data; pages use it as their ETag
+    data_version = sa.Column(sa.Integer(), nullable=False, server_default='0')
+    # Working hours of the sprint board: slots of slot_hours from
+    # day_start, the last one ending by day_end (hours of the day)
+    day_start = sa.Column(sa.Integer(), nullable=False, server_default='9')
+    day_end = sa.Column(sa.Integer(), nullable=False, server_default='23')
+    slot_hours = sa.Column(sa.Integer(), nullable=False, server_default='2')
     # Define the relationship to Role via UserRoles
     roles = relationship('Role', 'user_roles')
 
@@ -100,6 +155,10 @@ class Task(db.Model):
     such as status, sprint, deadline, etc.
     """
     __tablename__ = 'task'
+    __table_args__ = (
+        sa.Index('ix_task_user_id_sprint_id', 'user_id', 'sprint_id'),
+        sa.Index('ix_task_user_id_story_id', 'user_id', 'story_id'),
+    )
     id = sa.Column(sa.Integer(), primary_key=True)
     task = sa.Column(sa.String(1024), nullable=False)
     story_id = sa.Column(sa.Integer(), sa.ForeignKey(
@@ -125,11 +184,17 @@ class Tag(db.Model):
     Just an additional string to group stories differently from Epic.
     """
     __tablename__ = 'tag'
+    __table_args__ = (
+        sa.Index('ix_tag_user_id_tag', 'user_id', 'tag'),
+    )
     id = sa.Column(sa.Integer(), primary_key=True)
     tag = sa.Column(sa.String(255), nullable=False)
     user_id = sa.Column(sa.Integer, sa.ForeignKey('user.id'), nullable=False)
     stories = relationship('Story', 'tag_story')
 
+    def to_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
 
 class Story(db.Model):
     """
@@ -137,6 +202,9 @@ class Story(db.Model):
     Project object between Epic and Task level
     """
     __tablename__ = 'story'
+    __table_args__ = (
+        sa.Index('ix_story_user_id_epic_id', 'user_id', 'epic_id'),
+    )
     id = sa.Column(sa.Integer(), primary_key=True)
     story = sa.Column(sa.String(255), nullable=False)
     epic_id = sa.Column(sa.Integer(), sa.ForeignKey('epic.id'), nullable=False)
@@ -156,6 +224,9 @@ class TagStory(db.Model):
     TagStory model which joins Story to Tag.
     """
     __tablename__ = 'tag_story'
+    __table_args__ = (
+        sa.Index('ix_tag_story_tag_id_story_id', 'tag_id', 'story_id'),
+    )
     id = sa.Column(sa.Integer(), primary_key=True)
     tag_id = sa.Column(sa.Integer(), sa.ForeignKey('tag.id'))
     story_id = sa.Column(sa.Integer(), sa.ForeignKey('story.id'))
@@ -166,6 +237,9 @@ class Epic(db.Model):
     Epic model which defines the top level of project planning.
     """
     __tablename__ = 'epic'
+    __table_args__ = (
+        sa.Index('ix_epic_user_id_epic', 'user_id', 'epic'),
+    )
     id = sa.Column(sa.Integer(), primary_key=True)
     epic = sa.Column(sa.String(255), nullable=False)
     color = sa.Column(sa.String(12))
@@ -188,6 +262,9 @@ class Sprint(db.Model):
     is populated with tasks via Task.sprint_id
     """
     __tablename__ = 'sprint'
+    __table_args__ = (
+        sa.Index('ix_sprint_user_id_start_date', 'user_id', 'start_date'),
+    )
     id = sa.Column(sa.Integer(), primary_key=True)
     start_date = sa.Column(sa.Date(), nullable=False)
     end_date = sa.Column(sa.Date(), nullable=False)
@@ -209,6 +286,11 @@ class ScheduleTask(db.Model):
     associated with it.
     """
     __tablename__ = 'schedule_task'
+    __table_args__ = (
+        sa.Index('ix_schedule_task_user_id_sprint_id_sprint_day_sprint_hour',
+                 'user_id', 'sprint_id', 'sprint_day', 'sprint_hour'),
+        sa.Index('ix_schedule_task_task_id_sprint_id', 'task_id', 'sprint_id'),
+    )
     id = sa.Column(sa.Integer(), primary_key=True)
     task_id = sa.Column(sa.Integer(), sa.ForeignKey('task.id'), nullable=False)
     sprint_id = sa.Column(sa.Integer(), sa.ForeignKey(
@@ -216,6 +298,8 @@ class ScheduleTask(db.Model):
     user_id = sa.Column(sa.Integer(), sa.ForeignKey('user.id'), nullable=False)
     sprint_day = sa.Column(sa.Date(), nullable=False)
     sprint_hour = sa.Column(sa.Integer(), nullable=False)
+    # Hours scheduled; slots were always 2 hours before they had a length
+    duration = sa.Column(sa.Integer(), nullable=False, server_default='2')
     note = sa.Column(sa.String(2048), nullable=True)
 
     def to_dict(self):
@@ -227,4 +311,190 @@ class ScheduleTask(db.Model):
                 'sprint_id': self.sprint_id,
                 'sprint_day': str(self.sprint_day),
                 'sprint_hour': self.sprint_hour,
+                'duration': self.duration,
+                'note': self.note}
+
+
+class RecurringSchedule(db.Model):
+    """
+    Weekly scheduling template for recurring Tasks.
+    Puts a task at the same weekday and hour in every
+    sprint; it is expanded into the days of a sprint
+    when that sprint's board is built.
+    """
+    __tablename__ = 'recurring_schedule'
+    __table_args__ = (
+        sa.Index('ix_recurring_schedule_user_id_weekday_sprint_hour',
+                 'user_id', 'weekday', 'sprint_hour', unique=True),
+    )
+    id = sa.Column(sa.Integer(), primary_key=True)
+    task_id = sa.Column(sa.Integer(), sa.ForeignKey('task.id'), nullable=False)
+    user_id = sa.Column(sa.Integer(), sa.ForeignKey('user.id'), nullable=False)
+    weekday = sa.Column(sa.Integer(), nullable=False)
+    sprint_hour = sa.Column(sa.Integer(), nullable=False)
+    duration = sa.Column(sa.Integer(), nullable=False, server_default='2')
+    note = sa.Column(sa.String(2048), nullable=True)
+
+    def to_dict(self):
+        """
+        Generate a dict representation of the RecurringSchedule object.
+        """
+        return {'id': self.id,
+                'task_id': self.task_id,
+                'weekday': self.weekday,
+                'sprint_hour': self.sprint_hour,
+                'duration': self.duration,
                 'note': self.note}
+
+
+class SprintRollup(db.Model):
+    """
+    Cached estimate sums for one user's sprint board.
+    Kept current by noscrum.rollup as tasks change, so
+    the board does not add them up again on every view.
+    version counts the writes, so a write that raced
+    another is noticed instead of lost.
+    """
+    __tablename__ = 'sprint_rollup'
+    __table_args__ = (
+        sa.Index('ix_sprint_rollup_user_id_sprint_id',
+                 'user_id', 'sprint_id', unique=True),
+    )
+    id = sa.Column(sa.Integer(), primary_key=True)
+    user_id = sa.Column(sa.Integer(), sa.ForeignKey('user.id'), nullable=False)
+    sprint_id = sa.Column(sa.Integer(), sa.ForeignKey('sprint.id'), nullable=False)
+    sums = sa.Column(sa.Text(), nullable=False)
+    version = sa.Column(sa.Integer(), nullable=False, server_default='0')
+
+
+class WorkDay(db.Model):
+    """
+    Hours worked per user, day and task, kept in step
+    with the work table by noscrum.work_days so date
+    range reports read one row per task and day. The
+    task's story and epic are copied in for grouping.
+    """
+    __tablename__ = 'work_day'
+    __table_args__ = (
+        sa.Index('ix_work_day_user_id_work_date_task_id',
+                 'user_id', 'work_date', 'task_id', unique=True),
+    )
+    id = sa.Column(sa.Integer(), primary_key=True)
+    user_id = sa.Column(sa.Integer(), sa.ForeignKey('user.id'), nullable=False)
+    work_date = sa.Column(sa.Date(), nullable=False)
+    task_id = sa.Column(sa.Integer(), sa.ForeignKey('task.id'), nullable=False)
+    story_id = sa.Column(sa.Integer(), sa.ForeignKey('story.id'), nullable=True)
+    epic_id = sa.Column(sa.Integer(), sa.ForeignKey('epic.id'), nullable=True)
+    hours = sa.Column(sa.Integer(), nullable=False)
+
+    def to_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+
+def get_user_conditions(user_id):
+    """
+    Get each model of a user's planning data with the
+    condition picking their rows, parents first
+    Derived tables (rollups, work days) are left out
+    @param user_id owner of the rows
+    """
+    task_ids = sa.select([Task.id]).where(Task.user_id == user_id)
+    story_ids = sa.select([Story.id]).where(Story.user_id == user_id)
+    return [
+        (Epic, Epic.user_id == user_id),
+        (Story, Story.user_id == user_id),
+        (Sprint, Sprint.user_id == user_id),
+        (Task, Task.user_id == user_id),
+        (Tag, Tag.user_id == user_id),
+        (TagStory, TagStory.story_id.in_(story_ids)),
+        (ScheduleTask, ScheduleTask.user_id == user_id),
+        (RecurringSchedule, RecurringSchedule.user_id == user_id),
+        (Work, Work.task_id.in_(task_ids)),
+    ]
+
+
+def migrate_recurring_schedules(app_db):
+    """
+    Recurring schedules used to be ScheduleTask rows with a
+    sprint_id of 0. Turn any that are left into weekly
+    RecurringSchedule templates, the newest winning a slot.
+    @param app_db the SQLAlchemy instance for the app
+    """
+    legacy = ScheduleTask.query.filter(ScheduleTask.sprint_id == 0)\
+        .order_by(ScheduleTask.id).all()
+    if not legacy:
+        return 0
+    templates = {(x.user_id, x.weekday, x.sprint_hour): x
+                 for x in RecurringSchedule.query.all()}
+    for record in legacy:
+        key = (record.user_id, record.sprint_day.weekday(), record.sprint_hour)
+        if key not in templates:
+            templates[key] = RecurringSchedule(user_id=key[0], weekday=key[1],
+                                               sprint_hour=key[2])
+            app_db.session.add(templates[key])
+        templates[key].task_id = record.task_id
+        templates[key].duration = record.duration
+        templates[key].note = record.note
+        app_db.session.delete(record)
+    app_db.session.commit()
+    return len(legacy)
+
+
+def upgrade_schema(app_db):
+    """
+    Bring an existing database up to date with the models.
+    create_all() only creates missing tables, so columns
+    and indexes added to a table after it was first created
+    are made here instead (new columns need a server default
+    or to be nullable). Safe to run on every application start.
+    Returns a description of each column and index created
+    @param app_db the SQLAlchemy instance for the app
+    """
+    created = upgrade_tables(app_db.engine, app_db.Model.metadata.sorted_tables)
+    if {'schedule_task', 'recurring_schedule'} <= set(sa.inspect(app_db.engine).get_table_names()):
+        migrate_recurring_schedules(app_db)
+    return created
+
+
+def upgrade_tables(engine, tables):
+    """
+    Add the columns and indexes missing from the tables
+    that already exist in a database
+    Returns a description of each column and index created
+    @param engine database to bring up to date
+    @param tables model tables it should hold
+    """
+    inspector = sa.inspect(engine)
+    table_names = set(inspector.get_table_names())
+    created = []
+    for table in tables:
+        if table.name not in table_names:
+            continue
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                column_ddl = sa.schema.CreateColumn(column).compile(dialect=engine.dialect)
+                engine.execute(f'ALTER TABLE {table.name} ADD COLUMN {column_ddl}')
+                created.append(f'column {table.name}.{column.name}')
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+                created.append(f'index {index.name}')
+    if created and engine.dialect.name == 'sqlite':
+        # Refresh planner statistics so the new indexes get used
+        engine.execute('ANALYZE')
+    return created
+
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    """
+    Create missing tables and indexes in an existing database.
+    """
+    app_db = get_db()
+    app_db.create_all()
+    for created in upgrade_schema(app_db):
+        click.echo(f'Created {created}')
+    click.echo('Database is up to date.')
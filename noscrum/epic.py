@@ -10,8 +10,12 @@ from flask import (
     Blueprint, flash, redirect, render_template, request, url_for, abort
 )
 from flask_user import current_user, login_required
+import sqlalchemy as sa
 
-from noscrum.db import get_db, Epic
+from noscrum.db import get_db, create_record, Epic, Story, Task
+from noscrum.pagination import paginate_query
+from noscrum.etag import conditional_on_data
+from noscrum.forecast import get_forecasts
 
 bp = Blueprint('epic', __name__, url_prefix='/epic')
 
@@ -24,26 +28,25 @@ def get_epics(sprint_view=False, sprint_id=None):
     if not sprint_view:
         return Epic.query.filter(Epic.user_id == current_user.id).all()
 
-    return app_db.session.execute(
-        'SELECT epic.id, '+
-        "CASE WHEN epic.epic == 'NULL' THEN 'No Epic' ELSE epic.epic END as epic, "+
-        'color, epic.deadline, ' +
-        'sum(coalesce(estimate,0)) as estimate, count(task.id) as tasks, ' +
-        "COUNT(DISTINCT CASE WHEN task.status <> 'Done' THEN task.id ELSE NULL END) " +
-        "as active_tasks, " +
-        'COUNT(DISTINCT CASE WHEN task.estimate IS NULL THEN task.id ELSE NULL END) ' +
-        'as unestimated_tasks, ' +
-        "SUM(CASE WHEN task.status <> 'Done' THEN task.estimate - coalesce(task.actual,0)" +
-        " ELSE 0 END) AS rem_estimate " +
-        'FROM epic ' +
-        'LEFT OUTER JOIN story ON story.epic_id = epic.id ' +
-        'AND story.user_id = :user_id ' +
-        'LEFT OUTER JOIN task ON task.story_id = story.id ' +
-        'AND task.sprint_id = :sprint_id ' +
-        'AND task.user_id = :user_id ' +
-        'WHERE epic.user_id = :user_id ' +
-        'GROUP BY epic.epic, epic.id, epic.color',
-        {'user_id': current_user.id, 'sprint_id': sprint_id}).fetchall()
+    query = app_db.session.query(
+        Epic.id,
+        sa.case([(Epic.epic == 'NULL', 'No Epic')], else_=Epic.epic).label('epic'),
+        Epic.color, Epic.deadline,
+        sa.func.sum(sa.func.coalesce(Task.estimate, 0)).label('estimate'),
+        sa.func.count(Task.id).label('tasks'),
+        sa.func.count(sa.distinct(sa.case([(Task.status != 'Done', Task.id)])))
+        .label('active_tasks'),
+        sa.func.count(sa.distinct(sa.case([(Task.estimate.is_(None), Task.id)])))
+        .label('unestimated_tasks'),
+        sa.func.sum(sa.case([(Task.status != 'Done',
+                              Task.estimate - sa.func.coalesce(Task.actual, 0))], else_=0))
+        .label('rem_estimate')
+    ).outerjoin(Story, sa.and_(Story.epic_id == Epic.id, Story.user_id == current_user.id)
+    ).outerjoin(Task, sa.and_(Task.story_id == Story.id, Task.sprint_id == sprint_id,
+                              Task.user_id == current_user.id)
+    ).filter(Epic.user_id == current_user.id
+    ).group_by(Epic.id, Epic.epic, Epic.color, Epic.deadline)
+    return app_db.session.execute(query.statement).fetchall()
 
 
 def get_epic_by_name(epic):
@@ -85,16 +88,11 @@ def create_epic(epic, color, deadline):
     @param color the highlighted color for use
     @param deadline (optional) planned end day
     """
-    app_db = get_db()
-    new_epic = Epic(
-        epic=epic,
-        color=color,
-        deadline=deadline,
-        user_id=current_user.id
-    )
-    app_db.session.add(new_epic)
-    app_db.session.commit()
-    return get_epic_by_name(epic)
+    return create_record(Epic,
+                         epic=epic,
+                         color=color,
+                         deadline=deadline,
+                         user_id=current_user.id)
 
 
 def update_epic(epic_id, epic, color, deadline):
@@ -183,19 +181,31 @@ def show(epic_id):
             abort(500, error)
         flash(error, 'error')
 
+    forecasts = get_forecasts()
+    forecast = forecasts['epics'].get(epic.id)
+    story_forecasts = {x.id: forecasts['stories'].get(x.id) for x in epic.stories}
     if is_json:
-        return json.dumps({'Success': True, 'epic': dict(epic), 'stories': {}})
-    return render_template('epic/show.html', epic=epic, stories={})
+        return json.dumps({'Success': True, 'epic': epic.to_dict(), 'stories': {},
+                           'forecast': forecast, 'story_forecasts': story_forecasts},
+                          default=str)
+    return render_template('epic/show.html', epic=epic, stories={},
+                           forecast=forecast, story_forecasts=story_forecasts)
 
 
 @bp.route('/', methods=('GET',))
 @login_required
+@conditional_on_data
 def list_all():
     """
     List all of the epics made by current user
     """
     is_json = request.args.get('is_json', False)
-    epics = get_epics()
     if is_json:
-        return json.dumps({'Success': True, 'epics': [dict(x) for x in epics]})
-    return render_template('epic/list.html', epics=epics)
+        epics, next_cursor = paginate_query(
+            Epic.query.filter(Epic.user_id == current_user.id), Epic.id)
+        return json.dumps({'Success': True,
+                           'epics': [x.to_dict() for x in epics],
+                           'next_cursor': next_cursor}, default=str)
+    epics = get_epics()
+    return render_template('epic/list.html', epics=epics,
+                           forecasts=get_forecasts()['epics'])
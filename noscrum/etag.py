@@ -0,0 +1,86 @@
+"""
+Conditional GET for pages built from a user's data
+
+Each user has a data version that every write bumps.
+Pages send it as a weak ETag, and a request whose
+If-None-Match still carries it is answered with 304
+before the view runs any of its queries.
+"""
+import os
+from datetime import date
+from functools import wraps
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+from noscrum.db import get_db, bump_data_version
+
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+CODE_SUFFIXES = ('.py', '.html', '.js', '.css')
+
+
+def get_data_etag():
+    """
+    ETag for the current user's data as it is now; the
+    day is part of it since pages like the active sprint
+    depend on the date, and the code's epoch since the
+    templates may have changed with a new release
+    """
+    return (f"{current_user.id}.{current_user.data_version}." +
+            f"{date.today().toordinal()}.{current_app.config['DATA_VERSION_EPOCH']}")
+
+
+def conditional_on_data(view):
+    """
+    Decorate a view to answer GETs with 304 while the
+    user's data has not changed since the client's copy
+    @param view the view function to wrap
+    """
+    @wraps(view)
+    def conditional_view(*args, **kwargs):
+        if request.method != 'GET' or not current_user.is_authenticated:
+            return view(*args, **kwargs)
+        etag = get_data_etag()
+        # Pending flash messages have to be rendered, not cached
+        if request.if_none_match.contains_weak(etag) and not session.get('_flashes'):
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return conditional_view
+
+
+def get_code_epoch(app):
+    """
+    Newest modification time of the app's code and
+    templates, the same for every worker of a release
+    @param app Flask application
+    """
+    return max(int(os.path.getmtime(os.path.join(folder, name)))
+               for folder, _, names in os.walk(app.root_path)
+               for name in names if name.endswith(CODE_SUFFIXES))
+
+
+def init_etag(app):
+    """
+    Bump data versions after writes and fix the epoch
+    the app's ETags are built with
+    @param app Flask application
+    """
+    app.config.setdefault('DATA_VERSION_EPOCH', get_code_epoch(app))
+    app.after_request(bump_after_write)
+
+
+def bump_after_write(response):
+    """
+    After any write request by a signed in user, bump the
+    user's data version (even if the write failed part way)
+    @param response the response being sent
+    """
+    if request.method in WRITE_METHODS and current_user.is_authenticated:
+        # Whatever the view left uncommitted is rolled back at teardown anyway
+        get_db().session.rollback()
+        bump_data_version(current_user.id)
+    return response
@@ -0,0 +1,160 @@
+"""
+Live sprint board updates sent as Server-Sent Events
+
+Changes are published to the owning user's channel after
+they are committed; every open board of that user streams
+the events for its sprint, so tabs and devices stay in step
+without reloading the page.
+"""
+import json
+import queue
+import threading
+from flask import Blueprint, Response, abort, current_app, request
+from flask_login import current_user
+from flask_user import login_required
+from noscrum.db import Sprint
+
+bp = Blueprint('events', __name__, url_prefix='/events')
+
+# Seconds between comment lines that keep idle streams open
+KEEPALIVE_SECONDS = 15
+# Milliseconds a browser waits before reconnecting a stream
+RETRY_MILLISECONDS = 3000
+# Events held for a stream before a slow reader misses some
+SUBSCRIBER_QUEUE_SIZE = 256
+# Request header naming the board tab that made a change
+CLIENT_HEADER = 'X-Board-Client'
+
+
+class LocalBroker:
+    """
+    In-process publish/subscribe for a single server process.
+    A broker backed by Redis or similar only has to offer the
+    same subscribe, unsubscribe and publish methods, with
+    subscribers that have a queue.Queue style get(timeout=...)
+    """
+
+    def __init__(self, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.channels = {}
+
+    def subscribe(self, channel):
+        """
+        Start listening to a channel
+        @param channel name of the channel
+        """
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self.lock:
+            self.channels.setdefault(channel, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, channel, subscriber):
+        """
+        Stop listening to a channel
+        @param channel name of the channel
+        @param subscriber from subscribe
+        """
+        with self.lock:
+            subscribers = self.channels.get(channel, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self.channels.pop(channel, None)
+
+    def publish(self, channel, event):
+        """
+        Hand an event to everyone listening on a channel;
+        a subscriber whose queue is full misses it
+        @param channel name of the channel
+        @param event JSON serialisable dictionary
+        """
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                pass
+
+
+def init_events(app, broker=None):
+    """
+    Give the app the broker its boards stream from
+    @param app Flask application
+    @param broker defaults to a LocalBroker
+    """
+    app.extensions['noscrum_events'] = LocalBroker() if broker is None else broker
+
+
+def get_broker():
+    """
+    Get the running app's event broker
+    """
+    return current_app.extensions['noscrum_events']
+
+
+def get_user_channel(user_id):
+    """
+    Name of the channel carrying a user's changes
+    @param user_id owner of the changes
+    """
+    return f'user:{user_id}'
+
+
+def publish_event(kind, sprint_id=None, **data):
+    """
+    Tell the current user's open boards about a change
+    @param kind event name, eg 'schedule_created'
+    @param sprint_id board the change belongs to,
+    None for changes shown on any board (task, work)
+    @param data event payload
+    """
+    event = {'event': kind, 'sprint_id': sprint_id,
+             'client': request.headers.get(CLIENT_HEADER), **data}
+    get_broker().publish(get_user_channel(current_user.id), event)
+
+
+def format_event(event):
+    """
+    Encode an event in the text/event-stream format
+    @param event dictionary from publish_event
+    """
+    return f"event: {event['event']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+
+def stream_events(broker, channel, sprint_id):
+    """
+    Yield a sprint's events until the client goes away
+    @param broker where the events are published
+    @param channel the sprint owner's channel
+    @param sprint_id sprint of the open board
+    """
+    subscriber = broker.subscribe(channel)
+    try:
+        yield f'retry: {RETRY_MILLISECONDS}\n\n'
+        while True:
+            try:
+                event = subscriber.get(timeout=KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            if event['sprint_id'] in (None, sprint_id):
+                yield format_event(event)
+    finally:
+        broker.unsubscribe(channel, subscriber)
+
+
+@bp.route('/sprint/<int:sprint_id>', methods=('GET',))
+@login_required
+def sprint_stream(sprint_id):
+    """
+    Stream the changes to a sprint board as they happen
+    @param sprint_id sprint of the open board
+    """
+    sprint = Sprint.query.filter(Sprint.id == sprint_id)\
+        .filter(Sprint.user_id == current_user.id).first()
+    if sprint is None:
+        abort(404, f'Sprint {sprint_id} not found')
+    events = stream_events(get_broker(), get_user_channel(current_user.id), sprint_id)
+    return Response(events, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
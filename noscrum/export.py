@@ -0,0 +1,77 @@
+"""
+Export a user's whole workspace as newline-delimited JSON
+"""
+import json
+import click
+from flask import Blueprint, Response, stream_with_context
+from flask.cli import with_appcontext
+from flask_login import current_user
+from flask_user import login_required
+from noscrum.db import get_db, get_user_conditions, User
+from noscrum.sharding import use_shard
+
+bp = Blueprint('export', __name__, url_prefix='/export')
+
+EXPORT_BATCH_SIZE = 1000
+
+
+def get_export_queries(user_id):
+    """
+    Get the select for each exported table, parents first
+    so noscrum.importer can replay the lines in order
+    @param user_id identity of the user to export
+    """
+    return [(model.__tablename__,
+             model.__table__.select().where(condition).order_by(model.id))
+            for model, condition in get_user_conditions(user_id)]
+
+
+def export_lines(user_id):
+    """
+    Generate one JSON line per row the user owns
+    Rows are read through a server-side cursor in
+    batches, so memory use does not grow with the account
+    @param user_id identity of the user to export
+    """
+    app_db = get_db()
+    for table, query in get_export_queries(user_id):
+        result = app_db.session.connection().execution_options(
+            stream_results=True).execute(query)
+        try:
+            while True:
+                rows = result.fetchmany(EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    yield json.dumps({'table': table, 'row': dict(row)}, default=str) + '\n'
+        finally:
+            result.close()
+
+
+@bp.route('/', methods=['GET'])
+@login_required
+def export_all():
+    """
+    Stream the current user's workspace as NDJSON
+    """
+    lines = export_lines(current_user.id)
+    return Response(stream_with_context(lines),
+                    mimetype='application/x-ndjson',
+                    headers={'Content-Disposition': 'attachment; filename=noscrum-export.ndjson'})
+
+
+@click.command('export-user')
+@click.argument('username')
+@click.option('--output', '-o', type=click.File('w'), default='-',
+              help='File to write the NDJSON to (default stdout).')
+@with_appcontext
+def export_user_command(username, output):
+    """
+    Write every record USERNAME owns as NDJSON.
+    """
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException(f'No user named {username}')
+    with use_shard(user.id):
+        for line in export_lines(user.id):
+            output.write(line)
@@ -0,0 +1,280 @@
+"""
+Monte Carlo completion forecasts for epics and stories
+
+The throughput of recent sprints (the size of the tasks
+each one got Done) is resampled into many possible futures
+at once. The sprint in which a future has burned through
+an epic's or story's remaining work gives the completion
+date percentiles and the chance of meeting its deadline.
+The simulated futures only depend on the throughput of
+ended sprints, so they are kept per user and reused by
+later writes to open work until the history or day moves.
+Both caches hold the FORECAST_CACHE_USERS most recently
+served users.
+"""
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+import numpy as np
+from flask import current_app
+from flask_login import current_user
+from noscrum.analytics import load_columns, index_of, to_list
+from noscrum.db import get_db, Epic, Story
+
+# Futures simulated for each forecast
+FORECAST_TRIALS = 20000
+# Most recent ended sprints resampled for throughput
+HISTORY_SPRINTS = 12
+# Futures are cut off after this many sprints
+MAX_FORECAST_SPRINTS = 260
+# Futures are drawn this many trials at a time
+SIMULATION_CHUNK = 2000
+PERCENTILES = (50, 85, 95)
+
+cache_lock = threading.Lock()
+
+
+def get_task_sizes(tasks):
+    """
+    Size of each task in hours: its estimate, or the hours
+    logged on it for tasks that were never estimated
+    @param tasks task columns from load_columns
+    """
+    estimate = tasks['estimate']
+    return np.where(estimate > 0, estimate, np.nan_to_num(tasks['actual']))
+
+
+def get_remaining_sizes(tasks, sizes):
+    """
+    Hours left on each task: none when Done, estimate less
+    actual when estimated, otherwise the median size of
+    the Done tasks
+    @param tasks task columns from load_columns
+    @param sizes from get_task_sizes
+    """
+    finished = sizes[tasks['done'] & (sizes > 0)]
+    typical = float(np.median(finished)) if len(finished) else 0.0
+    estimated = ~np.isnan(tasks['estimate'])
+    remaining = np.where(estimated,
+                         np.maximum(np.nan_to_num(tasks['estimate']) -
+                                    np.nan_to_num(tasks['actual']), 0),
+                         typical)
+    return np.where(tasks['done'], 0.0, remaining)
+
+
+def get_history(columns, sizes, today):
+    """
+    Throughput of the most recent sprints that have ended,
+    oldest first, and their median length in days
+    @param columns from load_columns
+    @param sizes from get_task_sizes
+    @param today first day of the forecast
+    """
+    tasks, sprints = columns['tasks'], columns['sprints']
+    ended = np.flatnonzero(sprints['end_date'] < np.datetime64(today))[-HISTORY_SPRINTS:]
+    if len(ended) == 0:
+        return np.zeros(0), None
+    task_sprint = index_of(sprints['id'], tasks['sprint_id'])
+    done = tasks['done'] & (task_sprint >= 0)
+    throughput = np.bincount(task_sprint[done], sizes[done], minlength=len(sprints['id']))
+    lengths = (sprints['end_date'][ended] - sprints['start_date'][ended]).astype(np.int64) + 1
+    return throughput[ended], max(1, int(np.median(lengths)))
+
+
+def get_horizon(throughput, most):
+    """
+    Future sprints to simulate: long enough for a slow
+    future to finish the most work, within the cut off
+    @param throughput past sprints' throughput to resample
+    @param most largest amount of work to forecast
+    """
+    return int(min(MAX_FORECAST_SPRINTS, np.ceil(3 * most / throughput.mean()) + 1))
+
+
+def simulate(throughput, most, trials, rng):
+    """
+    Total throughput after each future sprint, for long
+    enough to finish the most work; each column is sorted,
+    so row i is the i-th lowest total after that sprint.
+    Totals are float32 and drawn a chunk of trials at a
+    time, so no float64 copy of the futures is made
+    @param throughput past sprints' throughput to resample
+    @param most largest amount of work to forecast
+    @param trials number of futures to simulate
+    @param rng numpy random Generator
+    """
+    futures = np.empty((trials, get_horizon(throughput, most)), dtype=np.float32)
+    throughput = throughput.astype(np.float32)
+    for start in range(0, trials, SIMULATION_CHUNK):
+        chunk = futures[start:start + SIMULATION_CHUNK]
+        np.cumsum(rng.choice(throughput, size=chunk.shape), axis=1, out=chunk)
+    futures.sort(axis=0)
+    return futures
+
+
+def get_simulation(user_id, throughput, most, today):
+    """
+    Futures for a user's throughput history, reusing the
+    last simulation while the history and day are the
+    same and it reaches far enough for the most work
+    @param user_id owner of the history
+    @param throughput past sprints' throughput to resample
+    @param most largest amount of work to forecast
+    @param today first day of the forecast
+    """
+    key = (today, tuple(throughput))
+    cached = get_cached('noscrum_simulations', user_id)
+    if (cached is None or cached[0] != key or
+            cached[1].shape[1] < get_horizon(throughput, most)):
+        rng = np.random.default_rng((user_id, today.toordinal()))
+        cached = (key, simulate(throughput, most, FORECAST_TRIALS, rng))
+        put_cached('noscrum_simulations', user_id, cached)
+    return cached[1]
+
+
+def get_cached(name, user_id):
+    """
+    A user's entry in one of the app's forecast caches,
+    marked as the most recently used, or None
+    @param name extension holding the cache
+    @param user_id owner of the entry
+    """
+    with cache_lock:
+        cache = current_app.extensions.setdefault(name, OrderedDict())
+        if user_id not in cache:
+            return None
+        cache.move_to_end(user_id)
+        return cache[user_id]
+
+
+def put_cached(name, user_id, entry):
+    """
+    Store a user's entry in one of the forecast caches,
+    dropping the least recently used users past
+    FORECAST_CACHE_USERS
+    @param name extension holding the cache
+    @param user_id owner of the entry
+    @param entry value to keep
+    """
+    with cache_lock:
+        cache = current_app.extensions.setdefault(name, OrderedDict())
+        cache[user_id] = entry
+        cache.move_to_end(user_id)
+        while len(cache) > current_app.config['FORECAST_CACHE_USERS']:
+            cache.popitem(last=False)
+
+
+def get_completions(futures, remaining, deadline_sprints):
+    """
+    Sprints needed to finish each remaining amount at every
+    percentile (0 when not within the horizon), and the
+    share of futures finishing within the deadline sprints
+    @param futures from simulate
+    @param remaining hours left for each epic or story
+    @param deadline_sprints whole sprints before each
+    deadline (ignored where there is no deadline)
+    """
+    trials, horizon = futures.shape
+    needed = []
+    for percentile in PERCENTILES:
+        # p% of futures are done by sprint k once the (100-p)th percentile covers the work
+        covered = futures[int((100 - percentile) / 100 * (trials - 1))]
+        sprints = np.searchsorted(covered, remaining, side='left') + 1
+        needed.append(np.where(sprints > horizon, 0, sprints))
+    last = np.clip(deadline_sprints, 1, horizon) - 1
+    on_time = np.zeros(len(remaining))
+    for sprint in np.unique(last):
+        at = last == sprint
+        on_time[at] = 1 - np.searchsorted(futures[:, sprint], remaining[at], side='left') / trials
+    on_time = np.where(deadline_sprints < 1, 0.0, on_time)
+    return needed, on_time
+
+
+def get_group_remaining(record_ids, task_groups, remaining):
+    """
+    Hours left on each epic or story
+    @param record_ids ids of the epics or stories
+    @param task_groups each task's epic or story id
+    @param remaining from get_remaining_sizes
+    """
+    positions = index_of(np.array(record_ids, dtype=np.int64), task_groups)
+    owned = positions >= 0
+    return np.bincount(positions[owned], remaining[owned], minlength=len(record_ids))
+
+
+def forecast_groups(record_ids, deadlines, left, sprint_days, today, futures):
+    """
+    Forecast each epic or story from its remaining work
+    @param record_ids ids of the epics or stories
+    @param deadlines their deadline (or None)
+    @param left from get_group_remaining
+    @param sprint_days length of a future sprint
+    @param today first day of the forecast
+    @param futures from simulate, None without history
+    """
+    record_ids = np.array(record_ids, dtype=np.int64)
+    forecasts = {int(x): {'remaining': value, 'deadline': deadline,
+                          **{f'p{p}': None for p in PERCENTILES}, 'on_time': None}
+                 for x, value, deadline in zip(record_ids, to_list(left), deadlines)}
+    if not len(record_ids) or futures is None:
+        return forecasts
+    deadline_sprints = np.array([((x - today).days + 1) // sprint_days if x else 0
+                                 for x in deadlines])
+    needed, on_time = get_completions(futures, left, deadline_sprints)
+    for i, record_id in enumerate(record_ids):
+        forecast = forecasts[int(record_id)]
+        if not left[i]:
+            forecast['on_time'] = 1.0 if deadlines[i] else None
+            continue
+        for percentile, sprints in zip(PERCENTILES, needed):
+            if sprints[i]:
+                forecast[f'p{percentile}'] = today + timedelta(int(sprints[i]) * sprint_days - 1)
+        if deadlines[i]:
+            forecast['on_time'] = round(float(on_time[i]), 3)
+    return forecasts
+
+
+def build_forecasts(user_id, today):
+    """
+    Forecast completion of every epic and story of a user
+    @param user_id owner of the records
+    @param today first day of the forecast
+    """
+    columns = load_columns(user_id)
+    tasks = columns['tasks']
+    sizes = get_task_sizes(tasks)
+    remaining = get_remaining_sizes(tasks, sizes)
+    history = get_history(columns, sizes, today)
+    app_db = get_db()
+    groups = {}
+    for kind, model, group in (('epics', Epic, tasks['epic_id']),
+                               ('stories', Story, tasks['story_id'])):
+        records = app_db.session.query(model.id, model.deadline)\
+            .filter(model.user_id == user_id).order_by(model.id).all()
+        record_ids = [x.id for x in records]
+        groups[kind] = (record_ids, [x.deadline for x in records],
+                        get_group_remaining(record_ids, group, remaining))
+    futures = None
+    if history[0].sum():
+        most = max([0.0] + [x.max() for _, _, x in groups.values() if len(x)])
+        futures = get_simulation(user_id, history[0], most, today)
+    result = {'history_sprints': len(history[0]), 'sprint_days': history[1],
+              'trials': FORECAST_TRIALS}
+    for kind, (record_ids, deadlines, left) in groups.items():
+        result[kind] = forecast_groups(record_ids, deadlines, left, history[1], today, futures)
+    return result
+
+
+def get_forecasts():
+    """
+    Get the current user's forecasts, built once per
+    version of their data and day; the simulation
+    behind them outlives writes to open work
+    """
+    today = date.today()
+    key = (current_user.data_version, today)
+    cached = get_cached('noscrum_forecasts', current_user.id)
+    if cached is None or cached[0] != key:
+        cached = (key, build_forecasts(current_user.id, today))
+        put_cached('noscrum_forecasts', current_user.id, cached)
+    return cached[1]
@@ -0,0 +1,531 @@
+"""
+Bulk import of epics, stories, tasks and tags from NDJSON or CSV
+
+NDJSON written by noscrum.export ({"table": ..., "row": ...}
+per line, parents first) is also accepted, so an export can
+be restored: exported ids are mapped to the names of their
+parents, and tasks and sprints to the ids they get here.
+"""
+import csv
+import io
+import json
+from datetime import date
+import click
+from flask import Blueprint, request
+from flask.cli import with_appcontext
+from flask_login import current_user
+from flask_user import login_required
+from noscrum.db import get_db, bump_data_version, User, Epic, Story, Task, Tag, TagStory
+from noscrum.db import Sprint, ScheduleTask, RecurringSchedule, Work
+from noscrum.rollup import drop_rollups
+from noscrum.sharding import use_shard
+from noscrum.work_days import rebuild_work_days
+
+bp = Blueprint('importer', __name__, url_prefix='/import')
+
+IMPORT_CHUNK_SIZE = 1000
+NULL_EPIC = 'NULL'
+# Tables of an export, in the order they are written
+EXPORT_TABLES = ('epic', 'story', 'sprint', 'task', 'tag', 'tag_story',
+                 'schedule_task', 'recurring_schedule', 'work')
+
+
+def read_ndjson(stream):
+    """
+    Yield (line number, record) for each JSON object line
+    @param stream text file of newline-delimited JSON
+    """
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            raise ValueError(f'Line {number}: {error}') from error
+        if not isinstance(record, dict):
+            raise ValueError(f'Line {number}: expected a JSON object')
+        yield number, record
+
+
+def read_csv(stream):
+    """
+    Yield (line number, record) for each CSV row,
+    keyed by the header row; blank cells are dropped
+    @param stream text file of CSV with a header row
+    """
+    for number, row in enumerate(csv.DictReader(stream), 2):
+        yield number, {k: v for k, v in row.items() if k and v not in (None, '')}
+
+
+def get_reader(fmt, filename=None):
+    """
+    Pick read_csv or read_ndjson by format name or
+    by the file extension when no format is given
+    @param fmt 'csv', 'ndjson' or None
+    @param filename (optional) uploaded file name
+    """
+    if fmt is None and filename:
+        fmt = 'csv' if filename.lower().endswith('.csv') else 'ndjson'
+    if fmt in (None, 'ndjson', 'json'):
+        return read_ndjson
+    if fmt == 'csv':
+        return read_csv
+    raise ValueError(f'Unknown import format {fmt}')
+
+
+def parse_date(number, value):
+    """
+    Convert an ISO date string, or pass None through
+    @param number line number for error messages
+    @param value YYYY-MM-DD or None
+    """
+    if value is None or isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value))
+    except ValueError as error:
+        raise ValueError(f'Line {number}: bad date {value!r}') from error
+
+
+def parse_number(number, value, cast):
+    """
+    Convert a number field, or pass None through
+    @param number line number for error messages
+    @param value raw field value
+    @param cast int or float
+    """
+    if value is None:
+        return None
+    try:
+        return cast(value)
+    except (TypeError, ValueError) as error:
+        raise ValueError(f'Line {number}: bad number {value!r}') from error
+
+
+def parse_tags(value):
+    """
+    Tags may be a JSON list or a comma separated string
+    @param value raw tags field
+    """
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    return [str(x).strip() for x in value if str(x).strip()]
+
+
+def parse_record(number, record):
+    """
+    Validate one input record and normalise its fields
+    A record's type defaults to task, so a plain task
+    CSV (task, story, epic, estimate, ...) just works
+    @param number line number for error messages
+    @param record dictionary read from the input
+    """
+    if 'table' in record:
+        table, row = record['table'], record.get('row')
+        if table not in EXPORT_TABLES or not isinstance(row, dict) or 'id' not in row:
+            raise ValueError(f'Line {number}: not an exported {table!r} row')
+        return {'type': 'row', 'table': table, 'row': row, 'number': number}
+    kind = record.get('type', 'task')
+    if kind not in ('epic', 'story', 'task', 'tag'):
+        raise ValueError(f'Line {number}: unknown record type {kind!r}')
+    name = record.get(kind)
+    if not name:
+        raise ValueError(f'Line {number}: {kind} record has no {kind} name')
+    parsed = {'type': kind, 'name': str(name)}
+    if kind == 'epic':
+        parsed['color'] = record.get('color')
+        parsed['deadline'] = parse_date(number, record.get('deadline'))
+    elif kind == 'story':
+        parsed['epic'] = str(record.get('epic') or NULL_EPIC)
+        parsed['prioritization'] = parse_number(number, record.get('prioritization'), int)
+        parsed['deadline'] = parse_date(number, record.get('deadline'))
+        parsed['tags'] = parse_tags(record.get('tags'))
+    elif kind == 'task':
+        if not record.get('story'):
+            raise ValueError(f'Line {number}: task record has no story name')
+        parsed['story'] = str(record['story'])
+        parsed['epic'] = str(record.get('epic') or NULL_EPIC)
+        parsed['estimate'] = parse_number(number, record.get('estimate'), float)
+        parsed['actual'] = parse_number(number, record.get('actual'), float)
+        parsed['status'] = str(record.get('status') or 'To-Do')
+        parsed['deadline'] = parse_date(number, record.get('deadline'))
+        recurring = record.get('recurring', False)
+        parsed['recurring'] = str(recurring).lower() in ('1', 'true', 'yes')
+    return parsed
+
+
+class WorkspaceImporter:
+    """
+    Batched importer for one user's records
+    Keeps name to id maps of the user's epics, stories
+    and tags so parents resolve without a query per row;
+    missing parents are created. Each chunk is inserted
+    with bulk_insert_mappings and committed once
+    """
+
+    def __init__(self, user_id, chunk_size=IMPORT_CHUNK_SIZE):
+        """
+        Load the user's existing name maps
+        @param user_id identity of the importing user
+        @param chunk_size records per transaction
+        """
+        self.app_db = get_db()
+        self.user_id = user_id
+        self.chunk_size = chunk_size
+        session = self.app_db.session
+        self.epics = {x.epic: x.id for x in session.query(Epic.id, Epic.epic)
+                      .filter(Epic.user_id == user_id)}
+        self.stories = {(x.epic_id, x.story): x.id for x in
+                        session.query(Story.id, Story.epic_id, Story.story)
+                        .filter(Story.user_id == user_id)}
+        self.tags = {x.tag: x.id for x in session.query(Tag.id, Tag.tag)
+                     .filter(Tag.user_id == user_id)}
+        self.counts = {'epic': 0, 'story': 0, 'task': 0, 'tag': 0}
+        # Only loaded when an export is restored
+        self.sprints = self.story_tags = self.recurring = None
+        # Exported id: epic name, (epic, story) names, tag name,
+        # or for tasks and sprints the id given here (None until
+        # inserted)
+        self.exported = {'epic': {}, 'story': {}, 'tag': {}, 'task': {}, 'sprint': {}}
+
+    def load_restore_maps(self):
+        """
+        Load what restoring an export matches rows against:
+        the user's sprints by dates, story tags and weekly
+        recurring slots
+        """
+        session = self.app_db.session
+        self.sprints = {(x.start_date, x.end_date): x.id for x in
+                        session.query(Sprint.id, Sprint.start_date, Sprint.end_date)
+                        .filter(Sprint.user_id == self.user_id)}
+        self.story_tags = set(session.query(TagStory.story_id, TagStory.tag_id)
+                              .join(Story, Story.id == TagStory.story_id)
+                              .filter(Story.user_id == self.user_id))
+        self.recurring = set(session.query(RecurringSchedule.weekday,
+                                           RecurringSchedule.sprint_hour)
+                             .filter(RecurringSchedule.user_id == self.user_id))
+
+    def get_exported(self, number, kind, source_id):
+        """
+        What an exported id of an earlier line maps to
+        @param number line number for error messages
+        @param kind table the id belongs to
+        @param source_id id in the export
+        """
+        if source_id not in self.exported[kind]:
+            raise ValueError(f'Line {number}: {kind} {source_id} is not in the import')
+        return self.exported[kind][source_id]
+
+    def translate_row(self, record):
+        """
+        Turn a row of an export into an import record,
+        with its parents resolved through earlier rows
+        @param record exported row from parse_record
+        """
+        if self.sprints is None:
+            self.load_restore_maps()
+        table, row, number = record['table'], record['row'], record['number']
+        try:
+            if table == 'epic':
+                parsed = parse_record(number, dict(row, type='epic'))
+                self.exported['epic'][row['id']] = parsed['name']
+            elif table == 'story':
+                epic = self.get_exported(number, 'epic', row['epic_id'])
+                parsed = parse_record(number, dict(row, type='story', epic=epic))
+                self.exported['story'][row['id']] = (epic, parsed['name'])
+            elif table == 'task':
+                epic, story = self.get_exported(number, 'story', row['story_id'])
+                parsed = parse_record(number, dict(row, epic=epic, story=story))
+                parsed['sprint'] = row.get('sprint_id')
+                if parsed['sprint'] is not None:
+                    self.get_exported(number, 'sprint', parsed['sprint'])
+            elif table == 'tag':
+                parsed = parse_record(number, dict(row, type='tag'))
+                self.exported['tag'][row['id']] = parsed['name']
+            elif table == 'tag_story':
+                parsed = {'story': self.get_exported(number, 'story', row['story_id']),
+                          'tag': self.get_exported(number, 'tag', row['tag_id'])}
+            elif table == 'sprint':
+                parsed = {'start_date': parse_date(number, row['start_date']),
+                          'end_date': parse_date(number, row['end_date'])}
+            elif table == 'work':
+                parsed = {'work_date': parse_date(number, row['work_date']),
+                          'hours_worked': parse_number(number, row['hours_worked'], int),
+                          'status': row.get('status')}
+            else:
+                parsed = {'sprint_hour': parse_number(number, row['sprint_hour'], int),
+                          'duration': parse_number(number, row.get('duration', 2), int),
+                          'note': row.get('note')}
+                if table == 'schedule_task':
+                    self.get_exported(number, 'sprint', row['sprint_id'])
+                    parsed['sprint'] = row['sprint_id']
+                    parsed['sprint_day'] = parse_date(number, row['sprint_day'])
+                else:
+                    parsed['weekday'] = parse_number(number, row['weekday'], int)
+            if table in ('schedule_task', 'recurring_schedule', 'work'):
+                self.get_exported(number, 'task', row['task_id'])
+                parsed['task'] = row['task_id']
+        except KeyError as error:
+            raise ValueError(f'Line {number}: {table} row has no {error}') from error
+        if table in ('task', 'sprint'):
+            parsed['source_id'] = row['id']
+            self.exported[table][row['id']] = None
+        parsed['type'] = table
+        return parsed
+
+    def run(self, records):
+        """
+        Import (line number, record) pairs chunk by chunk
+        Chunks before a bad record stay committed
+        @param records iterable from read_ndjson or read_csv
+        """
+        chunk = []
+        try:
+            for number, record in records:
+                parsed = parse_record(number, record)
+                if parsed['type'] == 'row':
+                    parsed = self.translate_row(parsed)
+                chunk.append(parsed)
+                if len(chunk) >= self.chunk_size:
+                    self.import_chunk(chunk)
+                    chunk = []
+            if chunk:
+                self.import_chunk(chunk)
+        finally:
+            if self.counts.get('work'):
+                rebuild_work_days(self.app_db, self.user_id)
+            # Imported tasks can land in any sprint's totals
+            drop_rollups(self.user_id)
+            bump_data_version(self.user_id)
+        return self.counts
+
+    def import_chunk(self, chunk):
+        """
+        Insert one chunk of parsed records in a single transaction
+        @param chunk list of records from parse_record
+        """
+        try:
+            self.insert_chunk(chunk)
+            self.app_db.session.commit()
+        except Exception:
+            self.app_db.session.rollback()
+            raise
+
+    def insert_parents(self, model, known, new_rows, key):
+        """
+        Bulk insert parent rows and record their new ids
+        return_defaults hands the ids back without a re-query
+        @param model Epic, Story or Tag
+        @param known name map the ids are added to
+        @param new_rows mappings keyed by their map key
+        @param key function giving the map key of a mapping
+        """
+        if not new_rows:
+            return
+        rows = list(new_rows.values())
+        self.app_db.session.bulk_insert_mappings(model, rows, return_defaults=True)
+        for row in rows:
+            known[key(row)] = row['id']
+        self.add_count(model.__tablename__, len(rows))
+
+    def add_count(self, kind, count):
+        """
+        Count records imported of a kind
+        @param kind record type or table name
+        @param count records just inserted
+        """
+        self.counts[kind] = self.counts.get(kind, 0) + count
+
+    def insert_chunk(self, chunk):
+        """
+        Resolve parents then insert a chunk's records
+        @param chunk list of records from parse_record
+        """
+        new_epics, new_tags, new_stories = {}, {}, {}
+        for record in chunk:
+            if record['type'] == 'epic':
+                name = record['name']
+                if name not in self.epics:
+                    new_epics[name] = {'epic': name, 'color': record['color'],
+                                       'deadline': record['deadline'], 'user_id': self.user_id}
+            elif record['type'] in ('story', 'task'):
+                name = record['epic']
+                if name not in self.epics and name not in new_epics:
+                    new_epics[name] = {'epic': name, 'color': None,
+                                       'deadline': None, 'user_id': self.user_id}
+            tags = [record['name']] if record['type'] == 'tag' else record.get('tags', [])
+            for tag in tags:
+                if tag not in self.tags:
+                    new_tags[tag] = {'tag': tag, 'user_id': self.user_id}
+        self.insert_parents(Epic, self.epics, new_epics, lambda x: x['epic'])
+        self.insert_parents(Tag, self.tags, new_tags, lambda x: x['tag'])
+
+        story_tags = []
+        for record in chunk:
+            if record['type'] not in ('story', 'task'):
+                continue
+            epic_id = self.epics[record['epic']]
+            name = record['name'] if record['type'] == 'story' else record['story']
+            if (epic_id, name) in self.stories:
+                continue
+            if (epic_id, name) not in new_stories:
+                new_stories[(epic_id, name)] = {'story': name, 'epic_id': epic_id,
+                                                'prioritization': 1, 'deadline': None,
+                                                'user_id': self.user_id}
+            if record['type'] == 'story':
+                story = new_stories[(epic_id, name)]
+                if record['prioritization'] is not None:
+                    story['prioritization'] = record['prioritization']
+                story['deadline'] = record['deadline']
+                story_tags += [((epic_id, name), tag) for tag in record['tags']]
+        self.insert_parents(Story, self.stories, new_stories,
+                            lambda x: (x['epic_id'], x['story']))
+
+        session = self.app_db.session
+        session.bulk_insert_mappings(TagStory, [
+            {'story_id': self.stories[story], 'tag_id': self.tags[tag]}
+            for story, tag in story_tags])
+        self.insert_sprints([x for x in chunk if x['type'] == 'sprint'])
+        records = [x for x in chunk if x['type'] == 'task']
+        tasks = [{'task': x['name'],
+                  'story_id': self.stories[(self.epics[x['epic']], x['story'])],
+                  'estimate': x['estimate'],
+                  'actual': x['actual'],
+                  'status': x['status'],
+                  'deadline': x['deadline'],
+                  'recurring': x['recurring'],
+                  'sprint_id': self.exported['sprint'].get(x.get('sprint')),
+                  'user_id': self.user_id}
+                 for x in records]
+        # Restored tasks need their new ids for their schedules and work
+        restored = any('source_id' in x for x in records)
+        session.bulk_insert_mappings(Task, tasks, return_defaults=restored)
+        self.counts['task'] += len(tasks)
+        for record, task in zip(records, tasks):
+            if 'source_id' in record:
+                self.exported['task'][record['source_id']] = task['id']
+        self.insert_restored_rows(chunk)
+
+    def insert_sprints(self, records):
+        """
+        Insert a chunk's exported sprints, reusing the
+        user's sprint with the same dates if there is one
+        @param records sprint records from translate_row
+        """
+        new_sprints = {}
+        for record in records:
+            dates = (record['start_date'], record['end_date'])
+            if dates not in self.sprints and dates not in new_sprints:
+                new_sprints[dates] = {'start_date': dates[0], 'end_date': dates[1],
+                                      'user_id': self.user_id}
+        self.insert_parents(Sprint, self.sprints, new_sprints,
+                            lambda x: (x['start_date'], x['end_date']))
+        for record in records:
+            self.exported['sprint'][record['source_id']] = \
+                self.sprints[(record['start_date'], record['end_date'])]
+
+    def insert_restored_rows(self, chunk):
+        """
+        Insert a chunk's exported story tags, schedules
+        and work, once their tasks and sprints have ids.
+        Tags a story has and weekly slots already taken
+        are skipped
+        @param chunk list of records from translate_row
+        """
+        task_ids, sprint_ids = self.exported['task'], self.exported['sprint']
+        rows = {'tag_story': [], 'schedule_task': [], 'recurring_schedule': [], 'work': []}
+        for record in chunk:
+            kind = record['type']
+            if kind == 'tag_story':
+                pair = (self.stories[(self.epics[record['story'][0]], record['story'][1])],
+                        self.tags[record['tag']])
+                if pair not in self.story_tags:
+                    self.story_tags.add(pair)
+                    rows[kind].append({'story_id': pair[0], 'tag_id': pair[1]})
+            elif kind == 'schedule_task':
+                rows[kind].append({'task_id': task_ids[record['task']],
+                                   'sprint_id': sprint_ids[record['sprint']],
+                                   'sprint_day': record['sprint_day'],
+                                   'sprint_hour': record['sprint_hour'],
+                                   'duration': record['duration'],
+                                   'note': record['note'],
+                                   'user_id': self.user_id})
+            elif kind == 'recurring_schedule':
+                slot = (record['weekday'], record['sprint_hour'])
+                if slot not in self.recurring:
+                    self.recurring.add(slot)
+                    rows[kind].append({'task_id': task_ids[record['task']],
+                                       'weekday': record['weekday'],
+                                       'sprint_hour': record['sprint_hour'],
+                                       'duration': record['duration'],
+                                       'note': record['note'],
+                                       'user_id': self.user_id})
+            elif kind == 'work':
+                rows[kind].append({'task_id': task_ids[record['task']],
+                                   'work_date': record['work_date'],
+                                   'hours_worked': record['hours_worked'],
+                                   'status': record['status'],
+                                   'user_id': self.user_id})
+        for model in (TagStory, ScheduleTask, RecurringSchedule, Work):
+            if rows[model.__tablename__]:
+                self.app_db.session.bulk_insert_mappings(model, rows[model.__tablename__])
+                self.add_count(model.__tablename__, len(rows[model.__tablename__]))
+
+
+@bp.route('/', methods=['POST'])
+@login_required
+def import_all():
+    """
+    Import an uploaded NDJSON or CSV file (form field
+    'file') or a raw request body for the current user
+    """
+    upload = request.files.get('file')
+    fmt = request.values.get('format')
+    try:
+        if upload is not None:
+            reader = get_reader(fmt, upload.filename)
+            stream = io.TextIOWrapper(upload.stream, encoding='utf-8')
+        else:
+            if fmt is None and request.mimetype == 'text/csv':
+                fmt = 'csv'
+            reader = get_reader(fmt)
+            stream = io.TextIOWrapper(request.stream, encoding='utf-8')
+    except ValueError as error:
+        return json.dumps({'Success': False, 'error': str(error)}), 400
+    importer = WorkspaceImporter(current_user.id)
+    try:
+        importer.run(reader(stream))
+    except ValueError as error:
+        return json.dumps({'Success': False, 'error': str(error),
+                           'imported': importer.counts}), 400
+    return json.dumps({'Success': True, 'imported': importer.counts})
+
+
+@click.command('import-user')
+@click.argument('username')
+@click.argument('input_file', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default=None,
+              help='Input format (default from the file extension, else ndjson).')
+@click.option('--chunk-size', default=IMPORT_CHUNK_SIZE, show_default=True,
+              help='Records inserted per transaction.')
+@with_appcontext
+def import_user_command(username, input_file, fmt, chunk_size):
+    """
+    Bulk import epics, stories, tasks and tags for USERNAME.
+    """
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException(f'No user named {username}')
+    reader = get_reader(fmt, input_file.name)
+    # The importer reads the existing names from the user's shard
+    with use_shard(user.id):
+        importer = WorkspaceImporter(user.id, chunk_size)
+        try:
+            counts = importer.run(reader(input_file))
+        except ValueError as error:
+            raise click.ClickException(f'{error} (imported so far: {importer.counts})')
+    for kind, count in counts.items():
+        click.echo(f'Imported {count} {kind} records')
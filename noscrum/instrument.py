@@ -0,0 +1,195 @@
+"""
+Per-request query count and timing instrumentation
+
+Every request counts its SQL statements and their time,
+keeps the slowest few and times template rendering. The
+figures go out in a Server-Timing header and one JSON log
+line, and when DEBUG_REQUESTS is set each user can list
+their own last requests at /debug/requests.
+"""
+import heapq
+import json
+import logging
+import threading
+from collections import deque
+from time import perf_counter
+from flask import (
+    Blueprint, abort, current_app, g, has_request_context, render_template, request,
+    before_render_template, request_finished, request_started, template_rendered
+)
+from flask_login import current_user
+from flask_user import login_required
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+bp = Blueprint('instrument', __name__, url_prefix='/debug')
+
+logger = logging.getLogger('noscrum.requests')
+listen_lock = threading.Lock()
+
+# Requests kept for /debug/requests
+REQUEST_HISTORY = 100
+# Slowest statements kept for each request
+SLOW_STATEMENTS = 5
+# Characters of a statement kept for the log and listing
+STATEMENT_LENGTH = 300
+
+
+class RequestStats:
+    """
+    Figures gathered while one request is handled
+    """
+    __slots__ = ('started', 'queries', 'sql_seconds', 'slowest',
+                 'render_seconds', 'render_started')
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.slowest = []
+        self.render_seconds = 0.0
+        self.render_started = None
+
+    def add_query(self, statement, seconds):
+        """
+        Count one statement, keeping it if among the slowest
+        @param statement SQL text as executed
+        @param seconds time the cursor took
+        """
+        self.queries += 1
+        self.sql_seconds += seconds
+        # id() breaks ties without comparing statements
+        entry = (seconds, id(statement), statement)
+        if len(self.slowest) < SLOW_STATEMENTS:
+            heapq.heappush(self.slowest, entry)
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def to_dict(self, response):
+        """
+        Summary of the request for the log and the listing
+        @param response the response being sent
+        """
+        user_id = current_user.id if getattr(current_user, 'is_authenticated', False) else None
+        return {'user_id': user_id,
+                'method': request.method,
+                'path': request.full_path.rstrip('?'),
+                'endpoint': request.endpoint,
+                'status': response.status_code,
+                'queries': self.queries,
+                'sql_ms': round(self.sql_seconds * 1000, 2),
+                'render_ms': round(self.render_seconds * 1000, 2),
+                'total_ms': round((perf_counter() - self.started) * 1000, 2),
+                'slowest': [{'ms': round(seconds * 1000, 2),
+                             'statement': statement[:STATEMENT_LENGTH]}
+                            for seconds, _, statement in sorted(self.slowest, reverse=True)]}
+
+
+def get_stats():
+    """
+    Stats of the request being handled, None outside one
+    or when the app is not instrumented
+    """
+    return g.get('request_stats') if has_request_context() else None
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """
+    Note when a statement starts (SQLAlchemy event); one
+    start per connection, so a statement that fails and
+    never finishes is replaced by the next one
+    """
+    conn.info['query_started'] = (cursor, perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """
+    Add a finished statement to the request's stats
+    """
+    started = conn.info.pop('query_started', None)
+    if started is None or started[0] is not cursor:
+        return
+    seconds = perf_counter() - started[1]
+    stats = get_stats()
+    if stats is not None:
+        stats.add_query(statement, seconds)
+
+
+def start_request(app, **extra):
+    """
+    Begin the request's stats (request_started signal)
+    """
+    g.request_stats = RequestStats()
+
+
+def start_render(app, template, context, **extra):
+    """
+    Time a template render (before_render_template signal)
+    """
+    stats = get_stats()
+    if stats is not None:
+        stats.render_started = perf_counter()
+
+
+def finish_render(app, template, context, **extra):
+    """
+    Add the render's time (template_rendered signal)
+    """
+    stats = get_stats()
+    if stats is not None and stats.render_started is not None:
+        stats.render_seconds += perf_counter() - stats.render_started
+        stats.render_started = None
+
+
+def finish_request(app, response, **extra):
+    """
+    Report the request's stats (request_finished signal)
+    """
+    stats = get_stats()
+    if stats is None:
+        return
+    record = stats.to_dict(response)
+    response.headers['Server-Timing'] = (
+        f"sql;dur={record['sql_ms']};desc=\"{record['queries']} queries\", " +
+        f"render;dur={record['render_ms']}, total;dur={record['total_ms']}")
+    logger.info(json.dumps(record))
+    app.extensions['noscrum_instrument'].append(record)
+
+
+def init_instrument(app):
+    """
+    Instrument the app's requests unless INSTRUMENT_REQUESTS
+    is False; statement timing is hooked into every engine
+    once and only counts inside instrumented requests
+    @param app Flask application
+    """
+    app.config.setdefault('INSTRUMENT_REQUESTS', True)
+    app.config.setdefault('DEBUG_REQUESTS', False)
+    app.extensions['noscrum_instrument'] = deque(
+        maxlen=app.config.setdefault('REQUEST_HISTORY', REQUEST_HISTORY))
+    if not app.config['INSTRUMENT_REQUESTS']:
+        return
+    with listen_lock:
+        if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    request_started.connect(start_request, app)
+    before_render_template.connect(start_render, app)
+    template_rendered.connect(finish_render, app)
+    request_finished.connect(finish_request, app)
+
+
+@bp.route('/requests', methods=('GET',))
+@login_required
+def requests():
+    """
+    List the user's most recent requests, newest first
+    (only when the app sets DEBUG_REQUESTS)
+    """
+    if not current_app.config['DEBUG_REQUESTS']:
+        abort(404)
+    history = [x for x in reversed(current_app.extensions['noscrum_instrument'])
+               if x['user_id'] == current_user.id]
+    if request.args.get('is_json', False):
+        return json.dumps({'Success': True, 'requests': history})
+    return render_template('debug/requests.html', requests=history)
@@ -0,0 +1,83 @@
+"""
+Keyset (cursor) pagination for the is_json list endpoints
+"""
+import base64
+import binascii
+
+from flask import request, abort
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def encode_cursor(last_id):
+    """
+    Make the opaque next-page token for a given id
+    @param last_id identity of the last row sent
+    """
+    return base64.urlsafe_b64encode(f'id:{last_id}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Return the id a next-page token points after
+    @param cursor token given by a previous page
+    """
+    if not cursor:
+        return None
+    try:
+        prefix, last_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+        if prefix != 'id':
+            raise ValueError(prefix)
+        return int(last_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return abort(400, 'Invalid pagination cursor')
+
+
+def get_page_args():
+    """
+    Read limit and after from the request query
+    string; limit is clamped to 1..MAX_LIMIT
+    """
+    try:
+        limit = int(request.args.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        abort(400, 'limit must be an integer')
+    limit = max(1, min(limit, MAX_LIMIT))
+    return decode_cursor(request.args.get('after')), limit
+
+
+def paginate_query(query, id_column):
+    """
+    Apply the request's keyset page to an ORM query
+    Returns the page's rows and the next cursor
+    (None on the last page)
+    @param query SQLAlchemy query for the records
+    @param id_column unique column to page over
+    """
+    after, limit = get_page_args()
+    if after is not None:
+        query = query.filter(id_column > after)
+    rows = query.order_by(id_column).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(getattr(rows[-1], id_column.key))
+
+
+def paginate_rows(rows, limit, key='id'):
+    """
+    Split rows fetched for limit + 1 distinct keys
+    (ordered by key) into the page and next cursor
+    For queries that return several rows per key
+    @param rows result rows ordered by their key
+    @param limit the number of keys in the page
+    @param key name of the column paged over
+    """
+    keys = []
+    for row in rows:
+        if not keys or keys[-1] != row[key]:
+            keys.append(row[key])
+    if len(keys) <= limit:
+        return rows, None
+    return [x for x in rows if x[key] <= keys[limit - 1]], encode_cursor(keys[limit - 1])
@@ -0,0 +1,190 @@
+"""
+Rollup cache for the sprint board's estimate totals
+
+Each (user, sprint) board has one SprintRollup row with
+the sums the board shows, stored as a flat dictionary:
+'totals|<cut>' for the status/epic/story estimate cuts and
+'epics|<id>|<field>' / 'stories|<id>|<field>' for the
+summaries. A write that changes a task takes the task's
+share out of the cached rollups its change reaches and
+puts the new share back, so nothing is recomputed. Each
+of those updates only applies if the rollup's version is
+still the one seen before the change; a rollup that lost
+such a race is dropped, to be rebuilt on the next view.
+"""
+import json
+from contextlib import contextmanager
+from flask_login import current_user
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+from noscrum.db import get_db, SprintRollup, Task, Story, ScheduleTask
+
+ROLLUP_PRECISION = 6
+
+
+def get_task_parts(task, sprint_id, scheduled):
+    """
+    Get the sums one task adds to a sprint's rollup
+    @param task mapping with estimate, status, actual,
+    story_id, epic_id, sprint_id and recurring
+    @param sprint_id sprint of the rollup
+    @param scheduled is the task scheduled in it
+    """
+    in_sprint = task['sprint_id'] == sprint_id
+    if not (in_sprint or task['recurring'] or scheduled):
+        return {}
+    estimate = task['estimate']
+    status = task['status']
+    epic_id = task['epic_id']
+    story_id = task['story_id']
+    parts = {f'totals|{cut}': estimate or 0 for cut in (
+        status, f'e{epic_id}', f'e{epic_id}_{status}', f's{story_id}', f's{story_id}_{status}')}
+    if in_sprint:
+        active = status != 'Done'
+        summary = {'estimate': estimate or 0,
+                   'tasks': 1,
+                   'active_tasks': int(active),
+                   'unestimated_tasks': int(estimate is None),
+                   'rem_estimate': (estimate - (task['actual'] or 0)
+                                    if active and estimate is not None else 0)}
+        for kind, record_id in (('epics', epic_id), ('stories', story_id)):
+            for field, value in summary.items():
+                parts[f'{kind}|{record_id}|{field}'] = value
+    return parts
+
+
+def add_parts(sums, parts, sign=1):
+    """
+    Add (or with sign=-1 take away) parts from sums
+    Sums that reach zero are dropped; absent means 0
+    @param sums rollup dictionary to change
+    @param parts from get_task_parts
+    @param sign 1 to add, -1 to subtract
+    """
+    for key, value in parts.items():
+        total = round(sums.get(key, 0) + sign * value, ROLLUP_PRECISION)
+        if total:
+            sums[key] = total
+        else:
+            sums.pop(key, None)
+
+
+def unpack_rollup(sums):
+    """
+    Split rollup sums into the board's totals dict and
+    the epic and story summaries keyed by record id
+    @param sums rollup dictionary
+    """
+    totals, summaries = {}, {'epics': {}, 'stories': {}}
+    for key, value in sums.items():
+        kind, *names = key.split('|')
+        if kind == 'totals':
+            totals[names[0]] = value
+        else:
+            summaries[kind].setdefault(int(names[0]), {})[names[1]] = value
+    return totals, summaries['epics'], summaries['stories']
+
+
+def get_rollup(sprint_id):
+    """
+    Get the cached sums for the current user's sprint
+    or None if the sprint's board has not been built
+    @param sprint_id sprint of the rollup
+    """
+    rollup = SprintRollup.query.filter(SprintRollup.user_id == current_user.id)\
+        .filter(SprintRollup.sprint_id == sprint_id).first()
+    return None if rollup is None else json.loads(rollup.sums)
+
+
+def save_rollup(sprint_id, sums):
+    """
+    Cache freshly computed sums for the user's sprint;
+    when another worker cached the board first, its
+    (identical) row is kept
+    @param sprint_id sprint of the rollup
+    @param sums rollup dictionary
+    """
+    app_db = get_db()
+    app_db.session.add(SprintRollup(user_id=current_user.id,
+                                    sprint_id=sprint_id,
+                                    sums=json.dumps(sums)))
+    try:
+        app_db.session.commit()
+    except IntegrityError:
+        app_db.session.rollback()
+
+
+def drop_rollups(user_id):
+    """
+    Forget every cached rollup of a user, for changes
+    too broad to follow task by task (eg bulk import)
+    @param user_id owner of the rollups
+    """
+    app_db = get_db()
+    SprintRollup.query.filter(SprintRollup.user_id == user_id).delete()
+    app_db.session.commit()
+
+
+def get_tasks_parts(task_ids, sprint_ids):
+    """
+    Get the combined parts of some tasks for each sprint
+    @param task_ids tasks being changed
+    @param sprint_ids sprints with a cached rollup
+    """
+    app_db = get_db()
+    tasks = app_db.session.query(
+        Task.id, Task.estimate, Task.status, Task.actual, Task.story_id,
+        Story.epic_id, Task.sprint_id, Task.recurring
+    ).join(Story, Story.id == Task.story_id
+    ).filter(Task.user_id == current_user.id
+    ).filter(Task.id.in_(task_ids)).all()
+    scheduled = set(app_db.session.query(ScheduleTask.task_id, ScheduleTask.sprint_id)
+                    .filter(ScheduleTask.user_id == current_user.id)
+                    .filter(ScheduleTask.task_id.in_(task_ids)).distinct())
+    parts = {sprint_id: {} for sprint_id in sprint_ids}
+    for task in tasks:
+        for sprint_id, sprint_parts in parts.items():
+            add_parts(sprint_parts, get_task_parts(
+                task._asdict(), sprint_id, (task.id, sprint_id) in scheduled))
+    return parts
+
+
+@contextmanager
+def rollup_change(*task_ids):
+    """
+    Keep the user's cached rollups current across a
+    change to the given tasks. Yields the list of task
+    ids, so a task created inside can be appended to it
+    @param task_ids tasks the change touches
+    """
+    task_ids = [int(x) for x in task_ids if x is not None]
+    app_db = get_db()
+    seen = {sprint_id: (rollup_id, version) for rollup_id, sprint_id, version in
+            app_db.session.query(SprintRollup.id, SprintRollup.sprint_id, SprintRollup.version)
+            .filter(SprintRollup.user_id == current_user.id)}
+    if not seen:
+        yield task_ids
+        return
+    before = get_tasks_parts(task_ids, seen) if task_ids else {}
+    yield task_ids
+    if not task_ids:
+        return
+    after = get_tasks_parts(task_ids, seen)
+    changed = {seen[x][0]: x for x in seen if before.get(x, {}) != after.get(x, {})}
+    if not changed:
+        return
+    table = SprintRollup.__table__
+    rows = app_db.session.execute(sa.select([table.c.id, table.c.sums])
+                                  .where(table.c.id.in_(changed))).fetchall()
+    for rollup_id, sums in rows:
+        sprint_id = changed[rollup_id]
+        sums = json.loads(sums)
+        add_parts(sums, before.get(sprint_id, {}), -1)
+        add_parts(sums, after.get(sprint_id, {}))
+        saved = app_db.session.execute(
+            table.update().where(table.c.id == rollup_id)
+            .where(table.c.version == seen[sprint_id][1])
+            .values(sums=json.dumps(sums), version=table.c.version + 1))
+        if not saved.rowcount:
+            app_db.session.execute(table.delete().where(table.c.id == rollup_id))
+    app_db.session.commit()
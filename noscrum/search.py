@@ -1,9 +1,209 @@
 """
-Handle search logic (not yet implemeneted)
+Full text search over a user's epics, stories,
+tasks and schedule notes, using SQLite FTS5
 """
-alltext = """select 'task' label,task value, task.id from task
- union all select 'story',story,story.id from story
- union all select 'epic',epic,epic.id from epic
- union all select 'note',note,sr.id from schedule_task sr"""
+import json
+import re
+import click
+import sqlalchemy as sa
+from markupsafe import Markup, escape
+from flask import Blueprint, render_template, request, url_for, abort, current_app
+from flask.cli import with_appcontext
+from flask_login import current_user
+from flask_user import login_required
+from noscrum import sharding
+from noscrum.db import get_db
+from noscrum.pagination import DEFAULT_LIMIT, MAX_LIMIT
 
-magic_search = f"SELECT * from {alltext} WHERE value LIKE '%?%'"
+bp = Blueprint('search', __name__, url_prefix='/search')
+
+SEARCH_TABLE = 'search_index'
+# Index rowid = source id * SEARCH_STRIDE + source code, so
+# the sync triggers reach a row's entry through the rowid
+SEARCH_STRIDE = 8
+# kind: (code, text column, parent column, result link)
+SEARCH_SOURCES = {
+    'task': (0, 'task', 'story_id', ('task.show', 'task_id', 'record_id')),
+    'story': (1, 'story', 'epic_id', ('story.show', 'story_id', 'record_id')),
+    'epic': (2, 'epic', None, ('epic.show', 'epic_id', 'record_id')),
+    'schedule_task': (3, 'note', 'sprint_id', ('sprint.show', 'sprint_id', 'parent_id')),
+    'recurring_schedule': (4, 'note', 'task_id', ('task.show', 'task_id', 'parent_id')),
+}
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+
+
+def get_index_values(kind, row):
+    """
+    SQL expressions for a source row's index entry
+    @param kind source table name
+    @param row 'new'/'old' in a trigger, else the table
+    """
+    code, text, parent, _ = SEARCH_SOURCES[kind]
+    parent_sql = f'{row}.{parent}' if parent else 'NULL'
+    return (f"{row}.id * {SEARCH_STRIDE} + {code}, {row}.{text}, 'u' || {row}.user_id, " +
+            f"'{kind}', {row}.id, {parent_sql}")
+
+
+def get_index_ddl():
+    """
+    The FTS5 table and the triggers keeping it in step
+    with inserts, updates and deletes on every source
+    """
+    columns = 'rowid, body, owner, kind, record_id, parent_id'
+    statements = [
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(' +
+        'body, owner, kind UNINDEXED, record_id UNINDEXED, parent_id UNINDEXED, ' +
+        "prefix='2 3')"]
+    for kind, (code, text, parent, _) in SEARCH_SOURCES.items():
+        insert = (f'INSERT INTO {SEARCH_TABLE} ({columns}) ' +
+                  f'SELECT {get_index_values(kind, "new")} WHERE new.{text} IS NOT NULL;')
+        delete = f'DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id * {SEARCH_STRIDE} + {code};'
+        watched = ', '.join(x for x in (text, 'user_id', parent) if x)
+        statements += [
+            f'CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_{kind}_insert ' +
+            f'AFTER INSERT ON {kind} BEGIN {insert} END',
+            f'CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_{kind}_update ' +
+            f'AFTER UPDATE OF {watched} ON {kind} BEGIN {delete} {insert} END',
+            f'CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_{kind}_delete ' +
+            f'AFTER DELETE ON {kind} BEGIN {delete} END']
+    return statements
+
+
+def install_search(app_db):
+    """
+    Create the search index and its triggers when they
+    are missing, filling a new index from existing rows
+    Returns False if the database cannot host FTS5
+    @param app_db database to install the index in
+    """
+    if app_db.engine.dialect.name != 'sqlite':
+        return False
+    is_new = SEARCH_TABLE not in sa.inspect(app_db.engine).get_table_names()
+    try:
+        for statement in get_index_ddl():
+            app_db.session.execute(statement)
+    except sa.exc.OperationalError:
+        # SQLite built without FTS5
+        app_db.session.rollback()
+        return False
+    app_db.session.commit()
+    if is_new:
+        rebuild_search(app_db)
+    return True
+
+
+def rebuild_search(app_db):
+    """
+    Refill the search index from the source tables
+    Returns the number of entries indexed
+    @param app_db database holding the index
+    """
+    app_db.session.execute(f'DELETE FROM {SEARCH_TABLE}')
+    for kind, (_, text, _, _) in SEARCH_SOURCES.items():
+        app_db.session.execute(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, body, owner, kind, record_id, parent_id) ' +
+            f'SELECT {get_index_values(kind, kind)} FROM {kind} WHERE {text} IS NOT NULL')
+    app_db.session.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+    app_db.session.commit()
+    return app_db.session.execute(f'SELECT count(*) FROM {SEARCH_TABLE}').scalar()
+
+
+def get_match_query(text):
+    """
+    Turn free text into an FTS5 query where every word
+    has to match as a prefix, eg 'dep rel' -> "dep"* "rel"*
+    @param text words typed by the user
+    """
+    words = re.findall(r'\w+', text or '')
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def get_search_results(text, limit, offset):
+    """
+    Get the current user's best matches for the text,
+    ranked by bm25 (the owner column carries no weight);
+    the words only match the body, never the owner
+    @param text words typed by the user
+    @param limit the number of results wanted
+    @param offset results skipped before these
+    """
+    match = get_match_query(text)
+    if not match:
+        return []
+    app_db = get_db()
+    return app_db.session.execute(
+        'SELECT kind, record_id, parent_id, body, ' +
+        f"snippet({SEARCH_TABLE}, 0, '{SNIPPET_START}', '{SNIPPET_END}', '...', 16) AS snippet " +
+        f'FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match ' +
+        f'ORDER BY bm25({SEARCH_TABLE}, 1.0, 0.0) LIMIT :limit OFFSET :offset',
+        {'match': f'owner:"u{current_user.id}" AND body:({match})',
+         'limit': limit, 'offset': offset}).fetchall()
+
+
+def result_to_dict(result):
+    """
+    Prepare a search result for display or JSON
+    @param result row from get_search_results
+    """
+    record = dict(result)
+    endpoint, arg, column = SEARCH_SOURCES[record['kind']][3]
+    record['url'] = url_for(endpoint, **{arg: record[column]})
+    return record
+
+
+def highlight(snippet):
+    """
+    Escape a result snippet and mark the matched words
+    @param snippet text from the FTS5 snippet() function
+    """
+    return Markup(str(escape(snippet))
+                  .replace(SNIPPET_START, '<mark>')
+                  .replace(SNIPPET_END, '</mark>'))
+
+
+@bp.route('/', methods=('GET',))
+@login_required
+def results():
+    """
+    Search the current user's records
+    """
+    is_json = request.args.get('is_json', False)
+    if not current_app.config.get('SEARCH_ENABLED'):
+        abort(501, 'Search needs SQLite with FTS5')
+    text = request.args.get('q', '')
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        limit = max(1, min(int(request.args.get('limit', DEFAULT_LIMIT)), MAX_LIMIT))
+    except ValueError:
+        abort(400, 'page and limit must be integers')
+    found = [result_to_dict(x) for x in
+             get_search_results(text, limit + 1, (page - 1) * limit)]
+    next_page = page + 1 if len(found) > limit else None
+    found = found[:limit]
+    if is_json:
+        for record in found:
+            record['snippet'] = record['snippet'].replace(
+                SNIPPET_START, '').replace(SNIPPET_END, '')
+        return json.dumps({'Success': True, 'q': text, 'results': found,
+                           'page': page, 'next_page': next_page})
+    for record in found:
+        record['snippet'] = highlight(record['snippet'])
+    return render_template('search/results.html', q=text, results=found,
+                           page=page, next_page=next_page, limit=limit)
+
+
+@click.command('rebuild-search')
+@with_appcontext
+def rebuild_search_command():
+    """
+    Rebuild the full text search index from scratch,
+    in each user's shard when the database is sharded.
+    """
+    indexed = 0
+    for _ in sharding.for_each_shard(current_app):
+        app_db = get_db()
+        if not install_search(app_db):
+            raise click.ClickException('Search needs SQLite with FTS5')
+        indexed += rebuild_search(app_db)
+    click.echo(f'Indexed {indexed} records.')
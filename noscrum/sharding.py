@@ -0,0 +1,417 @@
+"""
+Per-user sharding: each user's planning data in a database of its own
+
+With SHARD_DATABASE_URI set (a URI with a {user_id} field, eg
+sqlite:////var/lib/noscrum/shards/user_{user_id}.sqlite) the session
+sends every statement on epics, stories, tasks, sprints, work and
+the rest to the database of the user being served, while users and
+roles stay in the app's own database. One user's commits then never
+wait on another's, and each file only holds the rows its user reads,
+so it stays small and hot in the page cache.
+
+The user served is the logged in user of the request, or the one
+given to use_shard() outside of requests (CLI commands). A shard is
+created on its first use. split-shards moves users' rows from the
+app's database into their shards; merge-shards brings them back,
+before SHARD_DATABASE_URI is unset again.
+"""
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import click
+import sqlalchemy as sa
+from flask import current_app, g, has_app_context
+from flask.cli import with_appcontext
+from flask_login import current_user
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.sql.util import find_tables
+from noscrum.db import get_db, get_user_conditions, bump_data_version, upgrade_tables
+from noscrum.db import User, SprintRollup, WorkDay
+from noscrum import search
+from noscrum.storage import get_engine_options, tune_engine
+
+# Tables kept in the app's database for every user
+SHARED_TABLES = frozenset(['user', 'roles', 'user_roles'])
+SHARD_COPY_BATCH_SIZE = 1000
+
+
+def get_shard_user():
+    """
+    User whose shard serves the current statement,
+    None outside of requests and use_shard()
+    """
+    if not has_app_context():
+        return None
+    user_id = g.get('shard_user_id')
+    # current_user is None outside of requests
+    if user_id is None and getattr(current_user, 'is_authenticated', False):
+        user_id = current_user.id
+    return user_id
+
+
+@contextmanager
+def use_shard(user_id):
+    """
+    Serve statements from a user's shard outside of their
+    requests. The session is closed on the way in and out,
+    so no rows of one database linger for the next
+    @param user_id owner of the shard
+    """
+    app_db = get_db()
+    previous = g.get('shard_user_id')
+    app_db.session.remove()
+    g.shard_user_id = user_id
+    try:
+        yield
+    finally:
+        app_db.session.remove()
+        g.shard_user_id = previous
+
+
+def for_each_shard(app):
+    """
+    Repeat the body of a loop in each user's shard, or
+    once in the app's database when it is not sharded
+        for _ in for_each_shard(app): rebuild(get_db())
+    @param app Flask application
+    """
+    router = app.extensions.get('noscrum_router')
+    if router is None:
+        yield None
+        return
+    for (user_id,) in get_db().session.query(User.id).order_by(User.id).all():
+        if router.has_shard(user_id):
+            with use_shard(user_id):
+                yield user_id
+
+
+def get_owned_tables(user_id):
+    """
+    Each table of a user's data with the condition picking
+    their rows, parents first. Rollups are left out, they
+    are built again on the next board view
+    @param user_id owner of the rows
+    """
+    tables = [(model.__table__, condition) for model, condition in get_user_conditions(user_id)]
+    tables.append((WorkDay.__table__, WorkDay.user_id == user_id))
+    order = get_db().Model.metadata.sorted_tables
+    return sorted(tables, key=lambda x: order.index(x[0]))
+
+
+class ShardRouter():
+    """
+    Picks the engine of each statement for RoutingSession:
+    the shard of the user served, unless the statement only
+    reads or writes the shared tables
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.uri = app.config['SHARD_DATABASE_URI']
+        self.limit = app.config['SHARD_ENGINE_LIMIT']
+        self.engines = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __call__(self, mapper, clause):
+        if mapper is None or mapper.local_table.name in SHARED_TABLES:
+            # A mapper of the shard settles it without walking the statement
+            tables = find_tables(clause, include_crud=True) if clause is not None else []
+            if mapper is not None:
+                tables.append(mapper.local_table)
+            if tables and all(x.name in SHARED_TABLES for x in tables):
+                return None
+        user_id = get_shard_user()
+        return None if user_id is None else self.get_engine(user_id)
+
+    def get_uri(self, user_id):
+        """
+        Database URI of a user's shard; relative SQLite
+        paths are from the app's root, as for the app's own
+        @param user_id owner of the shard
+        """
+        url = make_url(self.uri.format(user_id=int(user_id)))
+        if url.drivername.startswith('sqlite') and url.database not in (None, '', ':memory:'):
+            url.database = os.path.join(self.app.root_path, url.database)
+        return str(url)
+
+    def get_path(self, user_id):
+        """
+        File of a user's shard, None if it is not SQLite
+        @param user_id owner of the shard
+        """
+        url = make_url(self.get_uri(user_id))
+        if url.drivername.startswith('sqlite') and url.database not in (None, '', ':memory:'):
+            return url.database
+        return None
+
+    def has_shard(self, user_id):
+        """
+        Whether a user's shard may hold data
+        @param user_id owner of the shard
+        """
+        path = self.get_path(user_id)
+        return path is None or os.path.exists(path)
+
+    def get_engine(self, user_id):
+        """
+        Engine of a user's shard, made on first use; the
+        least recently used are closed past SHARD_ENGINE_LIMIT
+        @param user_id owner of the shard
+        """
+        with self.lock:
+            engine = self.engines.get(user_id)
+            if engine is not None:
+                self.engines.move_to_end(user_id)
+                return engine
+            engine = self.create_engine(user_id)
+            self.engines[user_id] = engine
+            while len(self.engines) > self.limit:
+                self.engines.popitem(last=False)[1].dispose()
+        return engine
+
+    def create_engine(self, user_id):
+        """
+        Open a user's shard with the app's storage settings,
+        creating its missing tables, columns and indexes
+        @param user_id owner of the shard
+        """
+        uri = self.get_uri(user_id)
+        path = self.get_path(user_id)
+        if path is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        config = dict(self.app.config, SQLALCHEMY_DATABASE_URI=uri,
+                      DB_POOL_SIZE=self.app.config['SHARD_POOL_SIZE'])
+        engine = sa.create_engine(uri, **get_engine_options(config))
+        tune_engine(self.app, engine)
+        tables = [x for x in get_db().Model.metadata.sorted_tables
+                  if x.name not in SHARED_TABLES]
+        get_db().Model.metadata.create_all(engine, tables=tables)
+        upgrade_tables(engine, tables)
+        if self.app.config.get('SEARCH_ENABLED') and engine.dialect.name == 'sqlite':
+            with engine.begin() as connection:
+                for statement in search.get_index_ddl():
+                    connection.execute(statement)
+        return engine
+
+    def close_engine(self, user_id):
+        """
+        Close a user's shard engine if it is open
+        @param user_id owner of the shard
+        """
+        with self.lock:
+            engine = self.engines.pop(user_id, None)
+        if engine is not None:
+            engine.dispose()
+
+
+def init_sharding(app):
+    """
+    Send the app's per-user tables to the users' shards
+    when SHARD_DATABASE_URI is set
+    @param app Flask application
+    """
+    uri = app.config.get('SHARD_DATABASE_URI')
+    if not uri:
+        return
+    if '{user_id}' not in uri:
+        raise ValueError('SHARD_DATABASE_URI needs a {user_id} field, eg ' +
+                         f'sqlite:///shards/user_{{user_id}}.sqlite, not {uri!r}')
+    app.extensions['noscrum_router'] = ShardRouter(app)
+
+
+def get_router(app):
+    """
+    The app's ShardRouter, ValueError if it is not sharded
+    @param app Flask application
+    """
+    router = app.extensions.get('noscrum_router')
+    if router is None:
+        raise ValueError('Set SHARD_DATABASE_URI to split or merge shards')
+    return router
+
+
+def get_offset(source, target, table, condition):
+    """
+    Amount added to the ids of rows copied into target:
+    0 while none of their ids is taken there, else the
+    largest id in target, so they are appended after it
+    @param source connection to read the rows from
+    @param target connection the rows are copied to
+    @param table table of the rows
+    @param condition picks the rows in source
+    """
+    ids = [x for (x,) in source.execute(sa.select([table.c.id]).where(condition))]
+    for start in range(0, len(ids), SHARD_COPY_BATCH_SIZE):
+        taken = sa.select([sa.func.count()]).select_from(table)\
+            .where(table.c.id.in_(ids[start:start + SHARD_COPY_BATCH_SIZE]))
+        if target.execute(taken).scalar():
+            return target.execute(sa.select([sa.func.max(table.c.id)])).scalar()
+    return 0
+
+
+def copy_rows(source, target, table, condition, offsets):
+    """
+    Copy rows between connections in batches, shifting
+    ids and the references to them by the table offsets
+    Returns the number of rows copied
+    @param source connection to read the rows from
+    @param target connection the rows are copied to
+    @param table table of the rows
+    @param condition picks the rows in source
+    @param offsets table name: amount added to its ids
+    """
+    shifts = {}
+    for column in table.columns:
+        if column.primary_key:
+            shifts[column.name] = offsets.get(table.name, 0)
+        for key in column.foreign_keys:
+            shifts[column.name] = offsets.get(key.column.table.name, 0)
+    shifts = {name: shift for name, shift in shifts.items() if shift}
+    result = source.execution_options(stream_results=True)\
+        .execute(table.select().where(condition).order_by(table.c.id))
+    copied = 0
+    try:
+        while True:
+            rows = [dict(x) for x in result.fetchmany(SHARD_COPY_BATCH_SIZE)]
+            if not rows:
+                break
+            for row in rows:
+                for name, shift in shifts.items():
+                    if row[name] is not None:
+                        row[name] += shift
+            target.execute(table.insert(), rows)
+            copied += len(rows)
+    finally:
+        result.close()
+    return copied
+
+
+def move_rows(source_engine, target_engine, user_id, keep=False):
+    """
+    Move a user's rows between databases, replacing any
+    older copy in the target. Rows whose ids are taken in
+    the target get new ones. The target commits first, so
+    a failure can leave the rows in both, never in neither
+    Returns the number of rows moved per table
+    @param source_engine database holding the user's rows
+    @param target_engine database the rows are moved to
+    @param user_id owner of the rows
+    @param keep leave the rows in the source as well
+    """
+    if source_engine.url == target_engine.url:
+        raise ValueError(f'Cannot move rows within {source_engine.url}')
+    tables = get_owned_tables(user_id)
+    rollups = SprintRollup.__table__.delete().where(SprintRollup.user_id == user_id)
+    with source_engine.begin() as source, target_engine.begin() as target:
+        for table, condition in reversed(tables):
+            target.execute(table.delete().where(condition))
+        target.execute(rollups)
+        offsets = {table.name: get_offset(source, target, table, condition)
+                   for table, condition in tables}
+        moved = {table.name: copy_rows(source, target, table, condition, offsets)
+                 for table, condition in tables}
+        if not keep:
+            for table, condition in reversed(tables):
+                source.execute(table.delete().where(condition))
+            source.execute(rollups)
+    return moved
+
+
+def split_user(app, user_id, keep=False):
+    """
+    Move a user's rows from the app's database to their
+    shard. ValueError if the shard already holds data
+    Returns the number of rows moved per table
+    @param app Flask application
+    @param user_id owner of the rows
+    @param keep leave the rows in the app's database as well
+    """
+    shard = get_router(app).get_engine(user_id)
+    with shard.connect() as connection:
+        for table, condition in get_owned_tables(user_id):
+            if connection.execute(sa.select([table.c.id]).where(condition).limit(1)).first():
+                raise ValueError(f'The shard of user {user_id} already holds data')
+    moved = move_rows(get_db().get_engine(app), shard, user_id, keep)
+    bump_data_version(user_id)
+    return moved
+
+
+def merge_user(app, user_id, keep=False):
+    """
+    Move a user's rows from their shard back to the app's
+    database, then delete the shard's file (SQLite)
+    Returns the number of rows moved per table, None
+    for a user without a shard
+    @param app Flask application
+    @param user_id owner of the rows
+    @param keep leave the shard as it is
+    """
+    router = get_router(app)
+    if not router.has_shard(user_id):
+        return None
+    path = router.get_path(user_id)
+    moved = move_rows(router.get_engine(user_id), get_db().get_engine(app),
+                      user_id, keep or path is not None)
+    if not keep and path is not None:
+        router.close_engine(user_id)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    bump_data_version(user_id)
+    return moved
+
+
+def get_users(usernames):
+    """
+    Users named on the command line, or all of them
+    @param usernames usernames given, may be empty
+    """
+    query = User.query.order_by(User.id)
+    if not usernames:
+        return query.all()
+    users = query.filter(User.username.in_(usernames)).all()
+    missing = set(usernames) - {x.username for x in users}
+    if missing:
+        raise click.ClickException(f'No user named {", ".join(sorted(missing))}')
+    return users
+
+
+@click.command('split-shards')
+@click.argument('usernames', nargs=-1)
+@click.option('--keep', is_flag=True, help="Leave the rows in the app's database too.")
+@with_appcontext
+def split_shards_command(usernames, keep):
+    """
+    Move users' data (default everyone's) into their shards.
+    """
+    try:
+        get_router(current_app)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    for user in get_users(usernames):
+        try:
+            moved = split_user(current_app, user.id, keep)
+        except ValueError as error:
+            click.echo(f'{user.username}: skipped, {error}')
+            continue
+        click.echo(f'{user.username}: moved {sum(moved.values())} rows')
+
+
+@click.command('merge-shards')
+@click.argument('usernames', nargs=-1)
+@click.option('--keep', is_flag=True, help='Leave the shards as they are.')
+@with_appcontext
+def merge_shards_command(usernames, keep):
+    """
+    Move users' data (default everyone's) back from their shards.
+    """
+    for user in get_users(usernames):
+        try:
+            moved = merge_user(current_app, user.id, keep)
+        except ValueError as error:
+            raise click.ClickException(str(error))
+        if moved is None:
+            click.echo(f'{user.username}: no shard')
+        else:
+            click.echo(f'{user.username}: moved {sum(moved.values())} rows')
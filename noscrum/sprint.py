@@ -2,18 +2,27 @@
 Sprint View and Database Interaction Module
 """
 from datetime import date, timedelta, datetime
+from functools import lru_cache
 import json
 
 from flask import (
     Blueprint, flash, redirect, render_template, request, url_for, abort
 )
 from flask_user import current_user, login_required
-from sqlalchemy import or_
-from noscrum.db import get_db, Sprint, Task, ScheduleTask
-from noscrum.epic import get_epics
-from noscrum.story import get_stories
+import sqlalchemy as sa
+from noscrum.db import get_db, create_record, Sprint, Task, ScheduleTask, RecurringSchedule
+from noscrum.db import Epic, Story, Work
+from noscrum.rollup import get_rollup, save_rollup, add_parts, get_task_parts, unpack_rollup
+from noscrum.rollup import rollup_change
+from noscrum.pagination import paginate_query
+from noscrum.events import publish_event
+from noscrum.etag import conditional_on_data
 
 statuses = ['To-Do', 'In Progress', 'Done']
+SCHEDULE_OPERATIONS = ('create', 'move', 'delete')
+MAX_SCHEDULE_OPERATIONS = 1000
+# Slot calendars kept, one per sprint dates and working hours
+SLOT_CALENDAR_CACHE_SIZE = 256
 bp = Blueprint('sprint', __name__, url_prefix='/sprint')
 
 def get_task(task_id):
@@ -108,13 +117,10 @@ def create_sprint(start_date, end_date):
     between @param start_date and the end date
     @param end_date
     """
-    app_db = get_db()
-    new_sprint = Sprint(start_date=start_date,
-                        end_date=end_date,
-                        user_id=current_user.id)
-    app_db.session.add(new_sprint)
-    app_db.session.commit()
-    return get_sprint_by_date(start_date=start_date, end_date=end_date)
+    return create_record(Sprint,
+                         start_date=start_date,
+                         end_date=end_date,
+                         user_id=current_user.id)
 
 
 def update_sprint(sprint_id, start_date, end_date):
@@ -191,7 +197,7 @@ def get_schedule_by_time(sprint_id, sprint_day, sprint_hour, schedule_id=None):
     return query.first()
 
 
-def create_schedule(sprint_id, task_id, sprint_day, sprint_hour, note):
+def create_schedule(sprint_id, task_id, sprint_day, sprint_hour, note, duration=None):
     """
     Create a new schedule for the task with ID
     @param task_id ID for task being scheduled
@@ -199,17 +205,18 @@ def create_schedule(sprint_id, task_id, sprint_day, sprint_hour, note):
     @param sprint_day the day for the schedule
     @param sprint_hour the schedule time value
     @param note Free field for clarifying time
+    @param duration (optional) hours scheduled,
+    the user's slot length by default
     """
-    app_db = get_db()
-    new_schedule = ScheduleTask(sprint_id=sprint_id,
-                                task_id=task_id,
-                                sprint_day=sprint_day,
-                                sprint_hour=sprint_hour,
-                                note=note,
-                                user_id=current_user.id)
-    app_db.session.add(new_schedule)
-    app_db.session.commit()
-    return get_schedule_by_time(sprint_id, sprint_day, sprint_hour)
+    with rollup_change(task_id):
+        return create_record(ScheduleTask,
+                             sprint_id=int(sprint_id),
+                             task_id=int(task_id),
+                             sprint_day=sprint_day,
+                             sprint_hour=int(sprint_hour),
+                             duration=int(duration or current_user.slot_hours),
+                             note=note,
+                             user_id=current_user.id)
 
 
 def update_schedule(sched_id, task_id, sprint_day, sprint_hour, note):
@@ -237,64 +244,343 @@ def delete_schedule(sched_id):
     @sched_id ScheduleTask chosen for deletion
     """
     app_db = get_db()
-    ScheduleTask.query.filter(ScheduleTask.id == sched_id)\
-        .filter(ScheduleTask.user_id == current_user.id)\
+    query = ScheduleTask.query.filter(ScheduleTask.id == sched_id)\
+        .filter(ScheduleTask.user_id == current_user.id)
+    schedule_task = query.first()
+    with rollup_change(None if schedule_task is None else schedule_task.task_id):
+        query.delete()
+        app_db.session.commit()
+
+
+def parse_schedule_operation(operation, sprint):
+    """
+    Check one operation of a schedule batch and convert
+    its fields, raising ValueError when it is not valid
+    @param operation dictionary from the request body
+    @param sprint the Sprint record being scheduled
+    """
+    if not isinstance(operation, dict) or operation.get('op') not in SCHEDULE_OPERATIONS:
+        raise ValueError(f'Each operation needs an op of {", ".join(SCHEDULE_OPERATIONS)}')
+    kind = operation['op']
+    parsed = {'op': kind}
+    try:
+        if kind != 'create':
+            parsed['schedule_id'] = int(operation['schedule_id'])
+        if kind != 'delete':
+            parsed['sprint_day'] = datetime.strptime(operation['sprint_day'], '%Y-%m-%d').date()
+            parsed['sprint_hour'] = int(operation['sprint_hour'])
+            if operation.get('duration') is not None:
+                parsed['duration'] = int(operation['duration'])
+        if kind == 'create':
+            parsed['task_id'] = int(operation['task_id'])
+            parsed.setdefault('duration', current_user.slot_hours)
+    except (KeyError, TypeError, ValueError) as error:
+        raise ValueError(f'Invalid {kind} operation {operation}: {error}') from error
+    if 'note' in operation and kind != 'delete':
+        parsed['note'] = operation['note']
+    if kind != 'delete':
+        if not sprint.start_date <= parsed['sprint_day'] <= sprint.end_date:
+            raise ValueError(f"Day {parsed['sprint_day']} is outside the sprint")
+        if not 0 <= parsed['sprint_hour'] <= 24:
+            raise ValueError('Sprint Hour must be from 0 to 24')
+        # A move without a duration keeps its own, checked once applied
+        if 'duration' in parsed and not 0 < parsed['duration'] <= 24 - parsed['sprint_hour']:
+            raise ValueError('Duration must fit in the day')
+    return parsed
+
+
+def apply_schedule_batch(sprint, operations):
+    """
+    Apply create/move/delete operations to the schedule
+    of a sprint in one transaction. The operations are
+    played in order on a map of the sprint's slots, where
+    a task put in a slot replaces whatever was there, and
+    only the difference is written: one delete, one update
+    and one insert. Each operation is checked against the
+    slots as the operations before it left them, so a slot
+    emptied earlier in the batch can be filled again, and
+    a schedule replaced or deleted earlier cannot be moved.
+    Nothing is written if any operation is invalid
+    (ValueError). Returns the sprint's schedule and
+    the deleted, moved and created schedules
+    @param sprint the Sprint record being scheduled
+    @param operations from parse_schedule_operation
+    """
+    app_db = get_db()
+    rows = app_db.session.query(
+        ScheduleTask.id, ScheduleTask.task_id, ScheduleTask.sprint_day,
+        ScheduleTask.sprint_hour, ScheduleTask.duration, ScheduleTask.note
+    ).filter(ScheduleTask.user_id == current_user.id
+    ).filter(ScheduleTask.sprint_id == sprint.id).all()
+    original = {row.id: row._asdict() for row in rows}
+    schedules = {x: dict(y) for x, y in original.items()}
+    task_ids = {x['task_id'] for x in operations if x['op'] == 'create'}
+    if task_ids:
+        found = {x for x, in app_db.session.query(Task.id)
+                 .filter(Task.user_id == current_user.id)
+                 .filter(Task.id.in_(task_ids))}
+        if task_ids - found:
+            raise ValueError(f'Tasks {sorted(task_ids - found)} not found')
+    # Where each existing schedule sits as the operations play
+    placed = {x: (y['sprint_day'], y['sprint_hour']) for x, y in schedules.items()}
+    slots = {}
+    for schedule_id, slot in placed.items():
+        slots.setdefault(slot, []).append(schedules[schedule_id])
+    for operation in operations:
+        if operation['op'] == 'create':
+            schedule_task = {'id': None, 'task_id': operation['task_id'], 'note': None,
+                             'duration': operation['duration']}
+        else:
+            slot = placed.pop(operation['schedule_id'], None)
+            if slot is None:
+                raise ValueError(f"Schedule {operation['schedule_id']} not found in sprint")
+            schedule_task = schedules[operation['schedule_id']]
+            slots[slot] = [x for x in slots[slot] if x is not schedule_task]
+        if operation['op'] != 'delete':
+            slot = (operation['sprint_day'], operation['sprint_hour'])
+            for replaced in slots.get(slot, []):
+                placed.pop(replaced['id'], None)
+            schedule_task['sprint_day'] = operation['sprint_day']
+            schedule_task['sprint_hour'] = operation['sprint_hour']
+            schedule_task['duration'] = operation.get('duration', schedule_task['duration'])
+            schedule_task['note'] = operation.get('note', schedule_task['note'])
+            if schedule_task['sprint_hour'] + schedule_task['duration'] > 24:
+                raise ValueError(f"Schedule {schedule_task['id']} must fit in the day")
+            slots[slot] = [schedule_task]
+            if schedule_task['id'] is not None:
+                placed[schedule_task['id']] = slot
+    result = [x for slot in slots.values() for x in slot]
+    kept = {x['id'] for x in result}
+    deleted = [y for x, y in original.items() if x not in kept]
+    moved = [x for x in result if x['id'] is not None and x != original[x['id']]]
+    created = [x for x in result if x['id'] is None]
+    changed_tasks = [x['task_id'] for x in deleted + moved + created]
+    with rollup_change(*changed_tasks):
+        if deleted:
+            ScheduleTask.query.filter(ScheduleTask.id.in_([x['id'] for x in deleted]))\
+                .delete(synchronize_session=False)
+        app_db.session.bulk_update_mappings(ScheduleTask, moved)
+        new_rows = [{'task_id': x['task_id'],
+                     'sprint_id': sprint.id,
+                     'user_id': current_user.id,
+                     'sprint_day': x['sprint_day'],
+                     'sprint_hour': x['sprint_hour'],
+                     'duration': x['duration'],
+                     'note': x['note']} for x in created]
+        app_db.session.bulk_insert_mappings(ScheduleTask, new_rows, return_defaults=True)
+        app_db.session.commit()
+    for schedule_task, row in zip(created, new_rows):
+        schedule_task['id'] = row['id']
+    result.sort(key=lambda x: (x['sprint_day'], x['sprint_hour']))
+    return result, {'deleted': deleted, 'moved': moved, 'created': created}
+
+
+def get_recurring_schedule(recurring_id):
+    """
+    Get a RecurringSchedule template by its id
+    @param recurring_id template ID you desire
+    """
+    return RecurringSchedule.query\
+        .filter(RecurringSchedule.id == recurring_id)\
+        .filter(RecurringSchedule.user_id == current_user.id).first()
+
+
+def create_recurring_schedule(task_id, weekday, sprint_hour, note, duration=None):
+    """
+    Schedule a recurring task on a weekday and
+    hour of every sprint, replacing whichever
+    template already holds that weekly slot
+    @param task_id ID for task being scheduled
+    @param weekday day of the week, Monday = 0
+    @param sprint_hour the schedule time value
+    @param note Free field for clarifying time
+    @param duration (optional) hours scheduled,
+    the user's slot length by default
+    """
+    app_db = get_db()
+    template = RecurringSchedule.query\
+        .filter(RecurringSchedule.user_id == current_user.id)\
+        .filter(RecurringSchedule.weekday == weekday)\
+        .filter(RecurringSchedule.sprint_hour == sprint_hour).first()
+    if template is None:
+        template = RecurringSchedule(user_id=current_user.id,
+                                     weekday=weekday,
+                                     sprint_hour=sprint_hour)
+        app_db.session.add(template)
+    template.task_id = task_id
+    template.duration = int(duration or current_user.slot_hours)
+    template.note = note
+    app_db.session.commit()
+    return template
+
+
+def delete_recurring_schedule(recurring_id):
+    """
+    Delete a RecurringSchedule template record
+    @param recurring_id template for deletion
+    """
+    app_db = get_db()
+    RecurringSchedule.query.filter(RecurringSchedule.id == recurring_id)\
+        .filter(RecurringSchedule.user_id == current_user.id)\
         .delete()
     app_db.session.commit()
 
 
-def get_sprint_details(sprint_id):
+def get_recurring_schedules_for_sprint(sprint):
+    """
+    Expand the user's recurring templates into
+    the days of a sprint. Cost is the number of
+    templates plus the days in the sprint, no
+    matter how many sprints have gone before
+    @param sprint the Sprint record to expand
+    """
+    app_db = get_db()
+    templates = app_db.session.query(
+        RecurringSchedule.id, RecurringSchedule.task_id,
+        RecurringSchedule.weekday, RecurringSchedule.sprint_hour,
+        RecurringSchedule.duration, RecurringSchedule.note
+    ).join(Task, Task.id == RecurringSchedule.task_id
+    ).filter(RecurringSchedule.user_id == current_user.id
+    ).filter(Task.recurring
+    ).all()
+    days_by_weekday = {}
+    current_day = sprint.start_date
+    while current_day <= sprint.end_date:
+        days_by_weekday.setdefault(current_day.weekday(), []).append(current_day)
+        current_day += timedelta(1)
+    return [{'id': template.id,
+             'task_id': template.task_id,
+             'sprint_id': sprint.id,
+             'sprint_day': sprint_day,
+             'sprint_hour': template.sprint_hour,
+             'duration': template.duration,
+             'note': template.note,
+             'recurring_schedule': 1}
+            for template in templates
+            for sprint_day in days_by_weekday.get(template.weekday, [])]
+
+
+@lru_cache(maxsize=SLOT_CALENDAR_CACHE_SIZE)
+def get_slot_calendar(start_date, end_date, day_start, day_end, slot_hours):
+    """
+    Get the board calendar of a sprint: a (day number,
+    day, slot start hours) tuple for each of its days.
+    Built once per sprint dates and working hours
+    @param start_date first day of the sprint
+    @param end_date last day of the sprint
+    @param day_start hour the first slot starts
+    @param day_end hour the last slot has to end by
+    @param slot_hours length of each slot in hours
+    """
+    hours = tuple(range(day_start, day_end - slot_hours + 1, slot_hours))
+    return tuple((i, start_date + timedelta(i), hours)
+                 for i in range((end_date - start_date).days + 1))
+
+
+def get_sprint_details(sprint_id, sprint=None):
     """
     Get detailed records for given sprint with
     @param sprint_id sprint details are wanted
+    @param sprint (optional) the Sprint record
+    when the caller has already fetched it. The
+    board is assembled from the sprint schedule,
+    the recurring templates, and one query for
+    the epic/story/task tree which is split into
+    dicts keyed by id. Estimate sums come from the
+    sprint's rollup, computed here on first view
     """
     app_db = get_db()
-    stories = get_stories(sprint_view=True, sprint_id=sprint_id)
-    epics = get_epics(sprint_view=True, sprint_id=sprint_id)
-    # tasks = #get_tasks().filter(Task.sprint_id == sprint_id)
-    tasks = app_db.session.execute(
-        'SELECT task.id, task, estimate, status, story_id, ' +
-        'epic_id, actual, task.deadline, task.recurring, coalesce(hours_worked,0) hours_worked, ' +
-        'coalesce(sum_sched,0) sum_sched, ' +
-        '(task.sprint_ID = sched.sprint_id) single_sprint_task ' +
-        'FROM task ' +
-        'JOIN story ON task.story_id = story.id ' +
-        'LEFT OUTER JOIN (SELECT task_id, sum(hours_worked) hours_worked ' +
-        'FROM work group by task_id) woik ' +
-        'ON woik.task_id = task.id ' +
-        'LEFT OUTER JOIN (select task_id, sprint_id, count(1) * 2 sum_sched ' +
-        'FROM schedule_task group by task_id, sprint_id) sched ' +
-        'ON task.id = sched.task_id AND sched.sprint_id = :sprint_id ' +
-        'WHERE task.user_id = :user_id ' +
-        'AND (task.sprint_ID = :sprint_id or coalesce(task.recurring,0) = 1 or ' +
-        'task.id in (select task_id from schedule_task where sprint_id = :sprint_id))',
-        {'sprint_id': sprint_id, 'user_id': current_user.id}).fetchall()
-    unplanned_tasks = Task.query.filter(Task.user_id == current_user.id
-                               ).filter(or_(Task.sprint_id == None,Task.sprint_id != sprint_id)
-                               ).all()
-    sprint_days = Sprint.query.filter(Sprint.id == sprint_id)\
-        .filter(Sprint.user_id == current_user.id).first()
-    schedule_records_std = ScheduleTask.query\
-        .filter(ScheduleTask.sprint_id == sprint_id)\
-        .filter(ScheduleTask.user_id == current_user.id)
-    schedule_records_recurring = ScheduleTask.query.join(Task)\
-        .filter(Task.recurring)\
-        .filter(ScheduleTask.user_id == current_user.id)
-    schedule_records_dict = {f'{x.sprint_day}T{x.sprint_hour}:00': x
-                             for x in schedule_records_recurring}
-    for record_std in schedule_records_std:
-        key = f'{record_std.sprint_day}T{record_std.sprint_hour}:00'
-        schedule_records_dict[key] = record_std
+    if sprint is None:
+        sprint = get_sprint(sprint_id)
+    schedule_rows = app_db.session.query(
+        ScheduleTask.id, ScheduleTask.task_id, ScheduleTask.sprint_id,
+        ScheduleTask.sprint_day, ScheduleTask.sprint_hour, ScheduleTask.duration,
+        ScheduleTask.note
+    ).filter(ScheduleTask.user_id == current_user.id
+    ).filter(ScheduleTask.sprint_id == sprint_id
+    ).all()
+    # Recurring records go in first so this sprint's own records win a slot
+    schedule_records_dict = {f"{x['sprint_day']}T{x['sprint_hour']}:00": x
+                             for x in get_recurring_schedules_for_sprint(sprint)}
+    sum_sched = {}
+    for record in schedule_rows:
+        schedule_records_dict[f'{record.sprint_day}T{record.sprint_hour}:00'] = record._asdict()
+        sum_sched[record.task_id] = sum_sched.get(record.task_id, 0) + record.duration
     schedule_records = list(schedule_records_dict.values())
 
-    current_day = sprint_days.start_date
-    i = 0
-    schedule_list = []
-    while current_day <= sprint_days.end_date:
-        schedule_list.append((i, current_day, range(9, 22, 2)))
-        i += 1
-        current_day += timedelta(1)
-    return stories, epics, tasks, schedule_list, schedule_records, unplanned_tasks
+    scheduled = app_db.session.query(ScheduleTask.task_id).distinct()\
+        .filter(ScheduleTask.user_id == current_user.id)\
+        .filter(ScheduleTask.sprint_id == sprint_id).subquery()
+    hours_worked = sa.select([sa.func.coalesce(sa.func.sum(Work.hours_worked), 0)])\
+        .where(Work.task_id == Task.id).as_scalar()
+    on_board = sa.or_(Task.sprint_id == sprint_id, Task.recurring.is_(True),
+                      Task.id.in_(scheduled))
+    query = app_db.session.query(
+        Epic.id.label('epic_id'), Epic.epic, Epic.color, Epic.deadline.label('epic_deadline'),
+        Story.id.label('story_id'), Story.story, Story.prioritization,
+        Story.deadline.label('story_deadline'),
+        Task.id.label('task_id'), Task.task, Task.estimate, Task.status, Task.actual,
+        Task.deadline, Task.recurring, Task.sprint_id,
+        sa.case([(on_board, hours_worked)]).label('hours_worked')
+    ).outerjoin(Story, sa.and_(Story.epic_id == Epic.id, Story.user_id == current_user.id)
+    ).outerjoin(Task, sa.and_(Task.story_id == Story.id, Task.user_id == current_user.id)
+    ).filter(Epic.user_id == current_user.id
+    # Spelled out so SQLite and PostgreSQL return the same order
+    ).order_by(Story.prioritization.desc().nullslast(), Epic.id, Story.id, Task.id)
+    rows = app_db.session.execute(query.statement).fetchall()
+
+    sums = get_rollup(sprint_id)
+    is_cached = sums is not None
+    if not is_cached:
+        sums = {}
+    epics, stories, tasks, unplanned_tasks = {}, {}, {}, []
+    for (epic_id, epic, color, epic_deadline, story_id, story, prioritization,
+         story_deadline, task_id, task, estimate, status, actual, deadline,
+         recurring, task_sprint_id, hours_worked) in rows:
+        if epic_id not in epics:
+            epics[epic_id] = {'id': epic_id,
+                              'epic': 'No Epic' if epic == 'NULL' else epic,
+                              'color': color, 'deadline': epic_deadline,
+                              'estimate': 0, 'tasks': 0, 'active_tasks': 0,
+                              'unestimated_tasks': 0, 'rem_estimate': 0}
+        if story_id is None:
+            continue
+        if story_id not in stories:
+            stories[story_id] = {'id': story_id,
+                                 'story': 'No Story' if story == 'NULL' else story,
+                                 'epic_id': epic_id, 'prioritization': prioritization,
+                                 'deadline': story_deadline,
+                                 'estimate': 0, 'tasks': 0, 'active_tasks': 0,
+                                 'unestimated_tasks': 0, 'rem_estimate': 0}
+        if task_id is None:
+            continue
+        if task_sprint_id != sprint_id:
+            unplanned_tasks.append({'id': task_id, 'task': task, 'story_id': story_id,
+                                    'epic_id': epic_id})
+        if hours_worked is not None:
+            tasks[task_id] = {'id': task_id, 'task': task, 'estimate': estimate,
+                              'status': status, 'story_id': story_id, 'epic_id': epic_id,
+                              'actual': actual, 'deadline': deadline, 'recurring': recurring,
+                              'sprint_id': task_sprint_id,
+                              'hours_worked': hours_worked,
+                              'sum_sched': sum_sched.get(task_id, 0),
+                              'single_sprint_task': (task_sprint_id == sprint_id
+                                                     if task_id in sum_sched else None)}
+            if not is_cached:
+                add_parts(sums, get_task_parts(tasks[task_id], sprint_id, task_id in sum_sched))
+    if not is_cached:
+        save_rollup(sprint_id, sums)
+    totals, epic_sums, story_sums = unpack_rollup(sums)
+    for epic_id, summary in epic_sums.items():
+        if epic_id in epics:
+            epics[epic_id].update(summary)
+    for story_id, summary in story_sums.items():
+        if story_id in stories:
+            stories[story_id].update(summary)
+
+    schedule_list = get_slot_calendar(sprint.start_date, sprint.end_date, current_user.day_start,
+                                      current_user.day_end, current_user.slot_hours)
+    return stories, epics, tasks, totals, schedule_list, schedule_records, unplanned_tasks
 
 
 def get_sprint_board(sprint_id, sprint, is_static=False):
@@ -304,31 +590,26 @@ def get_sprint_board(sprint_id, sprint, is_static=False):
     @param sprint record of board (only dates)
     @param is_static (optional) is unchanging?
     """
-    stories, epics, tasks, schedule_list, schedule_records, unplanned_tasks = get_sprint_details(
-        sprint_id)
-    tasks = {x['id']: dict(x) for x in tasks}
-    stories = {x['id']: dict(x) for x in stories}
-    epics = {x['id']: dict(x) for x in epics}
-    # Get Estimate Totals by story/epic at each status level
-    totals = {}
-    # sum up totals btw I don't like how this is implemented
-    # this will appear in your next annual review >:-(
-    for task in tasks.values():
-        estimate = task['estimate']
-        estimate = 0 if estimate is None else estimate
-        story_id = task['story_id']
-        epic_id = task['epic_id']
-        status = task['status']
-        cuts = [status, f'e{epic_id}',
-                        f'e{epic_id}_{status}',
-                        f's{story_id}',
-                        f's{story_id}_{status}']
-        for cut in cuts:
-            totals[cut] = totals.get(cut, 0)+estimate
+    (stories, epics, tasks, totals, schedule_list, schedule_records,
+     unplanned_tasks) = get_sprint_details(sprint_id, sprint)
+    # Index the schedule by slot so the calendar does one lookup per cell
+    slots = {}
+    day_totals = {}
     for schedule_item in schedule_records:
-        cuts = [f"d{schedule_item.sprint_day.strftime('%yyyy-%mm-%dd')}",'sprint']
-        for cut in cuts:
-            totals[cut] = totals.get(cut,0) + 2 #FIXME: Schedule Item should set hour amount
+        sprint_day = schedule_item['sprint_day']
+        slots.setdefault((sprint_day, schedule_item['sprint_hour']), []).append(schedule_item)
+        day_totals[sprint_day] = day_totals.get(sprint_day, 0) + schedule_item['duration']
+        totals['sprint'] = totals.get('sprint', 0) + schedule_item['duration']
+    # Slots made before the working hours changed keep their own rows
+    hours = set(schedule_list[0][2]) if schedule_list else set()
+    off_grid = {}
+    for sprint_day, hour in slots:
+        if hour not in hours:
+            off_grid.setdefault(sprint_day, set()).add(hour)
+    if off_grid:
+        schedule_list = [(i, day, tuple(sorted(off_grid[day].union(day_hours))))
+                         if day in off_grid else (i, day, day_hours)
+                         for i, day, day_hours in schedule_list]
     return render_template('sprint/board.html',
                            sprint=sprint,
                            sprint_id=sprint_id,
@@ -340,7 +621,9 @@ def get_sprint_board(sprint_id, sprint, is_static=False):
                            static=is_static,
                            schedule=schedule_list,
                            unplanned_tasks=unplanned_tasks,
-                           schedule_records=schedule_records)
+                           slots=slots,
+                           slot_hours=current_user.slot_hours,
+                           day_totals=day_totals)
 
 
 @bp.route('/schedule/<int:sprint_id>', methods=('GET', 'POST', 'DELETE'))
@@ -359,14 +642,13 @@ def schedule(sprint_id):
         sprint_hour = request.form.get('sprint_hour', None)
         schedule_id = request.form.get('schedule_id', None)
         note = request.form.get('note')
-        recurring = request.form.get('recurring', 0)
+        duration = request.form.get('duration', str(current_user.slot_hours))
+        recurring = request.form.get('recurring', '0') == '1'
         error = None
-        if recurring == '1':
+        if recurring:
             task = get_task(task_id)
-            if not task.recurring:
+            if task is None or not task.recurring:
                 error = 'Task not set as recurring, cannot schedule as recurring'
-            else:
-                sprint_id = 0
         if task_id is None:
             error = 'No Task ID Found in Request'
         elif sprint_day is None:
@@ -375,8 +657,20 @@ def schedule(sprint_id):
             error = 'No Sprint Hour Found in Request'
         elif sprint_day > sprint.end_date:
             error = 'Scheduled day is after sprint end'
+        elif not sprint_hour.isdigit():
+            error = 'Sprint Hour must be a whole number'
         elif int(sprint_hour) > 24:
             error = 'Sprint Hour is > 24'
+        elif not duration.isdigit() or not 0 < int(duration) <= 24 - int(sprint_hour):
+            error = 'Duration must be whole hours that fit in the day'
+        if error is None and recurring:
+            schedule_task = create_recurring_schedule(
+                task_id, sprint_day.weekday(), int(sprint_hour), note, int(duration))
+            publish_event('schedule_created', None, recurring=True,
+                          schedule_task=schedule_task.to_dict())
+            if is_json:
+                return {'Success': True, 'schedule_task': schedule_task.to_dict()}
+            return redirect(url_for('sprint.show', sprint_id=sprint_id))
         if error is None:
             old_record = get_schedule_by_time(sprint_id,
                                               sprint_day,
@@ -385,16 +679,23 @@ def schedule(sprint_id):
             if old_record is not None:
                 if old_record.id == schedule_id:
                     raise Exception("Old schedule flagged as duplicate")
+                old_schedule = old_record.to_dict()
                 delete_schedule(old_record.id)
+                publish_event('schedule_deleted', sprint_id,
+                              task_id=old_schedule['task_id'], schedule_id=old_schedule['id'])
                 schedule_id = None
                 # error = f'Day {sprint_day} at {sprint_hour} is already scheduled.
                 # Delete the existing task before scheduling another'
             if schedule_id is None:
                 schedule_task = create_schedule(
-                    sprint_id, task_id, sprint_day, sprint_hour, note)
+                    sprint_id, task_id, sprint_day, sprint_hour, note, int(duration))
+                publish_event('schedule_created', sprint_id,
+                              schedule_task=schedule_task.to_dict())
             else:
                 schedule_task = update_schedule(
                     schedule_id, task_id, sprint_day, sprint_hour, note)
+                publish_event('schedule_updated', sprint_id,
+                              schedule_task=schedule_task.to_dict())
 
             #print(f'Adding schedule for task {task_id} to sprint {sprint_id} ' +
             #      'on {sprint_day} {sprint_hour}:00')
@@ -406,22 +707,35 @@ def schedule(sprint_id):
                 return {'Success': True, 'schedule_task': schedule_task.to_dict()}
             return redirect(url_for('sprint.show', sprint_id=sprint_id))
         if is_json:
-            abort(500, error)
+            abort(400, error)
         flash(error, 'error')
     elif request.method == 'DELETE':
         #print(f'{request.method} and {request.method == "DELETE"}')
         schedule_id = request.form.get('schedule_id', None)
-        if request.form.get('recurring', 0) == 1:
-            sprint_id = 0
         error = None
         if schedule_id is None:
             error = 'No Schedule ID Requested to Delete'
+        elif request.form.get('recurring', '0') == '1':
+            template = get_recurring_schedule(schedule_id)
+            if template is None:
+                abort(404, 'Recurring schedule not found')
+            output = {'Success': True,
+                      'task_id': template.task_id,
+                      'schedule_id': template.id}
+            delete_recurring_schedule(schedule_id)
+            publish_event('schedule_deleted', None, recurring=True,
+                          task_id=output['task_id'], schedule_id=output['schedule_id'])
+            if is_json:
+                return json.dumps(output)
+            return f'Recurring schedule {schedule_id} deleted.'
         if error is None:
             deleted_schedule = get_schedule(schedule_id)
             output = {'Success': True,
                                    'task_id': deleted_schedule.task_id,
                                    'schedule_id': deleted_schedule.id}
             delete_schedule(schedule_id)
+            publish_event('schedule_deleted', sprint_id,
+                          task_id=output['task_id'], schedule_id=output['schedule_id'])
             if is_json:
                 return json.dumps(output)
             return f'Schedule {schedule_id} deleted.'
@@ -445,6 +759,51 @@ def schedule(sprint_id):
     return redirect(url_for('sprint.show', sprint_id=sprint_id))
 
 
+@bp.route('/schedule/<int:sprint_id>/batch', methods=('POST',))
+@login_required
+def schedule_batch(sprint_id):
+    """
+    Apply many schedule changes to a sprint at once
+    POST: JSON {"operations": [...]} where each is
+    {"op": "create", "task_id", "sprint_day", "sprint_hour", "duration", "note"},
+    {"op": "move", "schedule_id", "sprint_day", "sprint_hour", "duration", "note"}
+    or {"op": "delete", "schedule_id"}; duration and note are optional.
+    Returns the sprint's resulting slot map
+    @param sprint_id sprint being scheduled
+    """
+    sprint = get_sprint(sprint_id)
+    if sprint is None:
+        abort(404, f'Sprint {sprint_id} not found')
+    operations = (request.get_json(silent=True) or {}).get('operations')
+    if not isinstance(operations, list):
+        abort(400, 'Request needs a JSON list of operations')
+    if len(operations) > MAX_SCHEDULE_OPERATIONS:
+        abort(400, f'At most {MAX_SCHEDULE_OPERATIONS} operations per batch')
+    try:
+        operations = [parse_schedule_operation(x, sprint) for x in operations]
+        schedule_tasks, changes = apply_schedule_batch(sprint, operations)
+    except ValueError as error:
+        abort(400, str(error))
+    for schedule_task in changes['deleted'] + changes['moved']:
+        publish_event('schedule_deleted', sprint_id,
+                      task_id=schedule_task['task_id'], schedule_id=schedule_task['id'])
+    for schedule_task in changes['moved'] + changes['created']:
+        publish_event('schedule_created', sprint_id,
+                      schedule_task=dict(schedule_task, sprint_id=sprint_id,
+                                         sprint_day=str(schedule_task['sprint_day'])))
+    slots = {}
+    for schedule_task in schedule_tasks:
+        slots.setdefault(str(schedule_task['sprint_day']), {})[schedule_task['sprint_hour']] = {
+            'id': schedule_task['id'],
+            'task_id': schedule_task['task_id'],
+            'duration': schedule_task['duration'],
+            'note': schedule_task['note']}
+    return json.dumps({'Success': True, 'sprint_id': sprint_id, 'slots': slots,
+                       'deleted': len(changes['deleted']),
+                       'moved': len(changes['moved']),
+                       'created': len(changes['created'])})
+
+
 @bp.route('/create/next', methods=('POST',))
 @login_required
 def create_next():
@@ -535,19 +894,23 @@ def list_all():
     List all of the Sprints for a current user
     """
     is_json = request.args.get('is_json', False)
-    sprints = get_sprints()
     current_sprint = get_current_sprint()
-    if not sprints:
-        redirect(url_for("sprint.create"))
     if is_json:
+        sprints, next_cursor = paginate_query(
+            Sprint.query.filter(Sprint.user_id == current_user.id), Sprint.id)
         return json.dumps({'Success': True,
-                           'sprints': [dict(x) for x in sprints],
-                           'has_current_sprint': current_sprint is not None})
+                           'sprints': [x.to_dict() for x in sprints],
+                           'has_current_sprint': current_sprint is not None,
+                           'next_cursor': next_cursor}, default=str)
+    sprints = get_sprints()
+    if not sprints:
+        redirect(url_for("sprint.create"))
     return render_template('sprint/list.html', sprints=sprints, current_sprint=current_sprint)
 
 
 @bp.route('/<int:sprint_id>', methods=('GET', 'POST'))
 @login_required
+@conditional_on_data
 def show(sprint_id):
     """
     Show Board for Sprint with sprint identity
@@ -589,6 +952,7 @@ def show(sprint_id):
 
 @bp.route('/active', methods=('GET',))
 @login_required
+@conditional_on_data
 def active():
     """
     Returns sprint board for the active sprint
@@ -0,0 +1,98 @@
+"""
+Storage tuning: SQLite pragma profiles and pooled engines
+
+SQLite's defaults (rollback journal, synchronous=FULL, a
+fresh connection per checkout) make every commit block the
+board reads of the other workers. The production profile
+switches to WAL, so readers keep reading the last commit
+while a writer appends, and sets the pragmas below on each
+new connection. File databases are served from a pool
+of connections, sized through the config or environment.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+# Pragmas set on every new SQLite connection, by profile
+SQLITE_PROFILES = {
+    # SQLite's own defaults
+    'default': {},
+    'production': {
+        # Readers are not blocked by a writer, nor it by them
+        'journal_mode': 'WAL',
+        # With WAL, only a power loss can drop the last commits
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        # Negative sizes are KiB
+        'cache_size': -64 * 1024,
+        'temp_store': 'MEMORY',
+        # Milliseconds a writer waits for another to finish
+        'busy_timeout': 5000,
+    },
+}
+
+
+def get_engine_options(config):
+    """
+    Engine options for SQLALCHEMY_ENGINE_OPTIONS: a pool of
+    the configured size for file and server databases;
+    in-memory SQLite keeps Flask-SQLAlchemy's single
+    shared connection
+    @param config the app's config
+    """
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.drivername.startswith('sqlite') and url.database in (None, '', ':memory:'):
+        return {}
+    options = {'pool_size': config['DB_POOL_SIZE'],
+               'max_overflow': config['DB_MAX_OVERFLOW'],
+               'pool_timeout': config['DB_POOL_TIMEOUT'],
+               'pool_recycle': config['DB_POOL_RECYCLE']}
+    if url.drivername.startswith('sqlite'):
+        # SQLAlchemy would give file databases a NullPool; pooled
+        # connections move between request threads
+        options.update(poolclass=QueuePool, connect_args={'check_same_thread': False})
+    else:
+        # Server side connections may be dropped while idle in the pool
+        options['pool_pre_ping'] = True
+    return options
+
+
+def get_pragma_listener(pragmas):
+    """
+    Build the connect event handler setting the pragmas
+    @param pragmas name: value of each pragma
+    """
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+    return set_pragmas
+
+
+def init_storage(app, app_db):
+    """
+    Set the app's SQLite profile on every new connection
+    Call before anything connects to the database
+    @param app Flask application
+    @param app_db Flask-SQLAlchemy object bound to app
+    """
+    tune_engine(app, app_db.get_engine(app))
+
+
+def tune_engine(app, engine):
+    """
+    Set the app's SQLite profile on every new connection
+    of an engine, before it first connects
+    @param app Flask application
+    @param engine SQLAlchemy engine the app uses
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    profile = app.config['SQLITE_PROFILE']
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f'Unknown SQLITE_PROFILE {profile!r}, ' +
+                         f'choose from {", ".join(SQLITE_PROFILES)}')
+    pragmas = dict(SQLITE_PROFILES[profile], **app.config.get('SQLITE_PRAGMAS', {}))
+    if pragmas:
+        event.listen(engine, 'connect', get_pragma_listener(pragmas))
@@ -7,10 +7,16 @@ from flask import (
     Blueprint, flash, redirect, render_template, request, url_for, abort
 )
 from flask_user import current_user, login_required
+import sqlalchemy as sa
 
-from noscrum.db import get_db, Story, TagStory, Tag
+from noscrum.db import get_db, create_record, Story, TagStory, Tag, Task
 from noscrum.epic import get_epic, get_epics, get_null_epic
 from noscrum.tag import get_tags_for_story
+from noscrum.pagination import paginate_query
+from noscrum.rollup import rollup_change
+from noscrum.work_days import move_work_days
+from noscrum.etag import conditional_on_data
+from noscrum.forecast import get_forecasts
 
 bp = Blueprint('story', __name__, url_prefix='/story')
 
@@ -24,26 +30,25 @@ def get_stories(sprint_view=False, sprint_id=None):
     app_db = get_db()
     if not sprint_view:
         return Story.query.filter(Story.user_id == current_user.id).all()
-    return app_db.session.execute(
-        'SELECT story.id, ' +
-        "CASE WHEN story = 'NULL' THEN 'No Story' ELSE story END as story, " +
-        'epic_id, prioritization, story.deadline, ' +
-        'sum(coalesce(estimate,0)) as estimate, ' +
-        'count(task.id) as tasks, ' +
-        "COUNT(DISTINCT CASE WHEN task.status <> 'Done' THEN task.id ELSE NULL END) " +
-        "as active_tasks, " +
-        'COUNT(DISTINCT CASE WHEN task.estimate IS NULL THEN task.id ELSE NULL END) ' +
-        'as unestimated_tasks, ' +
-        "SUM(CASE WHEN task.status <> 'Done' THEN task.estimate - coalesce(task.actual,0) ELSE 0 " +
-        "END) AS rem_estimate " +
-        'FROM story ' +
-        'LEFT OUTER JOIN task on task.story_id = story.id ' +
-        'AND task.user_id = :user_id '+
-        'AND task.sprint_id = :sprint_id ' +
-        'GROUP BY story.id, story.story, story.epic_id, story.prioritization ' +
-
-        'ORDER BY prioritization DESC',
-        {'user_id': current_user.id, 'sprint_id': sprint_id}).fetchall()
+    query = app_db.session.query(
+        Story.id,
+        sa.case([(Story.story == 'NULL', 'No Story')], else_=Story.story).label('story'),
+        Story.epic_id, Story.prioritization, Story.deadline,
+        sa.func.sum(sa.func.coalesce(Task.estimate, 0)).label('estimate'),
+        sa.func.count(Task.id).label('tasks'),
+        sa.func.count(sa.distinct(sa.case([(Task.status != 'Done', Task.id)])))
+        .label('active_tasks'),
+        sa.func.count(sa.distinct(sa.case([(Task.estimate.is_(None), Task.id)])))
+        .label('unestimated_tasks'),
+        sa.func.sum(sa.case([(Task.status != 'Done',
+                              Task.estimate - sa.func.coalesce(Task.actual, 0))], else_=0))
+        .label('rem_estimate')
+    ).outerjoin(Task, sa.and_(Task.story_id == Story.id, Task.user_id == current_user.id,
+                              Task.sprint_id == sprint_id)
+    ).filter(Story.user_id == current_user.id
+    ).group_by(Story.id, Story.story, Story.epic_id, Story.prioritization, Story.deadline
+    ).order_by(Story.prioritization.desc())
+    return app_db.session.execute(query.statement).fetchall()
 
 def get_stories_by_epic(epic_id):
     """
@@ -105,23 +110,18 @@ def create_story(epic_id, story, prioritization, deadline):
     """
     if epic_id == 0:
         raise Exception("Tried to create a story without an epic")
-    app_db = get_db()
     if prioritization is None:
-        new_story = Story(story=story,
-                          epic_id=epic_id,
-                          deadline=deadline,
-                          user_id=current_user.id
-                          )
-    else:
-        new_story = Story(story=story,
-                          epic_id=epic_id,
-                          prioritization=prioritization,
-                          deadline=deadline,
-                          user_id=current_user.id)
-    app_db.session.add(new_story)
-    app_db.session.commit()
-    story = get_story_by_name(story, epic_id)
-    return story
+        return create_record(Story,
+                             story=story,
+                             epic_id=epic_id,
+                             deadline=deadline,
+                             user_id=current_user.id)
+    return create_record(Story,
+                         story=story,
+                         epic_id=epic_id,
+                         prioritization=int(prioritization),
+                         deadline=deadline,
+                         user_id=current_user.id)
 
 
 def update_story(story_id, story, epic_id, prioritization, deadline):
@@ -134,14 +134,18 @@ def update_story(story_id, story, epic_id, prioritization, deadline):
     @param deadline date the story will be due
     """
     app_db = get_db()
-    Story.query.filter(Story.id == story_id).filter(Story.user_id == current_user.id)\
-        .update({
-            'story': story,
-            'epic_id': epic_id,
-            'prioritization': prioritization,
-            'deadline': deadline
-        }, synchronize_session="fetch")
-    app_db.session.commit()
+    task_ids = [x for x, in app_db.session.query(Task.id).filter(Task.story_id == story_id)
+                .filter(Task.user_id == current_user.id)]
+    with rollup_change(*task_ids):
+        Story.query.filter(Story.id == story_id).filter(Story.user_id == current_user.id)\
+            .update({
+                'story': story,
+                'epic_id': epic_id,
+                'prioritization': prioritization,
+                'deadline': deadline
+            }, synchronize_session="fetch")
+        move_work_days(*task_ids)
+        app_db.session.commit()
     return get_story(story_id)
 
 
@@ -163,11 +167,7 @@ def insert_tag_story(story_id, tag_id):
     @param story_id story identification value
     @param tag_id tag record identifier number
     """
-    app_db = get_db()
-    tag_story_record = TagStory(story_id=story_id, tag_id=tag_id)
-    app_db.session.add(tag_story_record)
-    app_db.session.commit()
-    return get_tag_story(story_id, tag_id)
+    return create_record(TagStory, story_id=story_id, tag_id=tag_id)
 
 
 def delete_tag_story(story_id, tag_id):
@@ -297,15 +297,20 @@ def tag(story_id):
 
 @bp.route('/', methods=('GET',))
 @login_required
+@conditional_on_data
 def list_all():
     """
     List all the stories for a particular user
     """
     is_json = request.args.get('is_json', False)
+    if is_json:
+        stories, next_cursor = paginate_query(
+            Story.query.filter(Story.user_id == current_user.id), Story.id)
+        return json.dumps({'Success': True,
+                           'stories': [x.to_dict() for x in stories],
+                           'next_cursor': next_cursor}, default=str)
     stories = get_stories()
     epics = get_epics()
-    if is_json:
-        return json.dumps({'Success': True, 'stories': [dict(x) for x in stories]})
     return render_template('story/list.html', stories=stories, epics=epics)
 
 
@@ -355,6 +360,8 @@ def show(story_id):
         if is_json:
             abort(500, error)
         flash(error, 'error')
+    forecast = get_forecasts()['stories'].get(story.id)
     if is_json:
-        return json.dumps({'Success': True, 'story': dict(story)})
-    return render_template('story/show.html', story=story)
+        return json.dumps({'Success': True, 'story': story.to_dict(),
+                           'forecast': forecast}, default=str)
+    return render_template('story/show.html', story=story, forecast=forecast)
@@ -8,7 +8,8 @@ from flask import (
 )
 from flask_user import current_user
 
-from noscrum.db import get_db, Tag
+from noscrum.db import get_db, create_record, Tag
+from noscrum.pagination import paginate_query
 
 bp = Blueprint('tag', __name__, url_prefix='/tag')
 
@@ -51,11 +52,7 @@ def create_tag(tag):
     Create some new tag for organizing stories
     @param tag The name of the tag in question
     """
-    app_db = get_db()
-    newtag = Tag(tag=tag, user_id=current_user.id)
-    app_db.session.add(newtag)
-    app_db.session.commit()
-    return get_tag_from_name(tag)
+    return create_record(Tag, tag=tag, user_id=current_user.id)
 
 
 def update_tag(tag_id, tag):
@@ -166,8 +163,11 @@ def list_all():
     Handles requests to list all tags for user
     """
     is_json = request.args.get('is_json', False)
-    tags = get_tags()
-
     if is_json:
-        return json.dumps({'Success': True, tags: [dict(x) for x in tags]})
+        tags, next_cursor = paginate_query(
+            Tag.query.filter(Tag.user_id == current_user.id), Tag.id)
+        return json.dumps({'Success': True,
+                           'tags': [x.to_dict() for x in tags],
+                           'next_cursor': next_cursor})
+    tags = get_tags()
     return render_template('tag/list.html', tags=tags)
@@ -7,45 +7,63 @@ from flask import (
     Blueprint, redirect, render_template, request, url_for, abort, flash
 )
 from flask_user import current_user, login_required
+import sqlalchemy as sa
+from sqlalchemy.orm import selectinload
 
-from noscrum.story import get_story, get_stories
-from noscrum.epic import get_epics, get_null_epic
+from noscrum.story import get_story
+from noscrum.epic import get_null_epic
 from noscrum.sprint import get_current_sprint, get_sprint, get_sprints
-from noscrum.db import get_db, Task
+from noscrum.db import get_db, create_record, Task, Epic, Story, Work, ScheduleTask
+from noscrum.pagination import get_page_args, paginate_rows
+from noscrum.rollup import rollup_change
+from noscrum.work_days import move_work_days
+from noscrum.events import publish_event
+from noscrum.etag import conditional_on_data
 
 bp = Blueprint('task', __name__, url_prefix='/task')
 
 
-def get_tasks():
+def get_tasks(after=None, limit=None):
     """
     Get every task record for the current user
+    @param after (optional) only tasks past id
+    @param limit (optional) at most this many
+    tasks, ordered by id; a task scheduled in
+    several sprints can span more than one row
     """
     app_db = get_db()
-    return app_db.session.execute('SELECT task.id, task, estimate, status, story_id, ' +
-                                  'epic_id, actual, task.deadline, task.recurring, ' +
-                                  'coalesce(hours_worked,0) hours_worked, ' +
-                                  'coalesce(sum_sched,0) sum_sched, ' +
-                                  '(task.sprint_ID = sched.sprint_id) single_sprint_task ' +
-                                  'FROM task ' +
-                                  'JOIN story ON task.story_id = story.id ' +
-                                  'LEFT OUTER JOIN (SELECT task_id, ' +
-                                  'sum(hours_worked) hours_worked ' +
-                                  'from work group by task_id) woik ' +
-                                  'ON woik.task_id = task.id ' +
-                                  'LEFT OUTER JOIN (select task_id, sprint_id, ' +
-                                  'count(1) * 2 sum_sched ' +
-                                  'FROM schedule_task group by task_id, sprint_id) sched ' +
-                                  'ON task.id = sched.task_id ' +
-                                  'WHERE task.user_id = :user_id',
-                                  {'user_id': current_user.id})
-
-
-def get_task(task_id):
+    hours_worked = sa.select([sa.func.coalesce(sa.func.sum(Work.hours_worked), 0)])\
+        .where(Work.task_id == Task.id).as_scalar()
+    sched = app_db.session.query(
+        ScheduleTask.task_id, ScheduleTask.sprint_id,
+        sa.func.sum(ScheduleTask.duration).label('sum_sched')
+    ).filter(ScheduleTask.user_id == current_user.id
+    ).group_by(ScheduleTask.task_id, ScheduleTask.sprint_id).subquery('sched')
+    query = app_db.session.query(
+        Task.id, Task.task, Task.estimate, Task.status, Task.story_id, Story.epic_id,
+        Task.actual, Task.deadline, Task.recurring, hours_worked.label('hours_worked'),
+        sa.func.coalesce(sched.c.sum_sched, 0).label('sum_sched'),
+        (Task.sprint_id == sched.c.sprint_id).label('single_sprint_task')
+    ).join(Story, Task.story_id == Story.id
+    ).outerjoin(sched, Task.id == sched.c.task_id
+    ).filter(Task.user_id == current_user.id)
+    if limit is not None:
+        page = app_db.session.query(Task.id).filter(Task.user_id == current_user.id)\
+            .filter(Task.id > (after or 0)).order_by(Task.id).limit(limit)
+        query = query.filter(Task.id.in_(page.subquery())).order_by(Task.id)
+    return app_db.session.execute(query.statement)
+
+
+def get_task_tree():
     """
-    Task record for user for identifier number
-    @task_id task record identification number
+    Get the user's epics with their stories and
+    tasks eager loaded, so walking the tree costs
+    a fixed number of queries however big it is
     """
-    return Task.query.filter(Task.id == task_id).filter(Task.user_id == current_user.id).first()
+    return Epic.query.filter(Epic.user_id == current_user.id)\
+        .options(selectinload(Epic.stories).selectinload(Story.tasks),
+                 selectinload(Epic.tasks))\
+        .all()
 
 
 def get_task(task_id):
@@ -53,7 +71,8 @@ def get_task(task_id):
     Task record for user for identifier number
     @task_id task record identification number
     """
-    return Task.query.filter(Task.id==task_id).filter(Task.user_id == current_user.id).first()
+    return Task.query.filter(Task.id == task_id).filter(Task.user_id == current_user.id).first()
+
 
 def get_tasks_for_story(story_id):
     """
@@ -63,18 +82,6 @@ def get_tasks_for_story(story_id):
     return Task.query.filter(Task.story_id == story_id)\
         .filter(Task.user_id == current_user.id).all()
 
-def get_story_summary():
-    """
-    Get task summary for each story by task ID
-    """
-    app_db = get_db()
-    return app_db.session.query(
-        Task.story_id,
-        app_db.func.sum(Task.estimate).label('est'),
-        app_db.func.count(Task.id).filter(Task.estimate is None).label('unest'),
-        app_db.func.count(Task.id).filter(Task.status != 'Done').label('incomplete'),
-        app_db.func.count().label('task_count')).group_by(Task.story_id).all()
-
 def get_story_summary():
     """
     Get task summary for each story by task ID
@@ -84,7 +91,7 @@ def get_story_summary():
         Task.story_id,
         app_db.func.sum(Task.estimate).label('est'),
         app_db.func.count(Task.id).filter(
-            Task.estimate is None).label('unest'),
+            Task.estimate.is_(None)).label('unest'),
         app_db.func.count(Task.id).filter(
             Task.status != 'Done').label('incomplete'),
         app_db.func.count().label('task_count')).group_by(Task.story_id).all()
@@ -119,16 +126,16 @@ def create_task(task, story_id, estimate, deadline, sprint_id):
     @param deadline date when task will be due
     @param sprint_id Sprint where task planned
     """
-    app_db = get_db()
-    newtask = Task(task=task,
-                   story_id=story_id,
-                   estimate=estimate,
-                   deadline=deadline,
-                   sprint_id=sprint_id,
-                   user_id=current_user.id)
-    app_db.session.add(newtask)
-    app_db.session.commit()
-    return get_task_by_name(task, story_id)
+    with rollup_change() as task_ids:
+        new_task = create_record(Task,
+                                 task=task,
+                                 story_id=story_id,
+                                 estimate=None if estimate is None else float(estimate),
+                                 deadline=deadline,
+                                 sprint_id=sprint_id,
+                                 user_id=current_user.id)
+        task_ids.append(new_task.id)
+    return new_task
 
 def update_task(task_id, task, story_id, estimate, status, actual, deadline, sprint_id, recurring):
     """
@@ -166,8 +173,11 @@ def update_task(task_id, task, story_id, estimate, status, actual, deadline, spr
         else:
             recurring = False
         data['recurring'] = recurring
-    query.update(data, synchronize_session="fetch")
-    app_db.session.commit()
+    with rollup_change(task_id):
+        query.update(data, synchronize_session="fetch")
+        if story_id is not None:
+            move_work_days(task_id)
+        app_db.session.commit()
     return get_task(task_id)
 
 
@@ -292,15 +302,13 @@ def show(task_id):
         if status not in ['To-Do', 'In Progress', 'Done']:
             error = "Status is invalid. Valid statuses are ['To-Do','In Progress','Done']"
 
-        print(f"Task {task_id} will be in sprint ID {sprint_id}")
-        print(sprint_id)
-        print(get_sprint(sprint_id))
         if get_story(story_id) is None:
             error = f'Story with ID {story_id} not found'
         elif sprint_id is not None and get_sprint(sprint_id) is None:
             error = f'Sprint {sprint_id} not found.'
 
         if error is None:
+            old_status = task.status
             task = update_task(task_id,
                             task_name,
                             story_id,
@@ -310,6 +318,8 @@ def show(task_id):
                             deadline,
                             sprint_id,
                             recurring)
+            if task.status != old_status:
+                publish_event('task_status', task_id=task.id, status=task.status)
             if is_json:
                 return {'Success': True, 'task': task.to_dict()}
             return redirect(url_for('task.show', task_id=task_id))
@@ -326,27 +336,29 @@ rowproxy_to_dict = lambda x:[{column: value for column, value in rowproxy.items(
 
 @bp.route('/', methods=['GET'])
 @login_required
+@conditional_on_data
 def list_all():
     """
     Task showcase: lists epics stories & tasks
     """
     is_json = request.args.get('is_json', False)
-    tasks = get_tasks()
-    stories = get_stories()
-
-    epics = get_epics()
-    colors = ['primary', 'secondary', 'success', 'alert', 'warning']
     current_sprint = get_current_sprint()
-    user_sprints = get_sprints()
     if is_json:
-        return {'Success': True, 'tasks': rowproxy_to_dict(tasks),
+        after, limit = get_page_args()
+        tasks, next_cursor = paginate_rows(rowproxy_to_dict(get_tasks(after, limit + 1)), limit)
+        stories = Story.query.filter(Story.user_id == current_user.id)\
+            .filter(Story.id.in_({x['story_id'] for x in tasks})).all()
+        epics = Epic.query.filter(Epic.user_id == current_user.id)\
+            .filter(Epic.id.in_({x['epic_id'] for x in tasks})).all()
+        return {'Success': True, 'tasks': tasks,
                            'epics': [x.to_dict() for x in epics],
                            'stories': [x.to_dict() for x in stories],
-                           'current_sprint': current_sprint.id}
+                           'current_sprint': current_sprint.id if current_sprint else None,
+                           'next_cursor': next_cursor}
+    colors = ['primary', 'secondary', 'success', 'alert', 'warning']
+    user_sprints = {x.id: x for x in get_sprints()}
     return render_template('task/list.html',
                            current_sprint=current_sprint,
                            sprints=user_sprints,
-                           tasks=tasks,
-                           epics=epics,
-                           stories=stories,
+                           epics=get_task_tree(),
                            colors=colors)
@@ -1,11 +1,12 @@
 """
 User view and database controller
 """
+import json
 from flask import (
-    Blueprint, redirect, url_for
+    Blueprint, request, abort
 )
-from flask_user import current_user
-from noscrum.db import User
+from flask_user import current_user, login_required
+from noscrum.db import get_db, bump_data_version, User
 
 bp = Blueprint('user', __name__, url_prefix='/user')
 
@@ -41,13 +42,67 @@ def authenticate_user(username, credential):
         return user
 
 
+def get_schedule_settings(user):
+    """
+    Working hours of a user's sprint board
+    @param user the User record
+    """
+    return {'day_start': user.day_start,
+            'day_end': user.day_end,
+            'slot_hours': user.slot_hours}
+
+
+def parse_schedule_settings(values, user):
+    """
+    Check new working hours, raising ValueError when
+    they are not valid; settings not given are kept
+    @param values mapping of the submitted fields
+    @param user the User record being changed
+    """
+    settings = get_schedule_settings(user)
+    try:
+        for key in settings:
+            if values.get(key) not in (None, ''):
+                settings[key] = int(values[key])
+    except ValueError as error:
+        raise ValueError(f'Working hours must be whole hours: {error}') from error
+    if not 0 <= settings['day_start'] < settings['day_end'] <= 24:
+        raise ValueError('The day has to start before it ends, within 0 to 24')
+    if not 0 < settings['slot_hours'] <= settings['day_end'] - settings['day_start']:
+        raise ValueError('At least one slot has to fit in the day')
+    return settings
+
+
+def update_schedule_settings(settings):
+    """
+    Save the current user's working hours; boards
+    are drawn with the new slots from then on
+    @param settings from parse_schedule_settings
+    """
+    app_db = get_db()
+    User.query.filter(User.id == current_user.id).update(settings, synchronize_session='evaluate')
+    app_db.session.commit()
+    bump_data_version(current_user.id)
+
+
 @bp.route('/', methods=('GET', 'PUT'))
+@login_required
 def profile():
     """
     The _currently active_ user's profile page
     GET: Return user information they provided
-    PUT: not implemented, update a user's data
+    PUT: update the user's working hours
+    (day_start, day_end, slot_hours)
     """
-    if not current_user:
-        redirect(url_for('user.login'))
+    is_json = request.args.get('is_json', False)
+    if request.method == 'PUT':
+        try:
+            settings = parse_schedule_settings(request.values, current_user)
+        except ValueError as error:
+            abort(400, str(error))
+        update_schedule_settings(settings)
+        return json.dumps({'Success': True, 'schedule': settings})
+    if is_json:
+        return json.dumps({'Success': True, 'username': current_user.username,
+                           'schedule': get_schedule_settings(current_user)})
     return current_user.username
@@ -4,39 +4,62 @@ Data handler for work view and controller
 import json
 from datetime import date, datetime
 
+import click
 from flask import (
-    Blueprint, redirect, render_template, request, url_for, abort, flash
+    Blueprint, redirect, render_template, request, url_for, abort, flash, current_app
 )
+from flask.cli import with_appcontext
 from flask_user import current_user
+from sqlalchemy import func, or_
 
-from noscrum.db import get_db, Work
-from noscrum.task import get_task, update_task, get_tasks_for_story, get_tasks_for_epic, get_tasks
+from noscrum.db import get_db, bump_data_version, Work, WorkDay, Task, Story, SprintRollup
+from noscrum.pagination import paginate_query
+from noscrum.rollup import rollup_change
+from noscrum.sharding import for_each_shard
+from noscrum.events import publish_event
+from noscrum.work_days import add_work_day, refresh_work_day, get_work_days_query
+from noscrum.task import get_task, get_tasks_for_story, get_tasks_for_epic
 from noscrum.story import get_story
 from noscrum.epic import get_epic
 
 bp = Blueprint('work', __name__, url_prefix='/work')
 
 
-def create_work(work_date, hours_worked, status, task_id, new_actual, update_status):
+def create_work(work_date, hours_worked, status, task_id, update_status):
     """
-    Create new work for task on the given date
+    Create new work for task on the given date and add
+    its hours to the task's actual in the same UPDATE
     @param work_date when some action was done
     @param hours_worked number of hours worked
     @param status a new task status given work
     @param task_id task which work is executed
-    @param new_actual task actual hours worked
     @param update_status boolean update status
     """
     app_db = get_db()
-    new_work = Work(work_date=work_date,
-                    hours_worked=hours_worked,
-                    status=status,
-                    task_id=task_id)
-    app_db.session.add(new_work)
-    new_status = status if update_status else None
-    update_task(task_id, None, None, None, new_status,
-                new_actual, None, None, None)
-    app_db.session.commit()
+    with rollup_change(task_id):
+        new_work = Work(work_date=work_date,
+                        hours_worked=hours_worked,
+                        status=status,
+                        task_id=task_id,
+                        user_id=current_user.id)
+        app_db.session.add(new_work)
+        changes = {Task.actual: func.coalesce(Task.actual, 0) + hours_worked}
+        if update_status:
+            changes[Task.status] = status
+        Task.query.filter(Task.id == task_id).filter(Task.user_id == current_user.id)\
+            .update(changes, synchronize_session=False)
+        add_work_day(task_id, work_date, hours_worked)
+        app_db.session.commit()
+    return new_work
+
+
+def get_work_query():
+    """
+    Query for the current user's work records,
+    scoped through the owning task's user
+    """
+    return Work.query.join(Task, Task.id == Work.task_id)\
+        .filter(Task.user_id == current_user.id)
 
 
 def get_work(work_id):
@@ -44,7 +67,24 @@ def get_work(work_id):
     Get work record from identification number
     @param work_id work record identity number
     """
-    return Work.query.filter(Work.id == work_id).filter(Work.user_id == current_user.id).first()
+    return get_work_query().filter(Work.id == work_id).first()
+
+
+def get_work_for_task_query(task_id):
+    """
+    Query the work records for the task record
+    @param task_id task record work is queried
+    """
+    return get_work_query().filter(Work.task_id == task_id)
+
+
+def get_hours_worked(task_id):
+    """
+    Total hours logged against the task
+    @param task_id task which work is executed
+    """
+    return get_db().session.query(func.coalesce(func.sum(Work.hours_worked), 0))\
+        .filter(Work.task_id == task_id).scalar()
 
 
 def get_work_for_task(task_id):
@@ -52,7 +92,15 @@ def get_work_for_task(task_id):
     Get the work records given the task record
     @param task_id task record work is queried
     """
-    return Work.query.filter(Work.task_id == task_id).filter(Work.user_id == current_user.id).all()
+    return get_work_for_task_query(task_id).all()
+
+
+def get_work_for_story_query(story_id):
+    """
+    Query the work on a particular story record
+    @param story_id a Story record locator val
+    """
+    return get_work_query().filter(Task.story_id == story_id)
 
 
 def get_work_for_story(story_id):
@@ -60,8 +108,16 @@ def get_work_for_story(story_id):
     Get the work for a particular story record
     @param story_id a Story record locator val
     """
-    return Work.query.filter(Work.story.id == story_id)\
-        .filter(Work.user_id == current_user.id).all()
+    return get_work_for_story_query(story_id).all()
+
+
+def get_work_for_epic_query(epic_id):
+    """
+    Query the work records under an epic record
+    @param epic_id epic for which work queried
+    """
+    return get_work_query().join(Story, Story.id == Task.story_id)\
+        .filter(Story.epic_id == epic_id)
 
 
 def get_work_for_epic(epic_id):
@@ -69,11 +125,16 @@ def get_work_for_epic(epic_id):
     Get all work records under the epic record
     @param epic_id epic for which work queried
     """
-    app_db = get_db()
-    return Work(*app_db.execute("SELECT work.id, task_id, work_date, hours_worked, status " +
-                                'FROM work JOIN task on work.task_id = task.id ' +
-                                'JOIN story ON task.story_id = story.id ' +
-                                ' WHERE story.epic_id = ? order by work_date', (epic_id,)).fetchall())
+    return get_work_for_epic_query(epic_id).order_by(Work.work_date).all()
+
+
+def get_work_by_dates_query(start_date, end_date):
+    """
+    Query work executed between two date values
+    @param start_date date request lower limit
+    @param end_date date requested upper limit
+    """
+    return get_work_query().filter(Work.work_date.between(start_date, end_date))
 
 
 def get_work_by_dates(start_date, end_date):
@@ -82,22 +143,74 @@ def get_work_by_dates(start_date, end_date):
     @param start_date date request lower limit
     @param end_date date requested upper limit
     """
-    app_db = get_db()
-    return Work(*app_db.execute("SELECT id, task_id, work_date, hours_worked, status FROM work " +
-                                "WHERE work_date BETWEEN ? and ? order by work_date", (start_date, end_date)).fetchall())
+    return get_work_by_dates_query(start_date, end_date).order_by(Work.work_date).all()
+
+
+def work_page_json(query):
+    """
+    Serialize one keyset page of work records
+    @param query query for the work to be paged
+    """
+    work_items, next_cursor = paginate_query(query, Work.id)
+    return json.dumps({'Success': True,
+                       'work_items': [x.to_dict() for x in work_items],
+                       'next_cursor': next_cursor}, default=str)
+
+
+def work_days_page_json(query):
+    """
+    Serialize one keyset page of daily work totals
+    @param query query for the work days to be paged
+    """
+    work_days, next_cursor = paginate_query(query, WorkDay.id)
+    return json.dumps({'Success': True,
+                       'work_days': [x.to_dict() for x in work_days],
+                       'next_cursor': next_cursor}, default=str)
 
 
 def delete_work(work_id):
     """
-    Delete work record given a certain identiy
+    Delete work record given a certain identiy and take
+    its hours off the task's actual, undoing create_work;
+    hours entered by hand before any work stay in place
     @param work_id a work record to be deleted
     """
     app_db = get_db()
     work = get_work(work_id)
-    Work.query.filter(Work.id == work_id).filter(
-        Work.user_id == current_user.id).delete()
+    if work is None:
+        return None
+    with rollup_change(work.task_id):
+        Work.query.filter(Work.id == work.id).delete(synchronize_session=False)
+        Task.query.filter(Task.id == work.task_id)\
+            .update({Task.actual: func.coalesce(Task.actual, 0) - work.hours_worked},
+                    synchronize_session=False)
+        refresh_work_day(work.task_id, work.work_date)
+        app_db.session.commit()
+    return work_id
+
+
+def reconcile_actuals(app_db):
+    """
+    Repair drift between every task's actual and the
+    hours logged against it, in one UPDATE with the sum
+    as a correlated subquery (UPDATE ... FROM needs
+    SQLite 3.33). Tasks without work keep their (hand
+    entered) actual, as delete_work leaves it
+    Returns the number of tasks repaired
+    @param app_db database holding the tasks
+    """
+    logged = app_db.session.query(func.sum(Work.hours_worked))\
+        .filter(Work.task_id == Task.id).as_scalar()
+    has_work = app_db.session.query(Work.id).filter(Work.task_id == Task.id).exists()
+    repaired = Task.query.filter(has_work)\
+        .filter(or_(Task.actual.is_(None), Task.actual != logged))\
+        .update({Task.actual: logged}, synchronize_session=False)
+    if repaired:
+        # Cached boards carry remaining estimates built on the old actuals
+        SprintRollup.query.delete()
+        bump_data_version()
     app_db.session.commit()
-    return work.id
+    return repaired
 
 
 @bp.route('/create/<int:task_id>', methods=('POST', 'GET'))
@@ -134,10 +247,13 @@ def create(task_id):
         status = request.form.get('status', task.status)
         update_status = request.form.get('update_status', False)
         update_status = True if update_status or update_status == 'on' else False
-        true_actual = sum([x.hours_worked for x in get_work_for_task(task_id)])
-        new_actual = hours_worked if true_actual is None else true_actual + hours_worked
+        old_status = task.status
         create_work(work_date, hours_worked, status,
-                    task_id, new_actual, update_status)
+                    task_id, update_status)
+        publish_event('work_logged', task_id=task_id,
+                      hours_worked=get_hours_worked(task_id))
+        if update_status and status != old_status:
+            publish_event('task_status', task_id=task_id, status=status)
         if is_json:
             return json.dumps({'Success': True, 'task_id': task_id})
         return redirect(url_for('work.list_for_task', task_id=task_id))
@@ -187,6 +303,8 @@ def list_for_task(task_id):
         else:
             flash(error, 'error')
             return redirect(url_for('sprint.active'))
+    if is_json:
+        return work_page_json(get_work_for_task_query(task_id))
     work_items = get_work_for_task(task_id)
     if work_items is None:
         error = f'No Work Items found for Task {task_id}'
@@ -195,8 +313,6 @@ def list_for_task(task_id):
         else:
             flash(error, 'error')
             return redirect(url_for('sprint.active'))
-    if is_json:
-        return json.dumps({'Sucecss': True, 'work_items': work_items})
     return render_template('work/list.html', key='Task', tasks=tasks, work_items=work_items)
 
 
@@ -216,6 +332,8 @@ def list_for_story(story_id):
         else:
             flash(error, 'error')
             return redirect(url_for('sprint.active'))
+    if is_json:
+        return work_page_json(get_work_for_story_query(story_id))
     tasks = get_tasks_for_story(story_id)
     if tasks is None:
         error = f'No Tasks found for Story {story.id}'
@@ -232,8 +350,6 @@ def list_for_story(story_id):
         else:
             flash(error, 'error')
             return redirect(url_for('sprint.active'))
-    if is_json:
-        return json.dumps({'Sucecss': True, 'work_items': work_items})
     return render_template('work/list.html',
                            key='Story '+story['story'],
                            tasks=tasks,
@@ -256,6 +372,8 @@ def list_for_epic(epic_id):
         else:
             flash(error, 'error')
             return redirect(url_for('sprint.active'))
+    if is_json:
+        return work_page_json(get_work_for_epic_query(epic_id))
     tasks = get_tasks_for_epic(epic_id)
     if tasks is None:
         error = 'No Tasks found for Epic {epic.id}'
@@ -272,8 +390,6 @@ def list_for_epic(epic_id):
         else:
             flash(error, 'error')
             return redirect(url_for('sprint.active'))
-    if is_json:
-        return json.dumps({'Sucecss': True, 'work_items': work_items})
     return render_template('work/list.html',
                            key='Epic ' + epic['epic'],
                            tasks=tasks,
@@ -289,23 +405,26 @@ def list_for_dates():
     is_json = request.args.get('is_json', False)
     start_date = request.args.get('start_date', date(2020, 1, 1))
     end_date = request.args.get('end_date', date.today())
-    work_items = get_work_by_dates(start_date, end_date)
-    if work_items is None:
-        error = 'No work items found between dates_provided'
-        if is_json:
-            abort(404, error)
-        else:
-            flash(error, 'error')
-            return redirect(url_for('sprint.active'))
-    all_tasks = get_tasks()
-    task_ids = [x['task_id'] for x in work_items]
-    tasks = []
-    for task in all_tasks:
-        if task['id'] in task_ids:
-            tasks.append(task)
+    query = get_work_days_query(start_date, end_date,
+                                request.args.get('story_id'), request.args.get('epic_id'))
     if is_json:
-        return json.dumps({'Success': True, 'work_items': work_items})
-    return render_template('work/list.html',
+        return work_days_page_json(query)
+    work_days = {}
+    for work_day in query.order_by(WorkDay.work_date):
+        work_days.setdefault(work_day.task_id, []).append(work_day)
+    tasks = Task.query.filter(Task.id.in_(query.with_entities(WorkDay.task_id)))\
+        .order_by(Task.id).all()
+    return render_template('work/report.html',
                            key=f'Dates from {start_date} to {end_date}',
                            tasks=tasks,
-                           work_items=work_items)
+                           work_days=work_days)
+
+
+@click.command('reconcile-actuals')
+@with_appcontext
+def reconcile_actuals_command():
+    """
+    Reset task actuals that drifted from their logged work.
+    """
+    repaired = sum(reconcile_actuals(get_db()) for _ in for_each_shard(current_app))
+    click.echo(f'Repaired {repaired} task actuals.')
@@ -0,0 +1,135 @@
+"""
+Per-day work aggregates for date range reports
+
+work_day holds one row per user, day and task with the
+hours logged, plus the task's story and epic. create_work
+and delete_work keep it current in their own transaction,
+and moving a task or story between parents updates the
+copied story and epic ids.
+"""
+import click
+import sqlalchemy as sa
+from flask import current_app
+from flask.cli import with_appcontext
+from flask_login import current_user
+from noscrum.db import get_db, Task, Story, Work, WorkDay
+from noscrum.sharding import for_each_shard
+
+WORK_DAY_COLUMNS = 'user_id, work_date, task_id, story_id, epic_id, hours'
+
+
+def add_work_day(task_id, work_date, hours):
+    """
+    Add logged hours to the task's row for the day
+    Does not commit; runs in the caller's transaction
+    @param task_id task which work is executed
+    @param work_date when the work was done
+    @param hours number of hours worked
+    """
+    get_db().session.execute(sa.text(
+        f'INSERT INTO work_day ({WORK_DAY_COLUMNS}) ' +
+        'SELECT task.user_id, :work_date, task.id, task.story_id, story.epic_id, :hours ' +
+        'FROM task LEFT JOIN story ON story.id = task.story_id ' +
+        'WHERE task.id = :task_id AND task.user_id = :user_id ' +
+        'ON CONFLICT (user_id, work_date, task_id) ' +
+        'DO UPDATE SET hours = work_day.hours + excluded.hours'
+    ).bindparams(sa.bindparam('work_date', type_=sa.Date())),
+        {'work_date': work_date, 'hours': hours,
+         'task_id': task_id, 'user_id': current_user.id})
+
+
+def refresh_work_day(task_id, work_date):
+    """
+    Recount the task's row for the day from its work,
+    dropping the row when no work is left
+    Does not commit; runs in the caller's transaction
+    @param task_id task which work is executed
+    @param work_date day of the changed work
+    """
+    app_db = get_db()
+    on_day = WorkDay.query.filter(WorkDay.task_id == task_id)\
+        .filter(WorkDay.work_date == work_date)
+    work = app_db.session.query(Work.id).filter(Work.task_id == task_id)\
+        .filter(Work.work_date == work_date)
+    if app_db.session.query(work.exists()).scalar():
+        hours = app_db.session.query(sa.func.sum(Work.hours_worked))\
+            .filter(Work.task_id == task_id).filter(Work.work_date == work_date).as_scalar()
+        on_day.update({WorkDay.hours: hours}, synchronize_session=False)
+    else:
+        on_day.delete(synchronize_session=False)
+
+
+def move_work_days(*task_ids):
+    """
+    Copy the tasks' current story and epic onto their
+    rows, after a task or its story changed parent
+    Does not commit; runs in the caller's transaction
+    @param task_ids tasks that may have moved
+    """
+    task_ids = [int(x) for x in task_ids if x is not None]
+    if not task_ids:
+        return
+    story_id = sa.select([Task.story_id]).where(Task.id == WorkDay.task_id).as_scalar()
+    epic_id = sa.select([Story.epic_id]).where(Story.id == Task.story_id)\
+        .where(Task.id == WorkDay.task_id).as_scalar()
+    WorkDay.query.filter(WorkDay.task_id.in_(task_ids))\
+        .update({WorkDay.story_id: story_id, WorkDay.epic_id: epic_id},
+                synchronize_session=False)
+
+
+def get_work_days_query(start_date, end_date, story_id=None, epic_id=None):
+    """
+    Query the current user's daily hours between dates
+    @param start_date date request lower limit
+    @param end_date date requested upper limit
+    @param story_id (optional) only this story
+    @param epic_id (optional) only this epic
+    """
+    query = WorkDay.query.filter(WorkDay.user_id == current_user.id)\
+        .filter(WorkDay.work_date.between(start_date, end_date))
+    if story_id is not None:
+        query = query.filter(WorkDay.story_id == story_id)
+    if epic_id is not None:
+        query = query.filter(WorkDay.epic_id == epic_id)
+    return query
+
+
+def rebuild_work_days(app_db, user_id=None):
+    """
+    Refill the aggregates from the work table with one
+    GROUP BY. Returns the number of rows written
+    @param app_db database holding the work
+    @param user_id (optional) only this user's rows
+    """
+    params = {'user_id': user_id}
+    owner = 'IS NOT NULL' if user_id is None else '= :user_id'
+    app_db.session.execute(f'DELETE FROM work_day WHERE user_id {owner}', params)
+    app_db.session.execute(
+        f'INSERT INTO work_day ({WORK_DAY_COLUMNS}) ' +
+        'SELECT task.user_id, work.work_date, task.id, task.story_id, story.epic_id, ' +
+        'sum(work.hours_worked) FROM work JOIN task ON task.id = work.task_id ' +
+        f'LEFT JOIN story ON story.id = task.story_id WHERE task.user_id {owner} ' +
+        'GROUP BY task.user_id, work.work_date, task.id, task.story_id, story.epic_id', params)
+    app_db.session.commit()
+    return app_db.session.execute(
+        f'SELECT count(*) FROM work_day WHERE user_id {owner}', params).scalar()
+
+
+def install_work_days(app_db):
+    """
+    Fill the aggregates the first time the app starts
+    on a database that already has work logged
+    @param app_db database holding the work
+    """
+    if WorkDay.query.first() is None and Work.query.first() is not None:
+        rebuild_work_days(app_db)
+
+
+@click.command('rebuild-work-days')
+@with_appcontext
+def rebuild_work_days_command():
+    """
+    Rebuild the per-day work aggregates from scratch.
+    """
+    aggregated = sum(rebuild_work_days(get_db()) for _ in for_each_shard(current_app))
+    click.echo(f'Aggregated {aggregated} task days.')
@@ -0,0 +1,84 @@
+import json
+import unittest
+from datetime import date
+from unittest.mock import patch
+import numpy as np
+from flask import url_for
+import noscrum
+from noscrum.analytics import rolling_mean, sprint_of_dates
+try:
+    from test_base import noscrumTestCase
+except ModuleNotFoundError:
+    from .test_base import noscrumTestCase
+
+
+class noscrumAnalyticsTest(noscrumTestCase):
+
+    def test_rolling_mean(self):
+        means = rolling_mean(np.array([2, 4, 6, 8]), 3)
+        self.assertTrue(np.isnan(means[:2]).all())
+        self.assertEqual(list(means[2:]), [4, 6])
+        self.assertTrue(np.isnan(rolling_mean(np.array([1.0]), 3)).all())
+
+    def test_overlapping_sprints(self):
+        # A long sprint with a short one starting inside it
+        sprints = {'id': np.array([1, 2, 3]),
+                   'start_date': np.array(['2021-01-04', '2021-01-06', '2021-02-01'],
+                                          dtype='datetime64[D]'),
+                   'end_date': np.array(['2021-01-24', '2021-01-10', '2021-02-07'],
+                                        dtype='datetime64[D]')}
+        dates = np.array(['2021-01-01', '2021-01-05', '2021-01-07', '2021-01-20',
+                          '2021-01-28', '2021-02-03'], dtype='datetime64[D]')
+        self.assertEqual(list(sprint_of_dates(sprints, dates)), [-1, 0, 1, 0, -1, 2])
+
+    @patch('flask_login.utils._get_user')
+    def test_velocity_and_burndown(self, current_user):
+        current_user.return_value = self.test_user
+        epic = noscrum.epic.create_epic('Stats Epic', 'red', None)
+        story = noscrum.story.create_story(epic.id, 'Stats Story', 1, None)
+        later = noscrum.sprint.create_sprint(date(2021, 1, 11), date(2021, 1, 17))
+        first = noscrum.sprint.create_sprint(date(2021, 1, 4), date(2021, 1, 10))
+        done = noscrum.task.create_task('Done', story.id, '4', None, first.id)
+        open_task = noscrum.task.create_task('Open', story.id, '6', None, first.id)
+        noscrum.task.create_task('Later', story.id, '5', None, later.id)
+        noscrum.task.create_task('Backlog', story.id, '3', None, None)
+        noscrum.work.create_work(date(2021, 1, 4), 2, 'In Progress', done.id, False)
+        noscrum.work.create_work(date(2021, 1, 6), 4, 'Done', done.id, True)
+        noscrum.work.create_work(date(2021, 1, 6), 1, 'In Progress', open_task.id, False)
+        noscrum.work.create_work(date(2021, 1, 12), 1, 'In Progress', open_task.id, False)
+
+        response = self.client.get(url_for('analytics.summary', is_json=True, window=2))
+        self.assert200(response)
+        result = json.loads(response.data)
+        sprints = {x['sprint_id']: x for x in result['sprints']}
+        self.assertEqual([x['sprint_id'] for x in result['sprints']], [first.id, later.id])
+        self.assertEqual((sprints[first.id]['committed'], sprints[first.id]['velocity'],
+                          sprints[first.id]['hours_worked'], sprints[first.id]['actual_to_estimate']),
+                         (10, 4, 7, 1.5))
+        self.assertEqual((sprints[later.id]['velocity'], sprints[later.id]['rolling_velocity']),
+                         (0, 2))
+        self.assertIsNone(sprints[first.id]['rolling_velocity'])
+        self.assertEqual(result['accuracy']['tasks'], 1)
+        self.assertEqual(result['accuracy']['underestimated'], 1)
+
+        response = self.client.get(url_for('analytics.burndown', sprint_id=first.id, is_json=True))
+        self.assert200(response)
+        series = json.loads(response.data)
+        self.assertEqual(series['scope'], 10)
+        self.assertEqual(series['days'][0], '2021-01-04')
+        self.assertEqual(series['daily_hours'], [2, 0, 5, 0, 0, 0, 0])
+        self.assertEqual(series['remaining'], [8, 8, 3, 3, 3, 3, 3])
+        self.assertEqual((series['ideal'][0], series['ideal'][-1]), (10, 0))
+        self.assert200(self.client.get(url_for('analytics.summary')))
+        self.assert200(self.client.get(url_for('analytics.burndown', sprint_id=first.id)))
+        self.assert404(self.client.get(url_for('analytics.burndown', sprint_id=first.id + 100)))
+
+        # Work after a short overlapping sprint ends still counts for the long one
+        noscrum.sprint.create_sprint(date(2021, 1, 5), date(2021, 1, 5))
+        response = self.client.get(url_for('analytics.summary', is_json=True))
+        sprints = {x['sprint_id']: x for x in json.loads(response.data)['sprints']}
+        self.assertEqual(sprints[first.id]['hours_worked'], 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+Runs one workload on SQLite and, when NOSCRUM_TEST_POSTGRES_URI
+names a PostgreSQL database that may be emptied (and psycopg2
+is installed), on PostgreSQL as well, then compares what the
+board, list and report queries return on each. For example:
+
+    docker run --rm -e POSTGRES_HOST_AUTH_METHOD=trust -p 5432:5432 postgres:16
+    NOSCRUM_TEST_POSTGRES_URI=postgresql://postgres@localhost/postgres \
+        python -m pytest tests/test_backends.py
+"""
+import json
+import os
+import unittest
+from datetime import date, timedelta
+from unittest.mock import patch
+from flask_user.tests.utils import utils_prepare_user
+import noscrum
+from noscrum.db import get_db
+try:
+    from test_base import noscrumTestCase
+except ModuleNotFoundError:
+    from .test_base import noscrumTestCase
+
+POSTGRES_URI = os.environ.get('NOSCRUM_TEST_POSTGRES_URI')
+
+
+def as_dicts(rows):
+    return sorted((dict(x.items()) for x in rows), key=lambda x: x['id'])
+
+
+class noscrumBackendTest(noscrumTestCase):
+
+    def run_workload(self, app, current_user):
+        """
+        Fill the app's database and gather what the queries
+        return, as JSON so both engines compare alike
+        """
+        user = utils_prepare_user(app)
+        current_user.return_value = user
+        start = date.today() - timedelta(date.today().weekday())
+        epic = noscrum.epic.create_epic('Parity Epic', 'red', start + timedelta(30))
+        noscrum.epic.create_epic('Empty Epic', 'blue', None)
+        story = noscrum.story.create_story(epic.id, 'Parity Story', 2, None)
+        other = noscrum.story.create_story(epic.id, 'Other Story', 1, None)
+        noscrum.sprint.create_sprint(start - timedelta(7), start - timedelta(1))
+        sprint = noscrum.sprint.create_sprint(start, start + timedelta(6))
+        done = noscrum.task.create_task('Done', story.id, '3', None, sprint.id)
+        open_task = noscrum.task.create_task('Open', story.id, '5', None, sprint.id)
+        noscrum.task.create_task('Unestimated', other.id, None, None, sprint.id)
+        backlog = noscrum.task.create_task('Backlog', other.id, '2', None, None)
+        noscrum.work.create_work(start, 4, 'Done', done.id, True)
+        noscrum.work.create_work(start + timedelta(1), 2, 'In Progress', open_task.id, True)
+        noscrum.sprint.create_schedule(sprint.id, backlog.id, start + timedelta(2), 9, 'note')
+        noscrum.sprint.create_schedule(sprint.id, open_task.id, start + timedelta(2), 11, None)
+        noscrum.db.bump_data_version(user.id)
+
+        client = app.test_client()
+        details = noscrum.sprint.get_sprint_details(sprint.id)
+        results = {
+            'epics': as_dicts(noscrum.epic.get_epics(True, sprint.id)),
+            'stories': as_dicts(noscrum.story.get_stories(True, sprint.id)),
+            'tasks': as_dicts(noscrum.task.get_tasks()),
+            'task_page': [x['id'] for x in noscrum.task.get_tasks(done.id, 2)],
+            'board': details[:4] + details[5:],
+            'reconciled': noscrum.work.reconcile_actuals(get_db()),
+        }
+        for url in (f'/sprint/{sprint.id}', '/task/', '/story/', '/epic/', '/sprint/active'):
+            results[url] = client.get(url).status_code
+        for url in ('/task/?is_json=1', f'/work/list/epic/{epic.id}?is_json=1',
+                    f'/work/list/dates?start={start}&end={start + timedelta(6)}&is_json=1',
+                    '/analytics/?is_json=1', f'/epic/{epic.id}?is_json=1'):
+            response = client.get(url)
+            results[url] = (response.status_code, json.loads(response.data))
+        results['/export'] = client.get('/export/').data.decode().splitlines()
+        return json.loads(json.dumps(results, default=str))
+
+    @patch('flask_login.utils._get_user')
+    def test_sqlite(self, current_user):
+        results = self.run_workload(self.app, current_user)
+        self.assertEqual([(x['epic'], x['tasks'], x['active_tasks'], x['unestimated_tasks'],
+                           x['rem_estimate']) for x in results['epics']],
+                         [('Parity Epic', 3, 2, 1, 3), ('Empty Epic', 0, 0, 0, 0)])
+        self.assertEqual([x['task'] for x in results['tasks']],
+                         ['Done', 'Open', 'Unestimated', 'Backlog'])
+        self.assertEqual(len(results['task_page']), 2)
+        self.assertEqual(results['reconciled'], 0)
+        self.assertEqual(set(results['board'][2]), {'1', '2', '3', '4'})
+
+    @unittest.skipUnless(POSTGRES_URI, 'NOSCRUM_TEST_POSTGRES_URI is not set')
+    @patch('flask_login.utils._get_user')
+    def test_postgres_parity(self, current_user):
+        expected = self.run_workload(self.app, current_user)
+        app_db = get_db()
+        app_db.session.remove()
+        postgres = noscrum.create_app({'SQLALCHEMY_DATABASE_URI': POSTGRES_URI,
+                                       'SECRET_KEY': 'TESTING_KEY', 'TESTING': True})
+        try:
+            with postgres.app_context():
+                app_db.drop_all()
+                app_db.create_all()
+                results = self.run_workload(postgres, current_user)
+                app_db.session.remove()
+                app_db.drop_all()
+        finally:
+            app_db.session.remove()
+        self.maxDiff = None
+        for key, value in expected.items():
+            self.assertEqual(results[key], value, key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+from unittest.mock import patch
+from flask import url_for
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import noscrum
+from noscrum.db import get_db, upgrade_schema
+try:
+    from test_base import noscrumTestCase
+except ModuleNotFoundError:
+    from .test_base import noscrumTestCase
+
+
+class noscrumEtagTest(noscrumTestCase):
+
+    def count_statement(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def get(self, endpoint, etag=None, **args):
+        self.statements = []
+        headers = {} if etag is None else {'If-None-Match': etag}
+        event.listen(Engine, 'before_cursor_execute', self.count_statement)
+        try:
+            return self.client.get(url_for(endpoint, **args), headers=headers)
+        finally:
+            event.remove(Engine, 'before_cursor_execute', self.count_statement)
+
+    @patch('flask_login.utils._get_user')
+    def test_not_modified_until_a_write(self, current_user):
+        current_user.return_value = self.test_user
+        noscrum.epic.create_epic('Cached Epic', 'red', None)
+        for endpoint, args in (('epic.list_all', {}), ('task.list_all', {'is_json': True})):
+            first = self.get(endpoint, **args)
+            self.assert200(first)
+            etag = first.headers['ETag']
+            self.assertTrue(etag.startswith('W/'))
+            cached = self.get(endpoint, etag, **args)
+            self.assertEqual(cached.status_code, 304)
+            self.assertEqual(self.statements, [])
+        response = self.client.post(url_for('epic.create'), data={'epic': 'New Epic', 'color': 'blue'})
+        self.assertEqual(response.status_code, 302)
+        fresh = self.get('epic.list_all', etag)
+        self.assert200(fresh)
+        self.assertIn(b'New Epic', fresh.data)
+        self.assertNotEqual(fresh.headers['ETag'], etag)
+
+    def test_upgrade_adds_missing_columns(self):
+        app_db = get_db()
+        app_db.session.execute('ALTER TABLE user DROP COLUMN data_version')
+        app_db.session.commit()
+        self.assertIn('column user.data_version', upgrade_schema(app_db))
+        self.assertEqual(upgrade_schema(app_db), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import json
+import unittest
+from datetime import date
+from unittest.mock import patch
+from flask import url_for
+import noscrum
+from noscrum.events import get_broker, get_user_channel
+try:
+    from test_base import noscrumTestCase
+except ModuleNotFoundError:
+    from .test_base import noscrumTestCase
+
+
+class noscrumEventsTest(noscrumTestCase):
+
+    def read_event(self, stream):
+        lines = next(stream).decode().splitlines()
+        self.assertTrue(lines[0].startswith('event: '), lines)
+        return json.loads(lines[1][len('data: '):])
+
+    @patch('flask_login.utils._get_user')
+    def test_board_changes_are_streamed(self, current_user):
+        current_user.return_value = self.test_user
+        epic = noscrum.epic.create_epic('Live Epic', 'red', None)
+        story = noscrum.story.create_story(epic.id, 'Live Story', 1, None)
+        sprint = noscrum.sprint.create_sprint(date(2021, 1, 4), date(2021, 1, 10))
+        other = noscrum.sprint.create_sprint(date(2021, 1, 11), date(2021, 1, 17))
+        task = noscrum.task.create_task('Live Task', story.id, '4', None, sprint.id)
+        response = self.client.get(url_for('events.sprint_stream', sprint_id=sprint.id),
+                                   buffered=False)
+        self.assert200(response)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        stream = iter(response.response)
+        self.assertTrue(next(stream).startswith(b'retry: '))
+
+        self.client.post(url_for('sprint.schedule', sprint_id=other.id, is_json=True),
+                         data={'task_id': task.id, 'sprint_day': '2021-01-12', 'sprint_hour': 9})
+        self.client.post(url_for('sprint.schedule', sprint_id=sprint.id, is_json=True),
+                         data={'task_id': task.id, 'sprint_day': '2021-01-05', 'sprint_hour': 9},
+                         headers={'X-Board-Client': 'tab-1'})
+        created = self.read_event(stream)
+        self.assertEqual((created['event'], created['client']), ('schedule_created', 'tab-1'))
+        self.assertEqual(created['schedule_task']['sprint_day'], '2021-01-05')
+
+        self.client.post(url_for('task.show', task_id=task.id, is_json=True),
+                         data={'status': 'In Progress'})
+        self.assertEqual(self.read_event(stream)['status'], 'In Progress')
+        self.client.post(url_for('work.create', task_id=task.id, is_json=True),
+                         data={'work_date': '2021-01-05', 'hours_worked': 3})
+        logged = self.read_event(stream)
+        self.assertEqual((logged['event'], logged['hours_worked']), ('work_logged', 3))
+
+        self.client.delete(url_for('sprint.schedule', sprint_id=sprint.id, is_json=True),
+                           data={'schedule_id': created['schedule_task']['id']})
+        self.assertEqual(self.read_event(stream)['event'], 'schedule_deleted')
+        response.close()
+        self.assertNotIn(get_user_channel(self.test_user.id), get_broker().channels)
+
+    @patch('flask_login.utils._get_user')
+    def test_unknown_sprint(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.client.get(url_for('events.sprint_stream', sprint_id=404))
+        self.assert404(response)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import json
+import unittest
+from datetime import date
+from unittest.mock import patch
+from flask import url_for
+import noscrum
+try:
+    from test_base import noscrumTestCase
+except ModuleNotFoundError:
+    from .test_base import noscrumTestCase
+
+
+class noscrumExportTest(noscrumTestCase):
+
+    def add_workspace(self):
+        epic = noscrum.epic.create_epic('Export Epic', 'red', None)
+        story = noscrum.story.create_story(epic.id, 'Export Story', 1, None)
+        task = noscrum.task.create_task('Export Task', story.id, '2', None, None)
+        noscrum.work.create_work(date.today(), 1, 'In Progress', task.id, False)
+        return epic, story, task
+
+    @patch('flask_login.utils._get_user')
+    def test_export_all(self, current_user):
+        current_user.return_value = self.test_user
+        epic, story, task = self.add_workspace()
+        response = self.client.get(url_for('export.export_all'))
+        self.assert200(response)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(x) for x in response.data.decode().splitlines()]
+        exported = {(x['table'], x['row']['id']) for x in lines}
+        self.assertIn(('epic', epic.id), exported)
+        self.assertIn(('story', story.id), exported)
+        self.assertIn(('task', task.id), exported)
+        self.assertIn('work', {x['table'] for x in lines})
+        tables = [x['table'] for x in lines]
+        self.assertLess(tables.index('epic'), tables.index('story'))
+        self.assertLess(tables.index('task'), tables.index('work'))
+
+    @patch('flask_login.utils._get_user')
+    def test_export_user_command(self, current_user):
+        current_user.return_value = self.test_user
+        self.add_workspace()
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(noscrum.export.export_user_command,
+                               [self.test_user.username])
+        self.assertEqual(result.exit_code, 0, result.output)
+        lines = [json.loads(x) for x in result.output.splitlines()]
+        self.assertTrue(lines)
+        result = runner.invoke(noscrum.export.export_user_command, ['nobody-here'])
+        self.assertNotEqual(result.exit_code, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
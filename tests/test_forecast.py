@@ -0,0 +1,116 @@
+import json
+import unittest
+from datetime import date, timedelta
+from unittest.mock import patch
+import numpy as np
+from flask import url_for
+import noscrum
+from noscrum.db import bump_data_version, create_record, User
+from noscrum.forecast import simulate, get_completions, get_forecasts
+try:
+    from test_base import noscrumTestCase
+except ModuleNotFoundError:
+    from .test_base import noscrumTestCase
+
+
+class noscrumForecastTest(noscrumTestCase):
+
+    def test_simulate(self):
+        rng = np.random.default_rng(1)
+        futures = simulate(np.array([10.0, 10.0]), 25, 1000, rng)
+        self.assertEqual(futures.shape, (1000, 9))
+        self.assertEqual(futures.dtype, np.float32)
+        needed, on_time = get_completions(futures, np.array([25.0, 10.0, 0.0]),
+                                          np.array([2, 3, 0]))
+        self.assertEqual([list(x) for x in needed], [[3, 1, 1]] * 3)
+        self.assertEqual(list(on_time), [0, 1, 0])
+        futures = simulate(np.array([0.0, 10.0]), 10, 4000, rng)
+        needed, on_time = get_completions(futures, np.array([10.0]), np.array([1]))
+        self.assertEqual((needed[0][0], needed[2][0]), (1, 5))
+        self.assertAlmostEqual(on_time[0], 0.5, delta=0.05)
+
+    @patch('flask_login.utils._get_user')
+    def test_epic_forecast(self, current_user):
+        current_user.return_value = self.test_user
+        today = date.today()
+        epic = noscrum.epic.create_epic('Forecast Epic', 'red', today + timedelta(13))
+        story = noscrum.story.create_story(epic.id, 'Forecast Story', 1, today + timedelta(6))
+        for weeks in (2, 1):
+            sprint = noscrum.sprint.create_sprint(today - timedelta(7 * weeks),
+                                                  today - timedelta(7 * weeks - 6))
+            task = noscrum.task.create_task(f'Done {weeks}', story.id, '10', None, sprint.id)
+            noscrum.work.create_work(sprint.start_date, 3, 'Done', task.id, True)
+        started = noscrum.task.create_task('Started', story.id, '15', None, None)
+        noscrum.work.create_work(today, 5, 'In Progress', started.id, False)
+        noscrum.task.create_task('Unestimated', story.id, None, None, None)
+        bump_data_version(self.test_user.id)
+
+        response = self.client.get(url_for('epic.show', epic_id=epic.id, is_json=True))
+        self.assert200(response)
+        result = json.loads(response.data)
+        forecast = result['forecast']
+        self.assertEqual(forecast['remaining'], 20)
+        self.assertEqual(forecast['p50'], str(today + timedelta(13)))
+        self.assertEqual(forecast['p95'], str(today + timedelta(13)))
+        self.assertEqual(forecast['on_time'], 1)
+        self.assertEqual(result['story_forecasts'][str(story.id)]['on_time'], 0)
+
+        response = self.client.get(url_for('story.show', story_id=story.id, is_json=True))
+        self.assert200(response)
+        self.assertEqual(json.loads(response.data)['forecast']['p85'], str(today + timedelta(13)))
+        self.assert200(self.client.get(url_for('epic.show', epic_id=epic.id)))
+        self.assert200(self.client.get(url_for('epic.list_all')))
+
+    @patch('flask_login.utils._get_user')
+    def test_forecast_cache(self, current_user):
+        current_user.return_value = self.test_user
+        epic = noscrum.epic.create_epic('Cached Epic', 'red', None)
+        forecasts = get_forecasts()
+        self.assertIs(get_forecasts(), forecasts)
+        self.assertIsNone(forecasts['sprint_days'])
+        bump_data_version(self.test_user.id)
+        self.assertIsNot(get_forecasts(), forecasts)
+
+        today = date.today()
+        story = noscrum.story.create_story(epic.id, 'Cached Story', 1, None)
+        sprint = noscrum.sprint.create_sprint(today - timedelta(7), today - timedelta(1))
+        done = noscrum.task.create_task('Done', story.id, '10', None, sprint.id)
+        noscrum.task.update_task(done.id, None, None, None, 'Done', None, None, None, None)
+        task = noscrum.task.create_task('Open', story.id, '30', None, None)
+        bump_data_version(self.test_user.id)
+        self.assertEqual(get_forecasts()['epics'][epic.id]['remaining'], 30)
+        simulations = self.app.extensions['noscrum_simulations']
+        futures = simulations[self.test_user.id][1]
+        # Work on open tasks reuses the simulation of the same history
+        noscrum.work.create_work(today, 5, 'In Progress', task.id, False)
+        bump_data_version(self.test_user.id)
+        self.assertEqual(get_forecasts()['epics'][epic.id]['remaining'], 25)
+        self.assertIs(simulations[self.test_user.id][1], futures)
+        noscrum.task.update_task(task.id, None, None, None, None, None, None, sprint.id, None)
+        noscrum.task.update_task(task.id, None, None, None, 'Done', None, None, None, None)
+        bump_data_version(self.test_user.id)
+        get_forecasts()
+        self.assertIsNot(simulations[self.test_user.id][1], futures)
+
+    @patch('flask_login.utils._get_user')
+    def test_cache_evicts_old_users(self, current_user):
+        self.app.config['FORECAST_CACHE_USERS'] = 2
+        users = [self.test_user] + [
+            create_record(User, username=f'forecaster{i}', password='', active=True)
+            for i in range(2)]
+        for user in users:
+            current_user.return_value = user
+            noscrum.epic.create_epic('Epic', 'red', None)
+            get_forecasts()
+        forecasts = self.app.extensions['noscrum_forecasts']
+        self.assertEqual(list(forecasts), [users[1].id, users[2].id])
+        # Serving a user makes them the most recently used
+        current_user.return_value = users[1]
+        get_forecasts()
+        current_user.return_value = users[0]
+        get_forecasts()
+        self.assertEqual(list(forecasts), [users[1].id, users[0].id])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import io
+import json
+import unittest
+from datetime import date
+from unittest.mock import patch
+from flask import url_for
+import noscrum
+from noscrum.db import create_record, Epic, Story, Task, Tag, TagStory, User, WorkDay
+from noscrum.export import export_lines
+try:
+    from test_base import noscrumTestCase
+except ModuleNotFoundError:
+    from .test_base import noscrumTestCase
+
+
+class noscrumImportTest(noscrumTestCase):
+
+    def post_file(self, content, filename):
+        data = {'file': (io.BytesIO(content.encode()), filename)}
+        return self.client.post(url_for('importer.import_all'), data=data,
+                                content_type='multipart/form-data')
+
+    @patch('flask_login.utils._get_user')
+    def test_import_ndjson(self, current_user):
+        current_user.return_value = self.test_user
+        existing = noscrum.epic.create_epic('Existing Epic', 'red', None)
+        lines = [{'type': 'epic', 'epic': 'New Epic', 'color': 'blue'},
+                 {'type': 'story', 'story': 'Tagged', 'epic': 'New Epic', 'tags': ['a', 'b']},
+                 {'type': 'tag', 'tag': 'c'}]
+        lines += [{'task': f'Task {i}', 'story': 'Tagged', 'epic': 'New Epic',
+                   'estimate': 2, 'deadline': '2021-02-03'} for i in range(7)]
+        lines += [{'task': 'Old epic task', 'story': 'Fresh', 'epic': 'Existing Epic'}]
+        importer = noscrum.importer.WorkspaceImporter(self.test_user.id, chunk_size=4)
+        counts = importer.run(enumerate(lines, 1))
+        self.assertEqual(counts, {'epic': 1, 'story': 2, 'task': 8, 'tag': 3})
+        story = Story.query.filter_by(story='Tagged').one()
+        self.assertEqual(Epic.query.get(story.epic_id).epic, 'New Epic')
+        self.assertEqual(Task.query.filter_by(story_id=story.id).count(), 7)
+        self.assertEqual(TagStory.query.filter_by(story_id=story.id).count(), 2)
+        fresh = Story.query.filter_by(story='Fresh').one()
+        self.assertEqual(fresh.epic_id, existing.id)
+
+        response = self.post_file('\n'.join(json.dumps(x) for x in lines[:3]), 'again.ndjson')
+        self.assert200(response)
+        self.assertEqual(json.loads(response.data)['imported'],
+                         {'epic': 0, 'story': 0, 'task': 0, 'tag': 0})
+        self.assertEqual(Tag.query.filter_by(user_id=self.test_user.id, tag='a').count(), 1)
+
+    @patch('flask_login.utils._get_user')
+    def test_import_csv(self, current_user):
+        current_user.return_value = self.test_user
+        content = ('task,story,epic,estimate,status\n'
+                   'CSV one,CSV story,CSV epic,1.5,Done\n'
+                   'CSV two,CSV story,,,\n')
+        response = self.post_file(content, 'tasks.csv')
+        self.assert200(response)
+        self.assertEqual(json.loads(response.data)['imported']['task'], 2)
+        done = Task.query.filter_by(task='CSV one').one()
+        self.assertEqual((done.estimate, done.status), (1.5, 'Done'))
+        orphan = Task.query.filter_by(task='CSV two').one()
+        self.assertEqual(Story.query.get(orphan.story_id).epic_id,
+                         Epic.query.filter_by(epic='NULL', user_id=self.test_user.id).one().id)
+
+    @patch('flask_login.utils._get_user')
+    def test_import_bad_record(self, current_user):
+        current_user.return_value = self.test_user
+        response = self.post_file('{"task": "No story"}\n', 'bad.ndjson')
+        self.assert400(response)
+        self.assertIn('Line 1', json.loads(response.data)['error'])
+        self.assertEqual(Task.query.filter_by(task='No story').count(), 0)
+
+    def get_export(self, user_id):
+        """
+        The user's export with ids swapped for the position
+        of the row they point at, so two exports compare
+        """
+        lines = [json.loads(x) for x in export_lines(user_id)]
+        positions = {}
+        for line in lines:
+            table = positions.setdefault(line['table'], {})
+            table[line['row']['id']] = len(table)
+        rows = []
+        for line in lines:
+            row = {x: y for x, y in line['row'].items() if x not in ('id', 'user_id')}
+            for name in [x for x in row if x.endswith('_id') and row[x] is not None]:
+                row[name] = positions[name[:-len('_id')]][row[name]]
+            rows.append((line['table'], row))
+        return rows
+
+    @patch('flask_login.utils._get_user')
+    def test_restore_export(self, current_user):
+        current_user.return_value = self.test_user
+        epic = noscrum.epic.create_epic('Backup Epic', 'red', date(2021, 3, 1))
+        story = noscrum.story.create_story(epic.id, 'Backup Story', 2, None)
+        noscrum.story.insert_tag_story(story.id, noscrum.tag.create_tag('backup').id)
+        sprint = noscrum.sprint.create_sprint(date(2021, 1, 4), date(2021, 1, 10))
+        task = noscrum.task.create_task('Backup Task', story.id, '5', None, sprint.id)
+        chore = noscrum.task.create_task('Chore', story.id, '1', None, None)
+        noscrum.task.update_task(chore.id, None, None, None, None, None, None, None, '1')
+        noscrum.work.create_work(date(2021, 1, 5), 3, 'In Progress', task.id, True)
+        noscrum.sprint.create_schedule(sprint.id, task.id, date(2021, 1, 6), 9, 'pair')
+        noscrum.sprint.create_recurring_schedule(chore.id, 0, 11, None)
+        backup = ''.join(export_lines(self.test_user.id))
+
+        other = create_record(User, username='restored', password='', active=True)
+        current_user.return_value = other
+        importer = noscrum.importer.WorkspaceImporter(other.id, chunk_size=3)
+        counts = importer.run(noscrum.importer.read_ndjson(io.StringIO(backup)))
+        self.assertEqual((counts['task'], counts['sprint'], counts['work']), (2, 1, 1))
+        self.assertEqual(self.get_export(other.id), self.get_export(self.test_user.id))
+        self.assertEqual(WorkDay.query.filter_by(user_id=other.id).count(), 1)
+
+        # Restoring again reuses the parents, sprint, tags and weekly slot
+        importer = noscrum.importer.WorkspaceImporter(other.id)
+        counts = importer.run(noscrum.importer.read_ndjson(io.StringIO(backup)))
+        self.assertEqual((counts['epic'], counts['story'], counts['tag'], counts['task']),
+                         (0, 0, 0, 2))
+        self.assertNotIn('recurring_schedule', counts)
+        self.assertNotIn('sprint', counts)
+
+        with self.assertRaisesRegex(ValueError, 'Line 1: story 99 is not in the import'):
+            noscrum.importer.WorkspaceImporter(other.id).run(enumerate([
+                {'table': 'task', 'row': {'id': 1, 'task': 'Lost', 'story_id': 99}}], 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import json
+import unittest
+from unittest.mock import patch
+from flask import url_for
+import noscrum
+from noscrum.instrument import RequestStats, SLOW_STATEMENTS
+try:
+    from test_base import noscrumTestCase
+except ModuleNotFoundError:
+    from .test_base import noscrumTestCase
+
+
+class noscrumInstrumentTest(noscrumTestCase):
+
+    def test_slowest_statements(self):
+        stats = RequestStats()
+        for i in range(10):
+            stats.add_query(f'SELECT {i}', i / 1000)
+        self.assertEqual(stats.queries, 10)
+        self.assertAlmostEqual(stats.sql_seconds, 0.045)
+        self.assertEqual(sorted(x[2] for x in stats.slowest),
+                         [f'SELECT {i}' for i in range(10 - SLOW_STATEMENTS, 10)])
+
+    @patch('flask_login.utils._get_user')
+    def test_request_stats(self, current_user):
+        current_user.return_value = self.test_user
+        noscrum.epic.create_epic('Timed Epic', 'red', None)
+        with self.assertLogs('noscrum.requests', 'INFO') as logs:
+            response = self.client.get(url_for('epic.list_all'))
+        self.assert200(response)
+        self.assertIn('render;dur=', response.headers['Server-Timing'])
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((record['endpoint'], record['status']), ('epic.list_all', 200))
+        self.assertGreater(record['queries'], 0)
+        self.assertGreater(record['render_ms'], 0)
+        self.assertIn(f"desc=\"{record['queries']} queries\"", response.headers['Server-Timing'])
+        self.assertLessEqual(len(record['slowest']), SLOW_STATEMENTS)
+
+        self.assert404(self.client.get(url_for('instrument.requests', is_json=True)))
+        self.app.config['DEBUG_REQUESTS'] = True
+        response = self.client.get(url_for('instrument.requests', is_json=True))
+        self.assert200(response)
+        history = json.loads(response.data)['requests']
+        self.assertEqual(history[0]['status'], 404)
+        self.assertIn(record, history)
+        self.assert200(self.client.get(url_for('instrument.requests')))
+
+        current_user.return_value = noscrum.db.create_record(
+            noscrum.db.User, username='otheruser', password='', active=True)
+        response = self.client.get(url_for('instrument.requests', is_json=True))
+        self.assertEqual([x['path'] for x in json.loads(response.data)['requests']], [])
+
+    def test_failed_statement_timing(self):
+        engine = noscrum.db.get_db().engine
+        with engine.connect() as conn:
+            with self.assertRaises(Exception):
+                conn.execute('SELECT * FROM no_such_table')
+            conn.execute('SELECT 1')
+            self.assertNotIn('query_started', conn.info)
+
+
+if __name__ == '__main__':
+    unittest.main()
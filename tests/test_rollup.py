@@ -0,0 +1,95 @@
+import unittest
+from datetime import date
+from unittest.mock import patch
+import noscrum
+from noscrum.db import get_db, SprintRollup, Task
+from noscrum.rollup import drop_rollups, rollup_change
+try:
+    from test_base import noscrumTestCase
+except ModuleNotFoundError:
+    from .test_base import noscrumTestCase
+
+
+class noscrumRollupTest(noscrumTestCase):
+
+    def board_sums(self, sprint_id):
+        stories, epics, _, totals, _, _, _ = noscrum.sprint.get_sprint_details(sprint_id)
+        return (totals,
+                {x: (y['estimate'], y['tasks'], y['active_tasks'], y['rem_estimate'])
+                 for x, y in epics.items()},
+                {x: (y['estimate'], y['tasks'], y['unestimated_tasks']) for x, y in stories.items()})
+
+    def assert_cache_is_fresh(self, sprint_id):
+        cached = self.board_sums(sprint_id)
+        drop_rollups(self.test_user.id)
+        self.assertEqual(cached, self.board_sums(sprint_id))
+
+    @patch('flask_login.utils._get_user')
+    def test_rollup_follows_writes(self, current_user):
+        current_user.return_value = self.test_user
+        epic = noscrum.epic.create_epic('Rollup Epic', 'red', None)
+        other_epic = noscrum.epic.create_epic('Other Epic', 'blue', None)
+        story = noscrum.story.create_story(epic.id, 'Rollup Story', 1, None)
+        sprint = noscrum.sprint.create_sprint(date(2021, 1, 4), date(2021, 1, 10))
+        later = noscrum.sprint.create_sprint(date(2021, 1, 11), date(2021, 1, 17))
+        first = noscrum.task.create_task('First', story.id, '3', None, sprint.id)
+        self.board_sums(sprint.id)
+        self.board_sums(later.id)
+        self.assertEqual(SprintRollup.query.filter_by(user_id=self.test_user.id).count(), 2)
+
+        second = noscrum.task.create_task('Second', story.id, '5', None, sprint.id)
+        noscrum.task.create_task('Unestimated', story.id, None, None, sprint.id)
+        loose = noscrum.task.create_task('Loose', story.id, '2', None, None)
+        noscrum.task.update_task(first.id, None, None, None, 'Done', None, None, None, None)
+        noscrum.work.create_work(date(2021, 1, 5), 2, 'In Progress', second.id, True)
+        noscrum.sprint.create_schedule(later.id, loose.id, date(2021, 1, 12), 9, None)
+        noscrum.task.update_task(second.id, None, None, '8', None, None, None, later.id, None)
+        noscrum.task.update_task(loose.id, None, None, None, None, None, None, None, '1')
+        noscrum.story.update_story(story.id, 'Rollup Story', other_epic.id, 1, None)
+        self.assertEqual(self.board_sums(sprint.id)[0]['Done'], 3)
+        self.assert_cache_is_fresh(sprint.id)
+        self.board_sums(sprint.id)
+        self.assert_cache_is_fresh(later.id)
+
+        schedule = noscrum.sprint.get_schedule_by_time(later.id, date(2021, 1, 12), 9)
+        self.board_sums(later.id)
+        noscrum.sprint.delete_schedule(schedule.id)
+        self.assert_cache_is_fresh(later.id)
+
+    @patch('flask_login.utils._get_user')
+    def test_interleaved_changes(self, current_user):
+        current_user.return_value = self.test_user
+        epic = noscrum.epic.create_epic('Rollup Epic', 'red', None)
+        story = noscrum.story.create_story(epic.id, 'Rollup Story', 1, None)
+        sprint = noscrum.sprint.create_sprint(date(2021, 1, 4), date(2021, 1, 10))
+        later = noscrum.sprint.create_sprint(date(2021, 1, 11), date(2021, 1, 17))
+        first = noscrum.task.create_task('First', story.id, '3', None, sprint.id)
+        second = noscrum.task.create_task('Second', story.id, '5', None, sprint.id)
+        self.board_sums(sprint.id)
+        self.board_sums(later.id)
+
+        def set_estimate(task_id, estimate):
+            Task.query.get(task_id).estimate = estimate
+            get_db().session.commit()
+
+        def get_version(sprint_id):
+            rollup = SprintRollup.query.filter_by(sprint_id=sprint_id).first()
+            return None if rollup is None else rollup.version
+
+        with rollup_change(first.id):
+            with rollup_change(second.id):
+                set_estimate(second.id, 7)
+            self.assertEqual(get_version(sprint.id), 1)
+            set_estimate(first.id, 4)
+        # The outer change saw version 0, so its sums are not trusted
+        self.assertIsNone(get_version(sprint.id))
+        self.assertEqual(get_version(later.id), 0)
+        self.assertEqual(self.board_sums(sprint.id)[0]['To-Do'], 11)
+        with rollup_change(first.id):
+            set_estimate(first.id, 1)
+        self.assertEqual(get_version(sprint.id), 1)
+        self.assert_cache_is_fresh(sprint.id)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import json
+import unittest
+from datetime import date
+from unittest.mock import patch
+from flask import url_for
+import noscrum
+from noscrum.db import get_db, Epic
+try:
+    from test_base import noscrumTestCase
+except ModuleNotFoundError:
+    from .test_base import noscrumTestCase
+
+
+class noscrumSearchTest(noscrumTestCase):
+
+    def search(self, text, **args):
+        response = self.client.get(url_for('search.results', q=text, is_json=True, **args))
+        self.assert200(response)
+        return json.loads(response.data)
+
+    def add_backlog(self):
+        epic = noscrum.epic.create_epic('Deployment pipeline', 'red', None)
+        story = noscrum.story.create_story(epic.id, 'Release automation', 1, None)
+        task = noscrum.task.create_task('Write deploy script', story.id, '2', None, None)
+        return epic, story, task
+
+    @patch('flask_login.utils._get_user')
+    def test_prefix_search(self, current_user):
+        current_user.return_value = self.test_user
+        epic, story, task = self.add_backlog()
+        found = {(x['kind'], x['record_id']) for x in self.search('depl')['results']}
+        self.assertEqual(found, {('epic', epic.id), ('task', task.id)})
+        found = self.search('release auto')['results']
+        self.assertEqual([(x['kind'], x['record_id']) for x in found], [('story', story.id)])
+        self.assertEqual(found[0]['url'], url_for('story.show', story_id=story.id))
+        self.assertEqual(self.search('"*')['results'], [])
+        # The owner column is indexed as u<id> but is not searched
+        self.assertEqual(self.search('u')['results'], [])
+        self.assertEqual(self.search(f'u{self.test_user.id}')['results'], [])
+
+    @patch('flask_login.utils._get_user')
+    def test_index_follows_changes(self, current_user):
+        current_user.return_value = self.test_user
+        _, _, task = self.add_backlog()
+        noscrum.task.update_task(task.id, 'Rotate certificates', None, None, None,
+                                 None, None, None, None)
+        self.assertEqual(self.search('script')['results'], [])
+        self.assertEqual(len(self.search('certif')['results']), 1)
+        sprint = noscrum.sprint.create_sprint(date(2021, 1, 4), date(2021, 1, 10))
+        noscrum.sprint.create_schedule(sprint.id, task.id, date(2021, 1, 5), 9, 'pair with ops')
+        notes = self.search('ops')['results']
+        self.assertEqual([x['kind'] for x in notes], ['schedule_task'])
+        self.assertEqual(notes[0]['url'], url_for('sprint.show', sprint_id=sprint.id))
+        other = Epic(epic='Deployment for someone else', user_id=self.test_user.id + 1000)
+        get_db().session.add(other)
+        get_db().session.commit()
+        self.assertNotIn(other.id, [x['record_id'] for x in self.search('deploy')['results']])
+        schedule = noscrum.sprint.get_schedule_by_time(sprint.id, date(2021, 1, 5), 9)
+        noscrum.sprint.delete_schedule(schedule.id)
+        self.assertEqual(self.search('ops')['results'], [])
+
+    @patch('flask_login.utils._get_user')
+    def test_pages_and_rebuild(self, current_user):
+        current_user.return_value = self.test_user
+        for i in range(5):
+            noscrum.epic.create_epic(f'Paged epic {i}', 'red', None)
+        first = self.search('paged', limit=3)
+        second = self.search('paged', limit=3, page=first['next_page'])
+        self.assertEqual((len(first['results']), len(second['results'])), (3, 2))
+        self.assertIsNone(second['next_page'])
+        response = self.client.get(url_for('search.results', q='paged'))
+        self.assert200(response)
+        self.assertIn(b'<mark>Paged</mark>', response.data)
+        get_db().session.execute('DELETE FROM search_index')
+        get_db().session.commit()
+        self.assertEqual(noscrum.search.rebuild_search(get_db()), 5)
+        self.assertEqual(len(self.search('paged')['results']), 5)
+        result = self.app.test_cli_runner().invoke(noscrum.search.rebuild_search_command)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Indexed 5 records', result.output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date
+from unittest.mock import patch
+import sqlalchemy as sa
+from flask_user.tests.utils import utils_prepare_user
+import noscrum
+from noscrum.db import get_db, create_record, User, Epic, Task
+from noscrum.export import export_lines
+try:
+    from test_base import noscrumTestCase
+except ModuleNotFoundError:
+    from .test_base import noscrumTestCase
+
+
+class noscrumShardingTest(noscrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.workdir = tempfile.mkdtemp(prefix='noscrum-test-')
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.shards = os.path.join(self.workdir, 'shards')
+        # Apps made here share the session of self.app's thread
+        self.addCleanup(get_db().session.remove)
+
+    def make_app(self, sharded):
+        config = {'TESTING': True, 'SECRET_KEY': 'TESTING_KEY',
+                  'SQLALCHEMY_DATABASE_URI':
+                  f"sqlite:///{os.path.join(self.workdir, 'noscrum.sqlite')}"}
+        if sharded:
+            config['SHARD_DATABASE_URI'] = \
+                f"sqlite:///{os.path.join(self.shards, 'user_{user_id}.sqlite')}"
+        get_db().session.remove()
+        return noscrum.create_app(config)
+
+    def add_users(self, app):
+        first = utils_prepare_user(app)
+        second = create_record(User, username='seconduser', password='', active=True)
+        return first.id, second.id
+
+    def add_workspace(self, current_user, user_id, name):
+        current_user.return_value = User.query.get(user_id)
+        epic = noscrum.epic.create_epic(f'{name} Epic', 'red', None)
+        story = noscrum.story.create_story(epic.id, f'{name} Story', 1, None)
+        task = noscrum.task.create_task(f'{name} Task', story.id, '2', None, None)
+        noscrum.work.create_work(date.today(), 1, 'In Progress', task.id, False)
+
+    def count(self, engine, model):
+        return engine.execute(sa.select([sa.func.count()]).select_from(model.__table__)).scalar()
+
+    def get_export(self, current_user, user_id):
+        current_user.return_value = User.query.get(user_id)
+        return [json.loads(x) for x in export_lines(user_id)]
+
+    @patch('flask_login.utils._get_user')
+    def test_routing(self, current_user):
+        app = self.make_app(sharded=True)
+        with app.app_context():
+            first, second = self.add_users(app)
+            self.add_workspace(current_user, first, 'First')
+            self.add_workspace(current_user, second, 'Second')
+            router = app.extensions['noscrum_router']
+            self.assertEqual(self.count(get_db().engine, Epic), 0)
+            self.assertEqual(User.query.count(), 2)
+            for user_id, name in ((first, 'First Epic'), (second, 'Second Epic')):
+                self.assertTrue(router.has_shard(user_id))
+                shard = router.get_engine(user_id)
+                self.assertEqual([x for x, in shard.execute('SELECT epic FROM epic')], [name])
+            current_user.return_value = User.query.get(first)
+            response = app.test_client().get('/task/?is_json=1')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'First Task', response.data)
+            self.assertNotIn(b'Second Task', response.data)
+
+    @patch('flask_login.utils._get_user')
+    def test_import_into_shard(self, current_user):
+        app = self.make_app(sharded=True)
+        with app.app_context():
+            first, _ = self.add_users(app)
+            self.add_workspace(current_user, first, 'First')
+            path = os.path.join(self.workdir, 'import.ndjson')
+            with open(path, 'w', encoding='utf-8') as stream:
+                stream.write(json.dumps({'task': 'Imported Task', 'story': 'First Story',
+                                         'epic': 'First Epic', 'tags': ['new']}) + '\n')
+            # No one is logged in on the command line
+            current_user.return_value = None
+            result = app.test_cli_runner().invoke(noscrum.importer.import_user_command,
+                                                  ['testuser', path])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('Imported 0 epic records', result.output)
+            shard = app.extensions['noscrum_router'].get_engine(first)
+            self.assertEqual([x for x, in shard.execute('SELECT epic FROM epic')], ['First Epic'])
+            self.assertEqual(
+                [x for x, in shard.execute('SELECT story.story FROM task JOIN story ' +
+                                           'ON story.id = task.story_id ORDER BY task.id')],
+                ['First Story', 'First Story'])
+            self.assertEqual(self.count(get_db().engine, Task), 0)
+
+    def test_shard_uri(self):
+        with self.assertRaises(ValueError):
+            noscrum.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'TESTING': True,
+                                'SHARD_DATABASE_URI': 'sqlite:///shard.sqlite'})
+        self.assertNotIn('noscrum_router', self.app.extensions)
+
+    @patch('flask_login.utils._get_user')
+    def test_split_merge(self, current_user):
+        app = self.make_app(sharded=False)
+        with app.app_context():
+            first, second = self.add_users(app)
+            self.add_workspace(current_user, first, 'First')
+            self.add_workspace(current_user, second, 'Second')
+            before = self.get_export(current_user, first)
+
+        app = self.make_app(sharded=True)
+        with app.app_context():
+            result = app.test_cli_runner().invoke(noscrum.sharding.split_shards_command, [])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('testuser: moved', result.output)
+            self.assertEqual(self.count(get_db().engine, Task), 0)
+            router = app.extensions['noscrum_router']
+            self.assertEqual(self.count(router.get_engine(second), Task), 1)
+            self.assertEqual(self.get_export(current_user, first), before)
+            # An epic, story and task indexed in each shard
+            result = app.test_cli_runner().invoke(noscrum.search.rebuild_search_command, [])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('Indexed 6 records.', result.output)
+            # New rows of one shard take ids used in the other
+            story_id = noscrum.story.get_stories()[0].id
+            task = noscrum.task.create_task('Later Task', story_id, '1', None, None)
+            self.assertTrue(Task.query.get(task.id))
+            sharded = self.get_export(current_user, first)
+            result = app.test_cli_runner().invoke(noscrum.sharding.split_shards_command, [])
+            self.assertIn('skipped', result.output)
+
+            result = app.test_cli_runner().invoke(noscrum.sharding.merge_shards_command, [])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertFalse(os.listdir(self.shards))
+
+        app = self.make_app(sharded=False)
+        with app.app_context():
+            self.assertEqual(self.get_export(current_user, first), sharded)
+            rows = self.get_export(current_user, second)
+            stories = {x['row']['id'] for x in rows if x['table'] == 'story'}
+            tasks = {x['row']['id']: x['row'] for x in rows if x['table'] == 'task'}
+            work = [x['row'] for x in rows if x['table'] == 'work']
+            self.assertEqual([x['task'] for x in tasks.values()], ['Second Task'])
+            self.assertNotIn(task.id, tasks)
+            self.assertTrue(all(x['story_id'] in stories for x in tasks.values()))
+            self.assertEqual([x['task_id'] in tasks for x in work], [True])
+            self.assertEqual(self.count(get_db().engine, Task), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import json
+import unittest
+from datetime import date
+from unittest.mock import patch
+from flask import url_for
+import noscrum
+from noscrum.db import ScheduleTask
+from noscrum.rollup import drop_rollups
+try:
+    from test_base import noscrumTestCase
+except ModuleNotFoundError:
+    from .test_base import noscrumTestCase
+
+
+class noscrumSprintTest(noscrumTestCase):
+
+    def post_batch(self, sprint_id, operations):
+        return self.client.post(url_for('sprint.schedule_batch', sprint_id=sprint_id),
+                                json={'operations': operations})
+
+    def get_slots(self, sprint_id):
+        return {(str(x.sprint_day), x.sprint_hour): x.task_id for x in
+                ScheduleTask.query.filter(ScheduleTask.sprint_id == sprint_id)}
+
+    @patch('flask_login.utils._get_user')
+    def test_schedule_batch(self, current_user):
+        current_user.return_value = self.test_user
+        epic = noscrum.epic.create_epic('Batch Epic', 'red', None)
+        story = noscrum.story.create_story(epic.id, 'Batch Story', 1, None)
+        sprint = noscrum.sprint.create_sprint(date(2021, 1, 4), date(2021, 1, 17))
+        first, second, third = (noscrum.task.create_task(f'Task {i}', story.id, '2', None, sprint.id)
+                                for i in range(3))
+        moving = noscrum.sprint.create_schedule(sprint.id, first.id, date(2021, 1, 4), 9, 'keep')
+        noscrum.sprint.create_schedule(sprint.id, second.id, date(2021, 1, 4), 11, None)
+        dropped = noscrum.sprint.create_schedule(sprint.id, second.id, date(2021, 1, 5), 9, None)
+        moving_id, dropped_id = moving.id, dropped.id
+        noscrum.sprint.get_sprint_details(sprint.id)
+        operations = [{'op': 'create', 'task_id': third.id, 'sprint_day': f'2021-01-{day:02}',
+                       'sprint_hour': 13} for day in range(4, 18)]
+        operations += [{'op': 'move', 'schedule_id': moving_id,
+                        'sprint_day': '2021-01-04', 'sprint_hour': 11},
+                       {'op': 'delete', 'schedule_id': dropped_id},
+                       {'op': 'create', 'task_id': second.id, 'sprint_day': '2021-01-04',
+                        'sprint_hour': 13, 'note': 'last write wins'}]
+        response = self.post_batch(sprint.id, operations)
+        self.assert200(response)
+        result = json.loads(response.data)
+        self.assertEqual((result['deleted'], result['moved'], result['created']), (2, 1, 14))
+        self.assertEqual(result['slots']['2021-01-04']['11'], {
+            'id': moving_id, 'task_id': first.id, 'duration': 2, 'note': 'keep'})
+        self.assertEqual(result['slots']['2021-01-04']['13']['note'], 'last write wins')
+        slots = self.get_slots(sprint.id)
+        self.assertEqual(len(slots), 15)
+        self.assertEqual(slots[('2021-01-04', 13)], second.id)
+        self.assertNotIn(('2021-01-05', 9), slots)
+        self.assertEqual(ScheduleTask.query.filter(ScheduleTask.sprint_id == sprint.id).count(), 15)
+        cached = noscrum.sprint.get_sprint_details(sprint.id)[3]
+        drop_rollups(self.test_user.id)
+        self.assertEqual(cached, noscrum.sprint.get_sprint_details(sprint.id)[3])
+
+        for operations in ([{'op': 'delete', 'schedule_id': dropped_id + 1000}],
+                           [{'op': 'create', 'task_id': first.id, 'sprint_day': '2021-02-01',
+                             'sprint_hour': 9}],
+                           [{'op': 'create', 'task_id': first.id + 1000, 'sprint_day': '2021-01-06',
+                             'sprint_hour': 9}],
+                           [{'op': 'delete', 'schedule_id': moving_id},
+                            {'op': 'move', 'schedule_id': moving_id,
+                             'sprint_day': '2021-01-06', 'sprint_hour': 9}],
+                           [{'op': 'rename'}]):
+            self.assert400(self.post_batch(sprint.id, operations))
+        self.assertEqual(self.get_slots(sprint.id), slots)
+
+    @patch('flask_login.utils._get_user')
+    def test_schedule_batch_order(self, current_user):
+        current_user.return_value = self.test_user
+        epic = noscrum.epic.create_epic('Batch Epic', 'red', None)
+        story = noscrum.story.create_story(epic.id, 'Batch Story', 1, None)
+        sprint = noscrum.sprint.create_sprint(date(2021, 1, 4), date(2021, 1, 10))
+        first, second, third = (noscrum.task.create_task(f'Task {i}', story.id, '2', None, sprint.id)
+                                for i in range(3))
+        first_id = noscrum.sprint.create_schedule(sprint.id, first.id, date(2021, 1, 4), 9, None).id
+        second_id = noscrum.sprint.create_schedule(
+            sprint.id, second.id, date(2021, 1, 4), 11, None).id
+        day = '2021-01-04'
+        # Each move lands in the slot the operation before it emptied
+        response = self.post_batch(sprint.id, [
+            {'op': 'move', 'schedule_id': first_id, 'sprint_day': day, 'sprint_hour': 13},
+            {'op': 'move', 'schedule_id': second_id, 'sprint_day': day, 'sprint_hour': 9},
+            {'op': 'create', 'task_id': third.id, 'sprint_day': day, 'sprint_hour': 11},
+            {'op': 'move', 'schedule_id': first_id, 'sprint_day': day, 'sprint_hour': 15},
+            {'op': 'move', 'schedule_id': second_id, 'sprint_day': day, 'sprint_hour': 13}])
+        self.assert200(response)
+        self.assertEqual(json.loads(response.data)['deleted'], 0)
+        slots = {(day, 11): third.id, (day, 13): second.id, (day, 15): first.id}
+        self.assertEqual(self.get_slots(sprint.id), slots)
+        # A schedule replaced earlier in the batch is gone
+        response = self.post_batch(sprint.id, [
+            {'op': 'move', 'schedule_id': first_id, 'sprint_day': day, 'sprint_hour': 13},
+            {'op': 'delete', 'schedule_id': second_id}])
+        self.assert400(response)
+        self.assertEqual(self.get_slots(sprint.id), slots)
+
+    @patch('flask_login.utils._get_user')
+    def test_slot_length(self, current_user):
+        current_user.return_value = self.test_user
+        epic = noscrum.epic.create_epic('Slot Epic', 'red', None)
+        story = noscrum.story.create_story(epic.id, 'Slot Story', 1, None)
+        sprint = noscrum.sprint.create_sprint(date(2021, 1, 4), date(2021, 1, 10))
+        task = noscrum.task.create_task('Slot Task', story.id, '8', None, sprint.id)
+        noscrum.sprint.create_schedule(sprint.id, task.id, date(2021, 1, 4), 9, None)
+
+        response = self.client.put(url_for('user.profile'),
+                                   data={'day_start': 8, 'day_end': 17, 'slot_hours': 3})
+        self.assert200(response)
+        self.assertEqual(self.test_user.slot_hours, 3)
+        for settings in ({'day_start': 18}, {'slot_hours': 0}, {'day_end': 'noon'}):
+            self.assert400(self.client.put(url_for('user.profile'), data=settings))
+        noscrum.sprint.create_schedule(sprint.id, task.id, date(2021, 1, 4), 11, None)
+        noscrum.sprint.create_schedule(sprint.id, task.id, date(2021, 1, 5), 8, None, 1)
+        # Slots of the default length must also end by midnight
+        for form in ({'sprint_hour': 23}, {'sprint_hour': 9, 'duration': ''},
+                     {'sprint_hour': 9, 'duration': 'abc'}, {'sprint_hour': 'nine'}):
+            response = self.client.post(
+                url_for('sprint.schedule', sprint_id=sprint.id, is_json=True),
+                data=dict(form, task_id=task.id, sprint_day='2021-01-06'))
+            self.assert400(response)
+        day = '2021-01-06'
+        response = self.post_batch(sprint.id, [
+            {'op': 'create', 'task_id': task.id, 'sprint_day': day, 'sprint_hour': 22}])
+        self.assert400(response)
+        moving_id = noscrum.sprint.get_schedule_by_time(sprint.id, date(2021, 1, 4), 11).id
+        response = self.post_batch(sprint.id, [
+            {'op': 'move', 'schedule_id': moving_id, 'sprint_day': day, 'sprint_hour': 22}])
+        self.assert400(response)
+        response = self.post_batch(sprint.id, [
+            {'op': 'move', 'schedule_id': moving_id, 'sprint_day': day, 'sprint_hour': 21}])
+        self.assert200(response)
+        response = self.post_batch(sprint.id, [
+            {'op': 'move', 'schedule_id': moving_id, 'sprint_day': '2021-01-04',
+             'sprint_hour': 11}])
+        self.assert200(response)
+
+        details = noscrum.sprint.get_sprint_details(sprint.id)
+        self.assertEqual(details[2][task.id]['sum_sched'], 6)
+        self.assertEqual([x['sum_sched'] for x in noscrum.task.get_tasks()], [6])
+        self.assertEqual([x[2] for x in details[4]], [(8, 11, 14)] * 7)
+        self.assertIs(details[4], noscrum.sprint.get_sprint_details(sprint.id)[4])
+        response = self.client.get(url_for('sprint.show', sprint_id=sprint.id))
+        self.assert200(response)
+        self.assertIn(b'Total Hours Scheduled for Sprint: 6', response.data)
+        self.assertIn(b'Hours Scheduled for Day: 5', response.data)
+        # The 2 hour slot from before the change keeps its row
+        self.assertIn(b'id="r_0_9"', response.data)
+        self.assertNotIn(b'id="r_1_9"', response.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+from sqlalchemy.pool import QueuePool
+import noscrum
+from noscrum.storage import get_engine_options
+try:
+    from test_base import noscrumTestCase
+except ModuleNotFoundError:
+    from .test_base import noscrumTestCase
+
+
+class noscrumStorageTest(noscrumTestCase):
+
+    def make_file_app(self, **config):
+        workdir = tempfile.mkdtemp(prefix='noscrum-test-')
+        self.addCleanup(shutil.rmtree, workdir)
+        return noscrum.create_app(dict(
+            config, TESTING=True, SECRET_KEY='TESTING_KEY',
+            SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(workdir, 'test.sqlite')}"))
+
+    def test_engine_options(self):
+        config = dict(self.app.config)
+        self.assertEqual(get_engine_options(config), {})
+        config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:////tmp/noscrum.sqlite'
+        options = get_engine_options(config)
+        self.assertIs(options['poolclass'], QueuePool)
+        self.assertEqual(options['pool_size'], config['DB_POOL_SIZE'])
+        self.assertFalse(options['connect_args']['check_same_thread'])
+        config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://noscrum@localhost/noscrum'
+        options = get_engine_options(config)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertNotIn('poolclass', options)
+
+    def test_production_profile(self):
+        app = self.make_file_app(DB_POOL_SIZE=2)
+        with app.app_context():
+            engine = noscrum.db.get_db().engine
+            self.assertIsInstance(engine.pool, QueuePool)
+            self.assertEqual(engine.pool.size(), 2)
+            with engine.connect() as connection:
+                pragma = lambda name: connection.execute(f'PRAGMA {name}').scalar()
+                self.assertEqual(pragma('journal_mode'), 'wal')
+                self.assertEqual(pragma('synchronous'), 1)
+                self.assertEqual(pragma('temp_store'), 2)
+                self.assertEqual(pragma('busy_timeout'), 5000)
+
+    def test_default_profile(self):
+        app = self.make_file_app(SQLITE_PROFILE='default', SQLITE_PRAGMAS={'cache_size': -1024})
+        with app.app_context():
+            with noscrum.db.get_db().engine.connect() as connection:
+                self.assertEqual(connection.execute('PRAGMA journal_mode').scalar(), 'delete')
+                self.assertEqual(connection.execute('PRAGMA cache_size').scalar(), -1024)
+        with self.assertRaises(ValueError):
+            self.make_file_app(SQLITE_PROFILE='fastest')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import json
+import unittest
+from unittest.mock import patch
+from flask import url_for
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import noscrum
+try:
+    from test_base import noscrumTestCase
+except ModuleNotFoundError:
+    from .test_base import noscrumTestCase
+
+
+class noscrumTaskTest(noscrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.statements = []
+
+    def count_statement(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def add_stories(self, epic, count, tasks_per_story):
+        for i in range(count):
+            story = noscrum.story.create_story(
+                epic.id, f'{epic.epic} Story {i}', 1, None)
+            for j in range(tasks_per_story):
+                noscrum.task.create_task(
+                    f'Task {i}.{j}', story.id, '2', None, None)
+
+    def count_list_queries(self):
+        engine = noscrum.db.get_db().engine
+        self.statements = []
+        event.listen(engine, 'before_cursor_execute', self.count_statement)
+        try:
+            response = self.client.get(url_for('task.list_all'))
+        finally:
+            event.remove(engine, 'before_cursor_execute', self.count_statement)
+        self.assert200(response)
+        return len(self.statements)
+
+    @patch('flask_login.utils._get_user')
+    def test_list_all_query_count_is_constant(self, current_user):
+        current_user.return_value = self.test_user
+        epic = noscrum.epic.create_epic('Query Count Epic', 'red', None)
+        self.add_stories(epic, 2, 2)
+        small = self.count_list_queries()
+        self.add_stories(noscrum.epic.create_epic('Second Epic', 'blue', None), 20, 3)
+        self.add_stories(epic, 20, 3)
+        large = self.count_list_queries()
+        self.assertEqual(small, large, 'Task list queries grow with stories')
+
+    @patch('flask_login.utils._get_user')
+    def test_task_tree(self, current_user):
+        current_user.return_value = self.test_user
+        epic = noscrum.epic.create_epic('Tree Epic', 'red', None)
+        self.add_stories(epic, 3, 2)
+        tree = [x for x in noscrum.task.get_task_tree() if x.id == epic.id]
+        self.assertEqual(len(tree), 1)
+        self.assertEqual(len(tree[0].stories), 3)
+        self.assertEqual(len(tree[0].tasks), 6)
+        for story in tree[0].stories:
+            self.assertEqual(len(story.tasks), 2)
+
+    @patch('flask_login.utils._get_user')
+    def test_list_all_json_pages(self, current_user):
+        current_user.return_value = self.test_user
+        epic = noscrum.epic.create_epic('Page Epic', 'red', None)
+        self.add_stories(epic, 2, 3)
+        expected = [x.id for x in noscrum.db.Task.query.filter_by(
+            user_id=self.test_user.id).order_by(noscrum.db.Task.id)]
+        seen, cursor = [], None
+        while True:
+            query = {'is_json': True, 'limit': 4}
+            if cursor:
+                query['after'] = cursor
+            response = self.client.get(url_for('task.list_all', **query))
+            self.assert200(response)
+            page = json.loads(response.data)
+            self.assertLessEqual(len({x['id'] for x in page['tasks']}), 4)
+            seen += [x['id'] for x in page['tasks']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+        response = self.client.get(url_for('task.list_all', is_json=True, after='bogus'))
+        self.assert400(response)
+
+    @patch('flask_login.utils._get_user')
+    def test_create_task_returns_flushed_row(self, current_user):
+        current_user.return_value = self.test_user
+        epic = noscrum.epic.create_epic('Create Epic', 'red', None)
+        story = noscrum.story.create_story(epic.id, 'Create Story', 1, None)
+        noscrum.task.create_task('Same Name', story.id, '1', None, None)
+        story_id = story.id
+        event.listen(Engine, 'before_cursor_execute', self.count_statement)
+        try:
+            task = noscrum.task.create_task('Same Name', story_id, '2', None, None)
+            self.assertEqual((task.task, task.estimate), ('Same Name', 2.0))
+        finally:
+            event.remove(Engine, 'before_cursor_execute', self.count_statement)
+        task_statements = [x for x in self.statements if 'task' in x]
+        self.assertEqual(len(task_statements), 1, task_statements)
+        self.assertTrue(task_statements[0].startswith('INSERT'))
+        self.assertEqual(noscrum.db.Task.query.get(task.id).estimate, 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import json
+import unittest
+from datetime import date
+from unittest.mock import patch
+from flask import url_for
+import noscrum
+from noscrum.db import get_db, Task, WorkDay
+from noscrum.work_days import rebuild_work_days
+try:
+    from test_base import noscrumTestCase
+except ModuleNotFoundError:
+    from .test_base import noscrumTestCase
+
+
+class noscrumWorkTest(noscrumTestCase):
+
+    def get_actual(self, task_id):
+        return get_db().session.query(Task.actual).filter(Task.id == task_id).scalar()
+
+    @patch('flask_login.utils._get_user')
+    def test_actual_follows_work(self, current_user):
+        current_user.return_value = self.test_user
+        epic = noscrum.epic.create_epic('Work Epic', 'red', None)
+        story = noscrum.story.create_story(epic.id, 'Work Story', 1, None)
+        task = noscrum.task.create_task('Work Task', story.id, '8', None, None)
+        first_id = noscrum.work.create_work(date(2021, 1, 4), 3, 'In Progress', task.id, True).id
+        noscrum.work.create_work(date(2021, 1, 5), 2, 'Done', task.id, False)
+        self.assertEqual(self.get_actual(task.id), 5)
+        self.assertEqual(noscrum.task.get_task(task.id).status, 'In Progress')
+        self.assertEqual(noscrum.work.delete_work(first_id), first_id)
+        self.assertEqual(self.get_actual(task.id), 2)
+        self.assertIsNone(noscrum.work.delete_work(first_id))
+
+    @patch('flask_login.utils._get_user')
+    def test_delete_last_work(self, current_user):
+        current_user.return_value = self.test_user
+        epic = noscrum.epic.create_epic('Work Epic', 'red', None)
+        story = noscrum.story.create_story(epic.id, 'Work Story', 1, None)
+        task = noscrum.task.create_task('Work Task', story.id, '8', None, None)
+        noscrum.task.update_task(task.id, None, None, None, None, '6', None, None, None)
+        work_id = noscrum.work.create_work(date(2021, 1, 4), 3, 'In Progress', task.id, False).id
+        self.assertEqual(self.get_actual(task.id), 9)
+        noscrum.work.delete_work(work_id)
+        self.assertEqual(self.get_actual(task.id), 6)
+        self.assertEqual(noscrum.work.reconcile_actuals(get_db()), 0)
+        self.assertEqual(self.get_actual(task.id), 6)
+
+    @patch('flask_login.utils._get_user')
+    def test_reconcile_actuals(self, current_user):
+        current_user.return_value = self.test_user
+        epic = noscrum.epic.create_epic('Work Epic', 'red', None)
+        story = noscrum.story.create_story(epic.id, 'Work Story', 1, None)
+        logged = noscrum.task.create_task('Logged', story.id, '8', None, None)
+        manual = noscrum.task.create_task('Manual', story.id, '8', None, None)
+        noscrum.work.create_work(date(2021, 1, 4), 3, 'In Progress', logged.id, False)
+        noscrum.work.create_work(date(2021, 1, 5), 4, 'In Progress', logged.id, False)
+        noscrum.task.update_task(logged.id, None, None, None, None, '1', None, None, None)
+        noscrum.task.update_task(manual.id, None, None, None, None, '6', None, None, None)
+        self.assertEqual(noscrum.work.reconcile_actuals(get_db()), 1)
+        self.assertEqual((self.get_actual(logged.id), self.get_actual(manual.id)), (7, 6))
+        result = self.app.test_cli_runner().invoke(noscrum.work.reconcile_actuals_command)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Repaired 0 task actuals', result.output)
+
+    def get_work_days(self):
+        return sorted((str(x.work_date), x.task_id, x.story_id, x.epic_id, x.hours)
+                      for x in WorkDay.query)
+
+    @patch('flask_login.utils._get_user')
+    def test_work_days_follow_work(self, current_user):
+        current_user.return_value = self.test_user
+        epic = noscrum.epic.create_epic('Report Epic', 'red', None)
+        other_epic = noscrum.epic.create_epic('Other Epic', 'blue', None)
+        story = noscrum.story.create_story(epic.id, 'Report Story', 1, None)
+        other_story = noscrum.story.create_story(epic.id, 'Other Story', 1, None)
+        task = noscrum.task.create_task('Report Task', story.id, '8', None, None)
+        moved = noscrum.task.create_task('Moved Task', story.id, '8', None, None)
+        first_id = noscrum.work.create_work(date(2021, 1, 4), 3, 'In Progress', task.id, False).id
+        noscrum.work.create_work(date(2021, 1, 4), 2, 'In Progress', task.id, False)
+        noscrum.work.create_work(date(2021, 3, 1), 1, 'In Progress', task.id, False)
+        noscrum.work.create_work(date(2021, 1, 5), 4, 'In Progress', moved.id, False)
+        noscrum.work.delete_work(first_id)
+        noscrum.task.update_task(moved.id, None, other_story.id, None, None, None, None, None, None)
+        noscrum.story.update_story(other_story.id, 'Other Story', other_epic.id, 1, None)
+        expected = [('2021-01-04', task.id, story.id, epic.id, 2),
+                    ('2021-01-05', moved.id, other_story.id, other_epic.id, 4),
+                    ('2021-03-01', task.id, story.id, epic.id, 1)]
+        self.assertEqual(self.get_work_days(), expected)
+        self.assertEqual(rebuild_work_days(get_db()), 3)
+        self.assertEqual(self.get_work_days(), expected)
+
+        response = self.client.get(url_for('work.list_for_dates', start_date='2021-01-01',
+                                           end_date='2021-01-31', is_json=True))
+        self.assert200(response)
+        found = [(x['task_id'], x['hours']) for x in json.loads(response.data)['work_days']]
+        self.assertEqual(found, [(task.id, 2), (moved.id, 4)])
+        response = self.client.get(url_for('work.list_for_dates', start_date='2021-01-01',
+                                           end_date='2021-12-31', epic_id=epic.id))
+        self.assert200(response)
+        self.assertIn(b'Report Task (3 hours)', response.data)
+        self.assertNotIn(b'Moved Task', response.data)
+
+
+if __name__ == '__main__':
+    unittest.main()